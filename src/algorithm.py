@@ -2,7 +2,19 @@
 # 関数（アルゴリズム系）
 ##############################
 
-import pandas as pd
+
+# パラメータの基本値
+DEFAULT_PARAMS = {
+    'duration': 20,  # ボリンジャーバンドの期間
+    'sigma': 2,  # σの値
+    'fast': 12,  # MACDの短期EMA
+    'slow': 26,  # MACDの長期EMA
+    'signal': 9,  # MACDのシグナル
+    'rsi_duration': 14,  # RSIの期間
+    'rsi_buy': 30,  # RSIの買いの閾値
+    'rsi_sell': 70,  # RSIの売りの閾値
+    'loss_cut': 0.01  # ロスカット・一時停止の損失率
+}
 
 
 def create_result(buy_flg, sell_flg):
@@ -17,6 +29,94 @@ def create_result(buy_flg, sell_flg):
     }
 
 
+##############################
+# 売買ルール
+# 値（float）でも系列（numpy.ndarray）でも同じ式で判定できるように、比較は&で結合する
+##############################
+
+def difference_rule(prev_diff, diff):
+    """
+    上昇下降トレンドによる判定
+
+    :rtype: object
+    """
+    # 下降→上昇
+    buy_flg = (prev_diff < 0) & (diff > 0)
+    # 上昇→下降
+    sell_flg = (prev_diff > 0) & (diff < 0)
+    return create_result(buy_flg, sell_flg)
+
+
+def bollinger_bands_rule(close, lower, upper):
+    """
+    ボリンジャーバンドによる判定
+
+    :rtype: object
+    """
+    # 最新の値段が±xσ区間を超えているか判定
+    buy_flg = close < lower
+    sell_flg = close > upper
+    return create_result(buy_flg, sell_flg)
+
+
+def macd_rule(prev_histogram, histogram):
+    """
+    MACDによる判定
+
+    :rtype: object
+    """
+    # ヒストグラムが負から正になったとき（MACDがシグナルを下から上に抜けるとき）
+    buy_flg = (prev_histogram < 0) & (histogram > 0)
+    # ヒストグラムが正の状態で減少したとき
+    sell_flg = (prev_histogram > 0) & (prev_histogram > histogram)
+    return create_result(buy_flg, sell_flg)
+
+
+def hybrid_rule(close, lower, prev_histogram, histogram):
+    """
+    ボリンジャーバンドとMACDによる判定
+
+    :rtype: object
+    """
+    # 最新の値段が-xσを下回ったとき
+    buy_flg = close < lower
+    # ヒストグラムが減少したとき（ヒストグラムがプラス状態であるときのみ）
+    sell_flg = macd_rule(prev_histogram, histogram)['sell_flg']
+    return create_result(buy_flg, sell_flg)
+
+
+def rsi_rule(rsi, buy_threshold=DEFAULT_PARAMS['rsi_buy'], sell_threshold=DEFAULT_PARAMS['rsi_sell']):
+    """
+    RSIによる判定
+
+    :rtype: object
+    """
+    # RSIが30を下回ったとき
+    buy_flg = rsi < buy_threshold
+    # RSIが70を上回ったとき
+    sell_flg = rsi > sell_threshold
+    return create_result(buy_flg, sell_flg)
+
+
+def mix_rule(results):
+    """
+    複数の判定の多数決（2つ以上）
+
+    :rtype: object
+    """
+    buy_count = 0
+    sell_count = 0
+    for result in results:
+        buy_count = buy_count + result['buy_flg'] * 1
+        sell_count = sell_count + result['sell_flg'] * 1
+    return create_result(buy_count >= 2, sell_count >= 2)
+
+
+##############################
+# pandasによる判定（逐次計算・一括計算の検証用）
+##############################
+
+
 def difference(df):
     """
     上昇下降トレンドによる判定
@@ -71,6 +171,7 @@ def macd(df):
     :rtype: object
     """
     # http://www.algo-fx-blog.com/macd-python-technical-indicators/
+    import pandas as pd
 
     macd = pd.DataFrame()
     macd['close'] = df['close']
@@ -116,6 +217,7 @@ def hybrid(df):
     # 最新の値段が±xσ区間を超えているか判定
     buy_flg = df.iloc[-1]['close'] < df.iloc[-1]['-' + str(sigma) + 'σ']
 
+    import pandas as pd
     macd = pd.DataFrame()
     macd['close'] = df['close']
     macd['ema_12'] = df['close'].ewm(span=12).mean()
@@ -201,3 +303,32 @@ def mix(df):
     sell_flg = sell_flg_count >= 2
 
     return create_result(buy_flg, sell_flg)
+
+
+def loss_cut(market_buy_amount, now_amount, rate=DEFAULT_PARAMS['loss_cut']):
+    """
+    ロスカット判定（購入金額の1%を下回った場合）
+
+    :rtype: bool
+    """
+    return market_buy_amount * rate < market_buy_amount - now_amount
+
+
+def pause(market_buy_amount, profit, profits, rate=DEFAULT_PARAMS['loss_cut']):
+    """
+    売却後の一時停止判定
+
+    :param profits: 直近の取引ごとの利益（古い順、今回の利益を含む）
+    :rtype: object
+    """
+    # 1%以上の損失を出しているか
+    loss = market_buy_amount * rate + profit
+    loss_flg = loss < 0
+    # 3連続の損失か（直近4回の利益が連続で減少している）
+    recent = list(profits)[-4:]
+    down_flg = len(recent) == 4 and recent[0] > recent[1] > recent[2] > recent[3]
+    return {
+        'loss': loss,
+        'loss_flg': loss_flg,
+        'down_flg': down_flg
+    }
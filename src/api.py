@@ -2,140 +2,557 @@
 # 関数（API系）
 ##############################
 
+import datetime
 import json
+import math
 import time
-import pandas as pd
 import os
 
 import environment
 
-from retry import retry
+from book import OrderBook
+from cache import TtlCache
+from execution import LimitExecutor
+from logger import DEBUG, logger
+from metrics import registry
+from candle import COLUMNS, CandleAggregator, CandleBuffer
+from store import MarketStore
+from transactions import TransactionIndex
+from resilience import Backoff, CircuitBreaker, call, remaining
+
 from coincheck.coincheck import CoinCheck
 
-coinCheck = CoinCheck(os.environ['ACCESS_KEY'], os.environ['API_SECRET'])
+coinCheck = CoinCheck(os.environ['ACCESS_KEY'], os.environ['API_SECRET'], dict(environment.API_OPTIONS, metrics=registry))
+
+# APIレスポンスのキャッシュ
+cache = TtlCache()
+# 約定・ローソク足の保存
+store = MarketStore(environment.STORE_DIR)
+# ペアごとの板の写し
+books = {}
+# 取引履歴の索引（前回の続きから取得する）
+transaction_index = TransactionIndex(coinCheck, environment.TRANSACTIONS_PATH)
+# 公開APIの再試行の間隔と、失敗が続いた場合に呼び出しを止めるサーキットブレーカー
+backoff = Backoff(environment.BACKOFF_BASE, environment.BACKOFF_CAP)
+breaker = CircuitBreaker('public', environment.BREAKER_THRESHOLD, environment.BREAKER_COOLDOWN)
+# ペアごとの最後に取得できた取引レート
+last_prices = {}
+
+
+def collect_stats():
+    """
+    キャッシュ・コネクションプールの状態（/metrics 出力時に呼ばれる）
+
+    :rtype: list
+    """
+    samples = []
+    for endpoint, counter in cache.stats().items():
+        for key, value in counter.items():
+            samples.append(('cache_' + key, {'endpoint': endpoint}, value))
+    for key, value in coinCheck.stats().items():
+        samples.append(('pool_' + key, {}, value))
+    samples.append(('circuit_open', {'name': breaker.name}, 0 if breaker.state() == 'closed' else 1))
+    return samples
+
+
+registry.collect(collect_stats)
+
+
+def successful(response):
+    """
+    エラーのレスポンスでないか（エラーはキャッシュしない）
+
+    :rtype: bool
+    """
+    try:
+        return json.loads(response).get('success', True) is not False
+    except (ValueError, AttributeError):
+        return False
 
 
-@retry(exceptions=Exception, delay=1)
-def get_latest_trading_rate():
+def cached(endpoint, fetch, *params):
     """
-    最新の取引レートを取得する
+    エンドポイントごとの有効期間でレスポンスをキャッシュする
+
+    :rtype: str
+    """
+    return cache.get((endpoint,) + params, environment.CACHE_TTL.get(endpoint, 0), fetch, successful)
+
+
+def fetch_latest_trading_rate(pair, timeout=None):
+    """
+    最新の取引レートを1回取得する
 
     :rtype: float
     """
-    if environment.COIN == 'btc':
-        ticker = coinCheck.ticker.all()
+    if pair == 'btc_jpy':
+        ticker = cached('ticker', lambda: coinCheck.ticker.all({}, timeout))
         return json.loads(ticker)['last']
 
     params = {
-        'pair': environment.PAIR
+        'pair': pair
     }
-    trade_all = coinCheck.trade.all(params)
+    trade_all = cached('trades', lambda: coinCheck.trade.all(params, timeout), pair)
     data = json.loads(trade_all)['data']
     return float(data[0]['rate'])
 
 
-@retry(exceptions=Exception, delay=1)
-def get_rate(order_type, coin_amount, price):
+def get_latest_trading_rate(pair=None):
     """
-    レートを取得する
+    最新の取引レートを取得する（失敗した場合は間隔を空けて再試行する）
+
+    一度取得できた後はTICK_DEADLINE秒で諦めて最後に取得できたレートを返す（ローソク足を止めない）
+
+    :rtype: float
+    """
+    pair = pair or environment.PAIR
+    last = last_prices.get(pair)
+    deadline = time.monotonic() + environment.TICK_DEADLINE if last is not None else None
+    try:
+        price = call(lambda: fetch_latest_trading_rate(pair, remaining(deadline)), 'ticker', breaker, backoff,
+                     deadline=deadline)
+    except Exception as e:
+        if last is None:
+            raise
+        logger.warning('stale_price', every=environment.LOG_SAMPLE, pair=pair, error=repr(e))
+        registry.inc('stale_prices', pair=pair)
+        return last
+    last_prices[pair] = price
+    return price
+
+
+def get_rate(order_type, coin_amount, price, pair=None):
+    """
+    レートを取得する（失敗した場合はRETRY_ATTEMPTS回まで間隔を空けて再試行する）
 
     :rtype: object
     """
     if coin_amount is not None:
         params = {
             'order_type': order_type,
-            'pair': environment.PAIR,
+            'pair': pair or environment.PAIR,
             'amount': coin_amount
         }
     else:
         params = {
             'order_type': order_type,
-            'pair': environment.PAIR,
+            'pair': pair or environment.PAIR,
             'price': price
         }
-    order_rate = coinCheck.order.rate(params)
-    return json.loads(order_rate)
+
+    def fetch():
+        # エラーのレスポンスはそのまま返す（キーが無効な場合はmain.pyで判定する）
+        order_rate = cached('rate', lambda: coinCheck.order.rate(params), order_type, params['pair'], coin_amount, price)
+        return json.loads(order_rate)
+
+    return call(fetch, 'rate', breaker, backoff, attempts=environment.RETRY_ATTEMPTS)
+
+
+def get_order_book(pair=None, max_age=None):
+    """
+    板の写しを取得する（WebSocketで更新されていない場合はCACHE_TTL['order_books']秒（max_age秒）ごとに取り直す）
+
+    :rtype: OrderBook
+    """
+    pair = pair or environment.PAIR
+    book = books.get(pair)
+    if book is None:
+        book = books.setdefault(pair, OrderBook(pair))
+    if max_age is None:
+        max_age = environment.CACHE_TTL['order_books']
+    elif book.age() > max_age:
+        cache.invalidate('order_books')
+    if book.age() > max_age:
+        order_books = cached('order_books', lambda: coinCheck.order_book.all({'pair': pair}), pair)
+        book.replace(json.loads(order_books))
+    return book
+
+
+# 指値注文の執行（EXECUTION=limit）
+executor = LimitExecutor(coinCheck, get_order_book, transaction_index, environment.LIMIT_TIMEOUT,
+                         max_replaces=environment.LIMIT_REPLACES)
+
+
+def quote(order_type, coin_amount, price, pair=None):
+    """
+    板の写しから成行で約定させた場合のレートを見積もる（get_rateと同じ形式、板が足りない場合はget_rate）
+
+    :rtype: object
+    """
+    try:
+        estimate = get_order_book(pair).estimate(order_type, coin_amount, price)
+    except Exception as e:
+        logger.error('order_book_failed', error=repr(e))
+        estimate = None
+    if estimate is None or not estimate['complete']:
+        return get_rate(order_type, coin_amount, price, pair)
+    return {
+        'success': True,
+        'rate': estimate['rate'],
+        'price': estimate['price'],
+        'amount': estimate['amount']
+    }
+
+
+def round_order(order_type, size):
+    """
+    子注文の大きさを切り捨てる（成行買いの金額は円単位、売りの数量はAMOUNT_STEP単位）
+
+    :rtype: float
+    """
+    if order_type == 'buy':
+        return float(math.floor(size))
+    return round(math.floor(size / environment.AMOUNT_STEP + 1e-9) * environment.AMOUNT_STEP, 8)
+
+
+def split_order(order_type, coin_amount, price, pair=None, max_age=None):
+    """
+    スリッページがMAX_SLIPPAGE以内になるように注文を分割する（MAX_SLIPPAGEが0の場合は分割しない）
+
+    :param max_age: 板の写しをこの秒数より古ければ取り直す（省略した場合はCACHE_TTL['order_books']）
+    :rtype: list 数量（成行買いの場合は金額）のリスト
+    """
+    total = coin_amount if coin_amount is not None else price
+    if environment.MAX_SLIPPAGE <= 0:
+        return [total]
+    try:
+        book = get_order_book(pair, max_age)
+    except Exception as e:
+        logger.error('order_book_failed', error=repr(e))
+        return [total]
+    estimate = book.estimate(order_type, coin_amount, price)
+    if estimate is not None:
+        registry.observe('estimated_slippage', estimate['slippage'], side=order_type)
+    children = book.split(order_type, coin_amount, price, environment.MAX_SLIPPAGE)
+    if len(children) > 1:
+        # 端数は最後の注文に寄せる
+        size = round_order(order_type, children[0])
+        children = [size] * (len(children) - 1) + [total - size * (len(children) - 1)]
+        logger.info('split_order', order_type=order_type, children=children, slippage=estimate and estimate['slippage'])
+    return children
+
+
+def print_sampling(sec, candle):
+    """
+    価格取得中の状態を表示する（DEBUGレベル、LOG_SAMPLE秒に1回）
+    """
+    # 無効な場合は何も組み立てない
+    if not logger.enabled(DEBUG):
+        return
+    var = {
+        'profit': environment.profit,
+        'market_buy_amount': environment.market_buy_amount,
+        'order_id': environment.order_id,
+        'COIN': environment.COIN,
+        'PAIR': environment.PAIR,
+        'ALGORITHM': environment.ALGORITHM,
+        'AMOUNT': environment.AMOUNT
+    }
+    # ログは別スレッドで書き出すので、次の取得で更新される前の値を写しておく
+    logger.debug('sampling', every=environment.LOG_SAMPLE, sec=sec, var=var, candle=dict(candle))
 
 
 def get_candle_stick():
     """
     1分間のローソク足を算出する
 
+    1秒ごとに価格を取得し、壁時計のINTERVAL秒の境界で区切る（runtime.sample_candlesと同じ）。
+    境界より遅れて呼ばれた場合はその区間の残りだけ取得し、保存するローソク足の時刻を境界に揃える
+    （取得・取引にかかった時間がずれとして溜まり、再起動時に途切れていると判定されないようにする）
+
     :rtype: object
     """
     candle = {}
-    for sec in range(1, environment.INTERVAL + 1):
+    interval = environment.INTERVAL
+    wall = time.time()
+    # 呼ばれた時刻を含む区間（境界の直前の場合は次の区間）
+    boundary = (wall + 0.5) // interval * interval
+    # 壁時計の境界を単調時計に換算する
+    start = time.monotonic() + boundary - wall
+    sec = max(0, int(wall - boundary))
+    while sec < interval:
+        # 取得が1秒以内に終わらなかった場合は遅れを次の取得に持ち越さない
+        sec = min(interval, max(sec + 1, int(time.monotonic() - start) + 1))
         price = get_latest_trading_rate()
+        store.append_tick(environment.PAIR, time.time(), price)
 
-        if sec == 1:
-            candle['open'] = price
-            candle['high'] = price
-            candle['low'] = price
-        elif sec == environment.INTERVAL:
-            candle['close'] = price
-
-        if sec != 1:
-            candle['high'] = price if price > candle['high'] else candle['high']
-            candle['low'] = price if price < candle['low'] else candle['low']
-
-        var = {
-            'profit': environment.profit,
-            'market_buy_amount': environment.market_buy_amount,
-            'order_id': environment.order_id,
-            'COIN': environment.COIN,
-            'PAIR': environment.PAIR,
-            'ALGORITHM': environment.ALGORITHM,
-            'AMOUNT': environment.AMOUNT
-        }
-        print(str(sec).zfill(2) + 'sec... var: ' + str(var) + ' candle: ' + str(candle))
-        time.sleep(1)
+        if not candle:
+            candle = {'open': price, 'high': price, 'low': price}
+        candle['high'] = price if price > candle['high'] else candle['high']
+        candle['low'] = price if price < candle['low'] else candle['low']
+        candle['close'] = price
+
+        print_sampling(sec, candle)
+        time.sleep(max(0.0, start + sec - time.monotonic()))
+    store.append_candle(environment.PAIR, interval, candle, boundary)
     return candle
 
 
-def data_collecting(how_many_samples=25):
+def data_collecting(how_many_samples=25, capacity=None):
     """
     初めの数回は取引をせずに価格データを集める
 
-    :rtype: price_list
+    :rtype: CandleBuffer
     """
-    print('Collecting data... (' + str(how_many_samples * environment.INTERVAL) + ' sec)')
-    df = pd.DataFrame()
+    logger.info('collecting', seconds=how_many_samples * environment.INTERVAL)
+    candles = CandleBuffer(capacity or how_many_samples)
     for i in range(1, how_many_samples + 1):
-        candle = get_candle_stick()
-        df = df.append({'open': candle['open'], 'high': candle['high'], 'low': candle['low'], 'close': candle['close'], }, ignore_index=True)
-        print(str(i) + '/' + str(how_many_samples) + ' finish.')
-    print('Collection is complete!')
-    return df
+        candles.append(get_candle_stick())
+        logger.info('collected', count=i, total=how_many_samples)
+    logger.info('collection_complete')
+    return candles
+
+
+def warm_start(how_many_samples=25, capacity=None, pair=None, interval=None, force=False):
+    """
+    保存済みのローソク足（BOOTSTRAPの場合は取引履歴）からサンプルデータを作る（作れない場合はNone）
+
+    :param force: BOOTSTRAPを指定していなくても取引履歴から作る（ポジションを持ったまま再開する場合など）
+    :rtype: CandleBuffer
+    """
+    candles = load_stored(how_many_samples, capacity, pair, interval)
+    if candles is None and (environment.bootstrap or force):
+        candles = bootstrap(how_many_samples, capacity, pair, interval)
+    return candles
+
+
+def load_stored(how_many_samples=25, capacity=None, pair=None, interval=None):
+    """
+    保存済みのローソク足からサンプルデータを作る（直近の分が途切れずに揃っていない場合はNone）
+
+    :rtype: CandleBuffer
+    """
+    pair = pair or environment.PAIR
+    interval = interval or environment.INTERVAL
+    recent = store.recent_candles(pair, interval, how_many_samples)
+    if len(recent) < how_many_samples:
+        return None
+    # 停止していた間のローソク足が抜けている場合は使わない
+    times = recent['time']
+    if time.time() - times[-1] > interval * 2 or (len(times) > 1 and (times[1:] - times[:-1]).max() > interval * 1.5):
+        return None
+
+    candles = CandleBuffer(capacity or how_many_samples)
+    for record in recent:
+        candles.append({column: float(record[column]) for column in COLUMNS})
+    logger.info('warm_start', store=environment.STORE_DIR, candles=how_many_samples)
+    return candles
+
+
+def parse_time(created_at):
+    """
+    取引履歴の時刻（"2015-01-10T05:55:38.000Z"）をUNIX時間にする
+
+    :rtype: float
+    """
+    return datetime.datetime.fromisoformat(created_at.replace('Z', '+00:00')).timestamp()
+
+
+def get_trades_since(since, pair=None, limit=100):
+    """
+    since以降の全取引履歴を新しい順にページを遡って取得する（sinceより古い取引に達したら止める）
+
+    :rtype: list (時刻, レート, 数量)の古い順のリスト
+    """
+    trades = []
+    params = {
+        'pair': pair or environment.PAIR,
+        'limit': limit,
+        'order': 'desc'
+    }
+    while True:
+        response = json.loads(coinCheck.trade.all(params))
+        if not response.get('success', True):
+            logger.error('trades_failed', response=response)
+            return None
+        data = response['data']
+        for trade in data:
+            timestamp = parse_time(trade['created_at'])
+            if timestamp < since:
+                return trades[::-1]
+            trades.append((timestamp, float(trade['rate']), float(trade['amount'])))
+        if len(data) < limit:
+            return trades[::-1]
+        # 次のページ（より古い取引）
+        params['starting_after'] = data[-1]['id']
+
+
+def bootstrap(how_many_samples=25, capacity=None, pair=None, interval=None):
+    """
+    取引履歴からINTERVALごとのローソク足を作り直してサンプルデータにする（取引履歴が足りない場合はNone）
+
+    :rtype: CandleBuffer
+    """
+    pair = pair or environment.PAIR
+    interval = interval or environment.INTERVAL
+    now = time.time()
+    # 最初のローソク足の区間の先頭から取得する
+    since = (now // interval - how_many_samples) * interval
+    try:
+        trades = get_trades_since(since, pair)
+    except Exception as e:
+        logger.error('bootstrap_failed', error=repr(e))
+        return None
+    if not trades:
+        return None
+
+    aggregator = CandleAggregator(interval)
+    aggregator.flush(since)
+    completed = []
+    for timestamp, rate, amount in trades:
+        completed += aggregator.add(timestamp, rate, amount)
+    completed += aggregator.flush(now)
+    if len(completed) < how_many_samples:
+        return None
+
+    candles = CandleBuffer(capacity or how_many_samples)
+    candles.extend(completed[-how_many_samples:])
+    logger.info('bootstrap', trades=len(trades), candles=how_many_samples)
+    return candles
+
+
+def create_split(order_type, total, create, pair=None):
+    """
+    分割した子注文を1つずつ出す（成行、totalは買いの場合は金額、売りの場合は数量）
+
+    子注文の間はSPLIT_DELAY秒待って板が回復してから取り直し、残りを分割し直す。
+    SPLIT_MAX_CHILDREN個目でも分割が必要な場合、買いは残りを諦め、売りはポジションを残さないよう残りをまとめて出す
+
+    :rtype: list 出した注文
+    """
+    orders = []
+    remaining = total
+    max_age = None
+    while True:
+        if order_type == 'buy':
+            children = split_order(order_type, None, remaining, pair, max_age)
+        else:
+            children = split_order(order_type, remaining, None, pair, max_age)
+        last = len(children) == 1
+        child = children[0]
+        if not last and order_type == 'sell' and len(orders) + 1 >= environment.SPLIT_MAX_CHILDREN:
+            logger.warning('split_limit', order_type=order_type, children=len(orders) + 1, remaining=remaining)
+            child = remaining
+            last = True
+        order = create(child, pair)
+        if order is None:
+            break
+        orders.append(order)
+        remaining -= child
+        if last or remaining <= 0:
+            break
+        if len(orders) >= environment.SPLIT_MAX_CHILDREN:
+            logger.warning('split_limit', order_type=order_type, children=len(orders), remaining=remaining)
+            break
+        time.sleep(environment.SPLIT_DELAY)
+        # 待っている間に更新されていない板は取り直す
+        max_age = environment.SPLIT_DELAY
+    return orders
+
+
+def combine_orders(orders, key):
+    """
+    分割した注文の結果をまとめる（idは最初の注文、idsはすべての注文）
+
+    :rtype: object
+    """
+    if len(orders) == 0:
+        return None
+    if len(orders) == 1:
+        return orders[0]
+    return dict(orders[0], ids=[order['id'] for order in orders], **{key: sum(float(order[key]) for order in orders)})
 
 
-def buy(market_buy_amount):
+def buy(market_buy_amount, pair=None):
     """
-    指定した金額で買い注文を入れる（成行）
+    指定した金額で買い注文を入れる（成行、MAX_SLIPPAGEを指定した場合は分割する、EXECUTION=limitの場合は指値）
+
+    :rtype: object
+    """
+    if environment.EXECUTION == 'limit':
+        return limit_buy(market_buy_amount, pair)
+    return combine_orders(create_split('buy', market_buy_amount, create_market_buy, pair), 'market_buy_amount')
+
+
+def create_market_buy(market_buy_amount, pair=None):
+    """
+    指定した金額で買い注文を1つ入れる（成行）
 
     :rtype: object
     """
     params = {
-        'pair': environment.PAIR,
+        'pair': pair or environment.PAIR,
         'order_type': 'market_buy',
         'market_buy_amount': market_buy_amount,  # 量ではなく金額
     }
     order = coinCheck.order.create(params)
+    # 注文後は残高が変わる
+    cache.invalidate('balance')
     order_create_json = json.loads(order)
 
     if order_create_json['success']:
         return order_create_json
     else:
-        print(order)
+        logger.error('order_failed', response=order_create_json)
         return None
 
 
+def limit_buy(market_buy_amount, pair=None):
+    """
+    指定した金額分を指値で買う（約定しなかった分は買わない）
+
+    :rtype: object
+    """
+    pair = pair or environment.PAIR
+    result = executor.execute(pair, 'buy', funds=market_buy_amount)
+    cache.invalidate('balance')
+    if result['amount'] <= 0:
+        logger.warning('limit_buy_unfilled', ids=result['ids'])
+        return None
+    # 最初のpost onlyの注文は約定せずに取り消されることがあるので、約定した最初の注文をidにする
+    filled_ids = [order_id for order_id in result['ids'] if executor.table.get(order_id)['filled'] > 0]
+    return {
+        'success': True,
+        'id': filled_ids[0],
+        'ids': result['ids'],
+        'market_buy_amount': result['price'],
+        'amount': result['amount']
+    }
+
+
+def limit_sell(coin_amount, pair=None):
+    """
+    指定した量を指値で売る（約定しなかった分は成行で売る）
+
+    :rtype: object
+    """
+    pair = pair or environment.PAIR
+    result = executor.execute(pair, 'sell', amount=coin_amount)
+    ids = result['ids']
+    remaining = coin_amount - result['amount']
+    if remaining > 1e-8:
+        logger.warning('limit_sell_fallback', ids=ids, remaining=remaining)
+        order = create_market_sell(remaining, pair)
+        if order is None and result['amount'] <= 0:
+            return None
+        if order is not None:
+            ids = ids + [order['id']]
+    cache.invalidate('balance')
+    return {
+        'success': True,
+        'id': ids[0],
+        'ids': ids,
+        'amount': coin_amount
+    }
+
+
 def simulation_buy(market_buy_amount):
     """
     シミュレーション：指定した金額で買い注文を入れる（成行）
 
     :rtype: object
     """
-    order_rate = get_rate('buy', None, market_buy_amount)
+    order_rate = quote('buy', None, market_buy_amount)
     return {
         'id': 'simulation',
         'market_buy_amount': market_buy_amount,
@@ -145,29 +562,124 @@ def simulation_buy(market_buy_amount):
 
 def sell(order_id):
     """
-    購入した量で売り注文を入れる（成行）
+    購入した量で売り注文を入れる（成行、分割した注文のIDのリストの場合はいずれかが約定していれば）
 
     :rtype: object
     """
-    transactions = coinCheck.order.transactions()
-    for transaction in json.loads(transactions)['transactions']:
-        if order_id == transaction['order_id']:
-            # TODO 買い注文が2つに分かれてるときがあるので一旦、全額売却にしておく
-            # coin_amount = transaction['funds'][COIN]
-            coin_amount = get_status()[environment.COIN]
-            params = {
-                'pair': environment.PAIR,
-                'order_type': 'market_sell',
-                'amount': coin_amount,
-            }
-            order = coinCheck.order.create(params)
-            order_create_json = json.loads(order)
+    order_ids = order_id if isinstance(order_id, list) else [order_id]
+    transaction_index.sync()
+    if transaction_index.fills(order_ids)['count'] > 0:
+        # TODO 買い注文が2つに分かれてるときがあるので一旦、全額売却にしておく
+        # coin_amount = transaction['funds'][COIN]
+        coin_amount = get_status()[environment.COIN]
+        return market_sell(coin_amount)
+
+
+def market_sell(coin_amount, pair=None):
+    """
+    指定した量で売り注文を入れる（成行、MAX_SLIPPAGEを指定した場合は分割する）
 
-            if order_create_json['success']:
-                return order_create_json
-            else:
-                print(order)
-                return None
+    :rtype: object
+    """
+    if environment.EXECUTION == 'limit':
+        return limit_sell(coin_amount, pair)
+    return combine_orders(create_split('sell', coin_amount, create_market_sell, pair), 'amount')
+
+
+def create_market_sell(coin_amount, pair=None):
+    """
+    指定した量で売り注文を1つ入れる（成行）
+
+    :rtype: object
+    """
+    params = {
+        'pair': pair or environment.PAIR,
+        'order_type': 'market_sell',
+        'amount': coin_amount,
+    }
+    order = coinCheck.order.create(params)
+    # 注文後は残高が変わる
+    cache.invalidate('balance')
+    order_create_json = json.loads(order)
+
+    if order_create_json['success']:
+        return order_create_json
+    else:
+        logger.error('order_failed', response=order_create_json)
+        return None
+
+
+def get_bought_amount(order_id, coin):
+    """
+    買い注文で約定した量（約定が分かれている場合・分割した注文のIDのリストの場合は合計）
+
+    :rtype: float
+    """
+    order_ids = order_id if isinstance(order_id, list) else [order_id]
+    transaction_index.sync()
+    return transaction_index.bought_amount(order_ids)
+
+
+def get_fills(order_id, amount=None, timeout=1.0, delay=0.2):
+    """
+    注文の約定の合計（数量・金額・手数料、IDのリストの場合は合計）
+
+    約定が取引履歴に反映されるまで最大timeout秒待って取り直す（amountを指定した場合はその数量が揃うまで）
+
+    :rtype: object
+    """
+    order_ids = order_id if isinstance(order_id, list) else [order_id]
+    deadline = time.monotonic() + timeout
+    while True:
+        transaction_index.sync()
+        fills = transaction_index.fills(order_ids)
+        if fills['count'] > 0 and (amount is None or fills['amount'] >= amount * (1 - 1e-6)):
+            return fills
+        if time.monotonic() + delay > deadline:
+            return fills
+        time.sleep(delay)
+
+
+def get_sell_fills(order_json, pair=None):
+    """
+    売り注文の約定の合計（売った数量の約定が揃うまでFILL_TIMEOUT秒待つ）
+
+    揃わなかった分は見積もった金額で補う（売却額0で全額を損失として記録しない）
+
+    :rtype: object
+    """
+    amount = float(order_json['amount'])
+    fills = get_fills(order_json.get('ids', order_json['id']), amount, environment.FILL_TIMEOUT)
+    missing = amount - fills['amount']
+    if missing <= 1e-8:
+        return fills
+    try:
+        proceeds = float(quote('sell', missing, None, pair)['price'])
+    except Exception:
+        proceeds = missing * float(get_latest_trading_rate(pair))
+    logger.warning('fills_estimated', order_id=order_json['id'], count=fills['count'], missing=missing,
+                   proceeds=proceeds)
+    registry.inc('fills_estimated')
+    return dict(fills, amount=amount, jpy=fills['jpy'] + proceeds)
+
+
+def book_buy_fills(ledger, order_id, market_buy_amount, amount=None):
+    """
+    買い注文の約定を損益に記録する（約定が揃うまでFILL_TIMEOUT秒待つ）
+
+    約定が見つからない場合は記録せず、売る前にもう一度呼ぶ（取得金額0で売却を記録しない）
+    売った数量amountを指定した場合は、それでも見つからなければ購入金額でその数量を買ったことにする
+
+    :rtype: bool 記録した場合True
+    """
+    fills = get_fills(order_id, timeout=environment.FILL_TIMEOUT)
+    if fills['count'] == 0:
+        logger.warning('buy_fills_missing', order_id=order_id, amount=amount)
+        if amount is None:
+            return False
+        fills = {'amount': amount, 'jpy': market_buy_amount, 'fee': 0.0}
+    ledger.buy(fills['amount'], fills['jpy'] or market_buy_amount, fills['fee'])
+    return True
 
 
 def simulation_sell():
@@ -176,11 +688,22 @@ def simulation_sell():
 
     :rtype: object
     """
+    order_rate = quote('sell', environment.simulation_coin, None)
     return {
-        'amount': environment.simulation_coin
+        'amount': environment.simulation_coin,
+        'price': float(order_rate['price'])
     }
 
 
+def get_balance():
+    """
+    残高を取得する（署名が必要なAPIなので、失敗した場合はAPIキーが無効）
+
+    :rtype: object
+    """
+    return json.loads(cached('balance', coinCheck.account.balance))
+
+
 def get_status():
     """
     現在の状態を取得する
@@ -194,7 +717,7 @@ def get_status():
             environment.COIN: environment.simulation_coin,  # COIN
         }
 
-    account_balance = coinCheck.account.balance()
+    account_balance = cached('balance', coinCheck.account.balance)
     account_balance_json = json.loads(account_balance)
     if account_balance_json['success']:
         return {
@@ -225,7 +748,7 @@ def sleep(hour):
     """
     interval = environment.INTERVAL * hour
     for minute in range(0, interval):
-        print(str(minute) + '/' + str(interval) + ' minutes passed...')
+        logger.info('paused', minutes=minute, total=interval)
         for sec in range(1, environment.INTERVAL + 1):
-            print(str(sec).zfill(2) + 'sec...')
+            logger.debug('paused_sec', every=environment.LOG_SAMPLE, sec=sec)
             time.sleep(1)
@@ -0,0 +1,285 @@
+##############################
+# バックテスト
+##############################
+
+import argparse
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+from algorithm import loss_cut, pause
+from indicator import IndicatorEngine, signals
+
+# アルゴリズム一覧
+ALGORITHMS = ['DIFFERENCE', 'BOLLINGER_BANDS', 'MACD', 'HYBRID', 'RSI', 'MIX']
+# 一時停止から再開した後に最初に売買判定を計算する本数
+RESUME_CANDLES = 1024
+
+
+def read_table(path):
+    """
+    CSV/Parquetを読み込む
+
+    :rtype: pandas.DataFrame
+    """
+    import pandas as pd
+    if path.endswith('.parquet') or path.endswith('.pq'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+def to_epoch_seconds(values):
+    """
+    時刻の列をUNIX時間（秒）に変換する
+
+    :rtype: numpy.ndarray
+    """
+    import pandas as pd
+    if np.issubdtype(values.dtype, np.number):
+        seconds = values.to_numpy(dtype=np.float64)
+        # ミリ秒で記録されている場合
+        if len(seconds) > 0 and seconds[0] > 1e11:
+            seconds = seconds / 1000.0
+        return seconds
+    return pd.to_datetime(values, utc=True).astype('int64').to_numpy() / 1e9
+
+
+def aggregate_trades(timestamps, rates, interval, amounts=None):
+    """
+    約定履歴をinterval秒ごとのローソク足に集計する
+
+    約定がなかった区間は直前の終値で出来高0のローソク足にする（main.py・CandleAggregatorと同じくINTERVALごとに1本）
+
+    :rtype: object
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    rates = np.asarray(rates, dtype=np.float64)
+    amounts = np.zeros(len(rates)) if amounts is None else np.asarray(amounts, dtype=np.float64)
+    if len(rates) == 0:
+        return {column: np.empty(0) for column in ['time', 'open', 'high', 'low', 'close', 'volume']}
+    order = np.argsort(timestamps, kind='stable')
+    timestamps = timestamps[order]
+    rates = rates[order]
+    amounts = amounts[order]
+    buckets = np.floor(timestamps / interval).astype(np.int64)
+    # 各ローソク足の先頭・末尾のインデックス
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(rates)] - 1
+
+    # 最初から最後までの区間のうち約定があったもの
+    first = buckets[0]
+    traded = np.zeros(buckets[-1] - first + 1, dtype=bool)
+    traded[buckets[starts] - first] = True
+    # 各区間に対応する（なければ直前の）約定のあった区間
+    index = np.cumsum(traded) - 1
+    close = rates[ends][index]
+    return {
+        'time': (first + np.arange(len(traded))) * interval,
+        'open': np.where(traded, rates[starts][index], close),
+        'high': np.where(traded, np.maximum.reduceat(rates, starts)[index], close),
+        'low': np.where(traded, np.minimum.reduceat(rates, starts)[index], close),
+        'close': close,
+        'volume': np.where(traded, np.add.reduceat(amounts, starts)[index], 0.0)
+    }
+
+
+def to_candles(df, interval):
+    """
+    ローソク足（open/high/low/close列）または約定履歴（時刻・rate列）の表からローソク足を作る
+
+    :rtype: object
+    """
+    columns = [column.lower() for column in df.columns]
+    df.columns = columns
+
+    if all(column in columns for column in ['open', 'high', 'low', 'close']):
+        candles = {column: df[column].to_numpy(dtype=np.float64) for column in ['open', 'high', 'low', 'close']}
+        for column in ['time', 'timestamp', 'created_at']:
+            if column in columns:
+                candles['time'] = to_epoch_seconds(df[column])
+                break
+        return candles
+
+    time_column = next(column for column in ['created_at', 'timestamp', 'time', 'date'] if column in columns)
+    rate_column = next(column for column in ['rate', 'price', 'last'] if column in columns)
+    amount_column = next((column for column in ['amount', 'size', 'volume'] if column in columns), None)
+    amounts = df[amount_column].to_numpy(dtype=np.float64) if amount_column is not None else None
+    return aggregate_trades(to_epoch_seconds(df[time_column]), df[rate_column].to_numpy(dtype=np.float64), interval, amounts)
+
+
+def load_store(root, pair, interval):
+    """
+    保存済みのローソク足（なければ約定）を読み込む（store.MarketStore）
+
+    :rtype: object
+    """
+    from store import MarketStore
+    store = MarketStore(root)
+    records = store.candles(pair, interval)
+    if len(records) > 0:
+        return {column: records[column] for column in ['time', 'open', 'high', 'low', 'close']}
+    ticks = store.ticks(pair)
+    return aggregate_trades(ticks['time'], ticks['rate'], interval, ticks['amount'])
+
+
+def load_candles(path, interval, pair='btc_jpy'):
+    """
+    CSV/Parquetファイル、または約定・ローソク足の保存先ディレクトリからローソク足を作る
+
+    :rtype: object
+    """
+    if os.path.isdir(path):
+        return load_store(path, pair, interval)
+    return to_candles(read_table(path), interval)
+
+
+def warmup_size(algorithm):
+    """
+    取引開始までに集めるローソク足の本数（main.pyと同じ）
+
+    :rtype: int
+    """
+    return 2 if algorithm == 'DIFFERENCE' else 25
+
+
+def run(candles, algorithm, interval, amount=100000.0, fee=0.0, pause_hours=5, initial_profit=0.0, params=None, vectorized=True):
+    """
+    main.pyと同じ売買・ロスカット・一時停止の判定でローソク足を再生する
+
+    :param params: インジケーター・ロスカットのパラメータ（algorithm.DEFAULT_PARAMSを上書き）
+    :param vectorized: 売買判定を系列全体で一括計算する（一時停止した場合は再開した位置から計算し直す）
+                       （Falseの場合はローソク足ごとにIndicatorEngineで判定する）
+    :param fee: 約定ごとの手数料・スリッページ（割合）
+    :param pause_hours: 一時停止の時間（0の場合は停止しない）
+    :rtype: object
+    """
+    close = np.asarray(candles['close'], dtype=np.float64)
+    closes = close.tolist()
+    length = len(closes)
+    warmup = warmup_size(algorithm)
+    # main.pyのsleep(hour)はINTERVAL * hour本分のローソク足を待つ
+    pause_candles = interval * pause_hours
+
+    engine = IndicatorEngine(params, verbose=False)
+    rate = engine.params['loss_cut']
+
+    def flags_from(start, end):
+        flags = signals(algorithm, close[start:end], engine.params)
+        return flags['buy_flg'].tolist(), flags['sell_flg'].tolist()
+
+    # 売買判定を計算した先頭の位置（一時停止後はmain.pyと同じくそこからインジケーターを作り直す）
+    base = 0
+    if vectorized:
+        buy_flgs, sell_flgs = flags_from(0, length)
+    # 直近の利益（ledger.Ledgerと同じく3件で初期化）
+    profits = deque([initial_profit] * 3, maxlen=4)
+
+    coin = 0.0
+    market_buy_amount = 0.0
+    holding = False
+    total_profit = 0.0
+    peak = 0.0
+    max_drawdown = 0.0
+    trades = 0
+    wins = 0
+    pauses = 0
+
+    i = 0
+    collected = 0
+    while i < length:
+        price = closes[i]
+        if vectorized:
+            # 判定は過去の値だけで決まるので、再開後は計算する範囲を倍ずつ広げる
+            if i - base >= len(buy_flgs):
+                buy_flgs, sell_flgs = flags_from(base, base + 2 * len(buy_flgs))
+            buy_flg = buy_flgs[i - base]
+            sell_flg = sell_flgs[i - base]
+        else:
+            engine.update(price)
+        i += 1
+
+        # サンプルデータ収集中は取引しない
+        if collected < warmup:
+            collected += 1
+            continue
+
+        if not vectorized:
+            result = engine.judge(algorithm)
+            buy_flg = result['buy_flg']
+            sell_flg = result['sell_flg']
+        now_amount = price * coin
+        loss_cut_flg = loss_cut(market_buy_amount, now_amount, rate)
+
+        if not holding and buy_flg:
+            coin = amount * (1.0 - fee) / price
+            market_buy_amount = amount
+            holding = True
+        elif holding and (sell_flg or loss_cut_flg):
+            profit = now_amount * (1.0 - fee) - market_buy_amount
+            total_profit += profit
+            profits.append(profit)
+            trades += 1
+            wins += 1 if profit > 0 else 0
+            pause_result = pause(market_buy_amount, profit, profits, rate)
+            coin = 0.0
+            market_buy_amount = 0.0
+            holding = False
+
+            if pause_hours > 0 and (pause_result['loss_flg'] or pause_result['down_flg']):
+                pauses += 1
+                i += pause_candles
+                profits = deque([profit] * 3, maxlen=4)
+                # サンプルデータ作り直し
+                engine = IndicatorEngine(params, verbose=False)
+                collected = 0
+                if vectorized:
+                    base = i
+                    buy_flgs, sell_flgs = flags_from(base, base + RESUME_CANDLES)
+
+        # 含み損益を含めた資産の推移からドローダウンを求める
+        equity = total_profit + (price * coin - market_buy_amount if holding else 0.0)
+        peak = max(peak, equity)
+        max_drawdown = max(max_drawdown, peak - equity)
+
+    return {
+        'algorithm': algorithm,
+        'interval': interval,
+        'candles': length,
+        'profit': total_profit,
+        'max_drawdown': max_drawdown,
+        'trades': trades,
+        'win_rate': wins / trades if trades > 0 else 0.0,
+        'pauses': pauses,
+        'holding': holding
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ローソク足・約定履歴ファイルでアルゴリズムを検証する')
+    parser.add_argument('path', help='CSV/Parquetファイル、または約定・ローソク足の保存先（STORE_DIR）')
+    parser.add_argument('--pair', default=(os.getenv('COIN') or 'btc') + '_jpy', help='保存先から読み込むペア')
+    parser.add_argument('--algorithm', default=os.getenv('ALGORITHM', 'DIFFERENCE'), choices=ALGORITHMS + ['ALL'])
+    parser.add_argument('--interval', type=int, default=int(os.getenv('INTERVAL', '60')))
+    parser.add_argument('--amount', type=float, default=float(os.getenv('AMOUNT') or 100000))
+    parser.add_argument('--fee', type=float, default=0.0)
+    parser.add_argument('--pause-hours', type=int, default=5)
+    parser.add_argument('--streaming', action='store_true', help='ローソク足ごとに逐次判定する（main.pyと同じ）')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    candles = load_candles(args.path, args.interval, args.pair)
+    print('Loaded ' + str(len(candles['close'])) + ' candles (' + str(round(time.perf_counter() - start, 3)) + ' sec)')
+
+    algorithms = ALGORITHMS if args.algorithm == 'ALL' else [args.algorithm]
+    for algorithm in algorithms:
+        start = time.perf_counter()
+        result = run(candles, algorithm, args.interval, args.amount, args.fee, args.pause_hours,
+                     vectorized=not args.streaming)
+        result['elapsed'] = round(time.perf_counter() - start, 3)
+        print(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+##############################
+# 起動・処理時間の計測
+##############################
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+# 起動時に読み込むモジュール（main.pyの起動経路）
+MODULES = ['environment', 'algorithm', 'indicator', 'dynamodb', 'coincheck.coincheck', 'api', 'runtime']
+
+
+def import_time(module, repeat=5):
+    """
+    新しいプロセスでモジュールを読み込む時間（-X importtime）
+
+    :rtype: object 読み込み時間の中央値（秒）と、時間のかかった依存モジュール
+    """
+    # api.pyはAPIキーがないと読み込めないので仮の値を入れる
+    env = dict(os.environ, ACCESS_KEY=os.getenv('ACCESS_KEY') or 'benchmark', API_SECRET=os.getenv('API_SECRET') or 'benchmark')
+    here = os.path.dirname(os.path.abspath(__file__))
+    totals = []
+    heaviest = {}
+    for i in range(repeat):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                                cwd=here, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(module + ': ' + result.stderr.strip().splitlines()[-1])
+        # import time: self [us] | cumulative | imported package（依存は先に、深さごとに2文字ずつ字下げして出力される）
+        children = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            if depth == 0:
+                if name.strip() == module:
+                    totals.append(int(cumulative_us) / 1e6)
+                    for child, seconds in children.items():
+                        heaviest[child] = max(heaviest.get(child, 0), seconds)
+                children = {}
+            elif depth == 1:
+                children[name.strip()] = int(cumulative_us) / 1e6
+    return {
+        'seconds': statistics.median(totals),
+        'heaviest': sorted(heaviest.items(), key=lambda item: -item[1])[:5]
+    }
+
+
+def imports(modules=MODULES, repeat=5, limit=None):
+    """
+    モジュールごとの読み込み時間を表示する（limit秒を超えたものがあればFalse）
+
+    :rtype: bool
+    """
+    ok = True
+    for module in modules:
+        result = import_time(module, repeat)
+        over = limit is not None and result['seconds'] > limit
+        ok = ok and not over
+        print('{:<24} {:8.1f} ms{}'.format(module, result['seconds'] * 1000, '  OVER' if over else ''))
+        for name, seconds in result['heaviest']:
+            print('    {:<20} {:8.1f} ms'.format(name, seconds * 1000))
+    return ok
+
+
+def sign_legacy(secret, url):
+    """
+    以前の署名（毎回キーをエンコードしてHMACを作り直す、nonceは時刻の丸め）
+
+    :rtype: tuple (nonce, 署名)
+    """
+    nonce = str(round(time.time() * 1000000))
+    return nonce, hmac.new(secret.encode('utf-8'), (nonce + url).encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def sign_signer(signer, url):
+    headers = signer.sign(url)
+    return headers['ACCESS-NONCE'], headers['ACCESS-SIGNATURE']
+
+
+def signing(count=100000, threads=4):
+    """
+    1回の署名にかかる時間と、複数スレッドで署名したときのnonceの重複・逆転を表示する
+    """
+    from coincheck.signer import Signer
+
+    secret = 'benchmark-secret-0123456789abcdef'
+    url = 'https://coincheck.com/api/exchange/orders/opens'
+    signer = Signer('benchmark', secret)
+    cases = [('legacy', lambda: sign_legacy(secret, url)), ('signer', lambda: sign_signer(signer, url))]
+
+    for name, sign in cases:
+        start = time.perf_counter()
+        for i in range(count):
+            sign()
+        per_call = (time.perf_counter() - start) / count
+
+        # スレッドごとの発行順のnonce
+        nonces = [[] for i in range(threads)]
+
+        def work(out):
+            for i in range(count // threads):
+                out.append(int(sign()[0]))
+
+        workers = [threading.Thread(target=work, args=(nonces[i],)) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        issued = [nonce for out in nonces for nonce in out]
+        duplicates = len(issued) - len(set(issued))
+        # 同じスレッド内で増えていないnonce（取引所に拒否される）
+        regressions = sum(1 for out in nonces for a, b in zip(out, out[1:]) if b <= a)
+        print('{:<8} {:8.2f} us/call  duplicates={} non-increasing={} ({} threads)'.format(
+            name, per_call * 1e6, duplicates, regressions, threads))
+
+
+def stress(requests=2000, threads=16, tasks=16, latency=0.001, public_concurrency=4, private_concurrency=1):
+    """
+    1つのクライアントからスレッドとasyncioで同時にリクエストを送り、模擬サーバーで署名・nonceを検証する
+
+    :rtype: bool 拒否・失敗したリクエストがなければTrue
+    """
+    from coincheck.coincheck import CoinCheck
+    from exchange import Exchange, Market, random_walk
+
+    exchange = Exchange([Market('btc_jpy', random_walk(seed=0), start=3600)], latency=latency,
+                        credentials={'stress-key': 'stress-secret'})
+    server = exchange.serve(0)
+    client = CoinCheck('stress-key', 'stress-secret', {
+        'apiBase': '127.0.0.1',
+        'port': server.server_address[1],
+        'secure': False,
+        'publicConcurrency': public_concurrency,
+        'privateConcurrency': private_concurrency
+    })
+    calls = [
+        lambda: client.ticker.all(),
+        lambda: client.order_book.all({'pair': 'btc_jpy'}),
+        lambda: client.account.balance(),
+        lambda: client.order.opens(),
+        lambda: client.order.transactions_pagination({'limit': 10})
+    ]
+    failures = []
+    lock = threading.Lock()
+
+    def call(i):
+        try:
+            response = json.loads(calls[i % len(calls)]())
+            ok = response.get('success', True) is not False
+        except Exception as e:
+            ok, response = False, repr(e)
+        if not ok:
+            with lock:
+                failures.append(response)
+
+    def work(offset, count, step):
+        for i in range(offset, count, step):
+            call(i)
+
+    async def tasks_main(offset, count):
+        await asyncio.gather(*[asyncio.to_thread(work, offset + i, count, tasks) for i in range(tasks)])
+
+    # 半分をスレッド、残りをasyncioから送る
+    half = requests // 2
+    start = time.perf_counter()
+    workers = [threading.Thread(target=work, args=(i, half, threads)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    asyncio.run(tasks_main(0, requests - half))
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    server.shutdown()
+    client.close()
+    print('{} requests in {:.2f} s ({:.0f} req/s), failed={}, rejected by server={}'.format(
+        requests, elapsed, requests / elapsed, len(failures), exchange.rejected))
+    for failure in failures[:5]:
+        print('    ' + str(failure))
+    return len(failures) == 0 and exchange.rejected == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='起動・処理時間の計測')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    parser_import = commands.add_parser('import', help='モジュールの読み込み時間（新しいプロセスで計測）')
+    parser_import.add_argument('modules', nargs='*', default=MODULES)
+    parser_import.add_argument('--repeat', type=int, default=5)
+    parser_import.add_argument('--limit', type=float, help='読み込み時間の上限（秒、超えた場合は終了コード1）')
+
+    parser_sign = commands.add_parser('sign', help='リクエストの署名の時間とnonceの重複')
+    parser_sign.add_argument('--count', type=int, default=100000)
+    parser_sign.add_argument('--threads', type=int, default=4)
+
+    parser_stress = commands.add_parser('stress', help='同時リクエストで署名・nonceを検証（模擬サーバー）')
+    parser_stress.add_argument('--requests', type=int, default=2000)
+    parser_stress.add_argument('--threads', type=int, default=16)
+    parser_stress.add_argument('--tasks', type=int, default=16)
+    parser_stress.add_argument('--latency', type=float, default=0.001, help='模擬サーバーの遅延（秒）')
+    parser_stress.add_argument('--public-concurrency', type=int, default=4)
+    parser_stress.add_argument('--private-concurrency', type=int, default=1)
+
+    args = parser.parse_args()
+    if args.command == 'import':
+        if not imports(args.modules, args.repeat, args.limit):
+            sys.exit(1)
+    elif args.command == 'sign':
+        signing(args.count, args.threads)
+    elif args.command == 'stress':
+        if not stress(args.requests, args.threads, args.tasks, args.latency, args.public_concurrency,
+                      args.private_concurrency):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+##############################
+# 板（約定価格・スリッページの見積もり）
+##############################
+
+import math
+import threading
+import time
+
+import numpy as np
+
+
+class OrderBook:
+    """
+    板の写し（/api/order_booksのスナップショットとWebSocketの差分で更新する）
+
+    板が変わったときだけ価格順の配列と数量・金額の累積和を作り直し、
+    見積もりは二分探索だけで行う（APIを呼ばない）
+    """
+
+    def __init__(self, pair=None):
+        self.pair = pair
+        self.lock = threading.Lock()
+        # レート → 数量
+        self.sides = {'bids': {}, 'asks': {}}
+        # 側ごとの(レート, 数量の累積和, 金額の累積和)
+        self.arrays = {}
+        self.updated = 0.0
+
+    def age(self):
+        """
+        最後に更新してからの秒数
+
+        :rtype: float
+        """
+        return time.time() - self.updated
+
+    def replace(self, book):
+        """
+        スナップショットで置き換える（{"bids": [["レート", "数量"], ...], "asks": [...]}）
+        """
+        with self.lock:
+            for side in ['bids', 'asks']:
+                self.sides[side] = {float(rate): float(amount) for rate, amount in book.get(side, [])}
+            self.arrays = {}
+            self.updated = time.time()
+
+    def apply(self, diff):
+        """
+        差分を反映する（数量0のレートは削除、スナップショットを取得するまでは何もしない）
+        """
+        with self.lock:
+            if self.updated == 0:
+                return
+            for side in ['bids', 'asks']:
+                levels = self.sides[side]
+                for rate, amount in diff.get(side, []):
+                    rate = float(rate)
+                    amount = float(amount)
+                    if amount > 0:
+                        levels[rate] = amount
+                    else:
+                        levels.pop(rate, None)
+            self.arrays = {}
+            self.updated = time.time()
+
+    def levels(self, side):
+        """
+        良い方から順の(レート, 数量の累積和, 金額の累積和)
+
+        :rtype: tuple
+        """
+        with self.lock:
+            arrays = self.arrays.get(side)
+            if arrays is None:
+                levels = self.sides[side]
+                rates = np.fromiter(levels.keys(), dtype=np.float64, count=len(levels))
+                amounts = np.fromiter(levels.values(), dtype=np.float64, count=len(levels))
+                order = np.argsort(-rates if side == 'bids' else rates, kind='stable')
+                rates = rates[order]
+                amounts = amounts[order]
+                arrays = (rates, np.cumsum(amounts), np.cumsum(rates * amounts))
+                self.arrays[side] = arrays
+            return arrays
+
+    def best(self, side):
+        """
+        最良気配（bids: 買い、asks: 売り）
+
+        :rtype: float
+        """
+        rates = self.levels(side)[0]
+        return float(rates[0]) if len(rates) > 0 else None
+
+    def estimate(self, order_type, amount=None, price=None):
+        """
+        成行で約定させた場合の数量・金額・平均レート・スリッページ（買いは売り板、売りは買い板を消費する）
+
+        :param amount: 数量
+        :param price: 金額（amountの代わり、成行買いの金額指定）
+        :rtype: object
+        """
+        side = 'asks' if order_type == 'buy' else 'bids'
+        rates, cum_amounts, cum_costs = self.levels(side)
+        if len(rates) == 0:
+            return None
+
+        if amount is not None:
+            i = int(np.searchsorted(cum_amounts, amount, 'left'))
+            if i >= len(rates):
+                filled, cost = float(cum_amounts[-1]), float(cum_costs[-1])
+            else:
+                before_amount = cum_amounts[i - 1] if i > 0 else 0.0
+                before_cost = cum_costs[i - 1] if i > 0 else 0.0
+                filled, cost = float(amount), float(before_cost + (amount - before_amount) * rates[i])
+        else:
+            i = int(np.searchsorted(cum_costs, price, 'left'))
+            if i >= len(rates):
+                filled, cost = float(cum_amounts[-1]), float(cum_costs[-1])
+            else:
+                before_amount = cum_amounts[i - 1] if i > 0 else 0.0
+                before_cost = cum_costs[i - 1] if i > 0 else 0.0
+                filled, cost = float(before_amount + (price - before_cost) / rates[i]), float(price)
+
+        best = float(rates[0])
+        rate = cost / filled if filled > 0 else best
+        return {
+            'amount': filled,
+            'price': cost,
+            'rate': rate,
+            'best': best,
+            'slippage': abs(rate - best) / best,
+            # 板の厚みが足りず全量を見積もれなかった場合はFalse
+            'complete': i < len(rates)
+        }
+
+    def depth(self, order_type, max_slippage):
+        """
+        平均レートのスリッページがmax_slippage以内に収まる最大の数量・金額
+
+        :rtype: tuple (数量, 金額)
+        """
+        side = 'asks' if order_type == 'buy' else 'bids'
+        rates, cum_amounts, cum_costs = self.levels(side)
+        if len(rates) == 0:
+            return 0.0, 0.0
+        # 最良気配からmax_slippage離れたレートまでの板をすべて消費しても平均レートはその内側に収まる
+        limit = rates[0] * (1 + max_slippage) if side == 'asks' else rates[0] * (1 - max_slippage)
+        i = int(np.searchsorted(rates, limit, 'right')) if side == 'asks' else int(np.searchsorted(-rates, -limit, 'right'))
+        i = max(i, 1)
+        return float(cum_amounts[i - 1]), float(cum_costs[i - 1])
+
+    def split(self, order_type, amount=None, price=None, max_slippage=0.001, max_children=10):
+        """
+        スリッページがmax_slippage以内になるように注文を分割する（数量、金額指定の場合は金額のリスト）
+
+        板が回復するのを待ちながら順に出す想定のため、子注文はすべて現在の板の厚みで区切る
+
+        :rtype: list
+        """
+        total = amount if amount is not None else price
+        depth_amount, depth_price = self.depth(order_type, max_slippage)
+        size = depth_amount if amount is not None else depth_price
+        if size <= 0 or total <= size:
+            return [total]
+        count = min(max_children, int(math.ceil(total / size)))
+        return [total / count] * count
@@ -0,0 +1,92 @@
+##############################
+# APIレスポンスのキャッシュ
+##############################
+
+import threading
+import time
+from concurrent.futures import Future
+
+
+class TtlCache:
+    """
+    有効期間付きのキャッシュ
+
+    キーの先頭要素をエンドポイント名として扱い、エンドポイントごとにヒット・ミスを数える。
+    同じキーを同時に取得しようとした場合は、最初の呼び出しの結果を待って共有する。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.inflight = {}
+        # 取得中に無効化された結果を保存しないための世代番号
+        self.generations = {}
+        self.counters = {}
+
+    def count(self, endpoint, key):
+        counter = self.counters.setdefault(endpoint, {'hit': 0, 'miss': 0, 'coalesced': 0, 'invalidated': 0})
+        counter[key] += 1
+
+    def get(self, key, ttl, fetch, cacheable=None):
+        """
+        有効なキャッシュがあればそれを、なければfetch()の結果を返す
+
+        :param cacheable: 結果を保存してよいか判定する関数（エラーのレスポンスを保存しないため）
+        """
+        endpoint = key[0]
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.count(endpoint, 'hit')
+                return entry[1]
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.inflight[key] = future
+                generation = self.generations.get(endpoint, 0)
+                self.count(endpoint, 'miss')
+            else:
+                self.count(endpoint, 'coalesced')
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self.lock:
+                self.inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            self.inflight.pop(key, None)
+            if ttl > 0 and self.generations.get(endpoint, 0) == generation and (cacheable is None or cacheable(value)):
+                self.entries[key] = (time.monotonic() + ttl, value)
+        future.set_result(value)
+        return value
+
+    def invalidate(self, *endpoints):
+        """
+        エンドポイントのキャッシュを破棄する（注文後の残高・取引履歴など）
+        """
+        with self.lock:
+            for endpoint in endpoints:
+                self.generations[endpoint] = self.generations.get(endpoint, 0) + 1
+                for key in [key for key in self.entries if key[0] == endpoint]:
+                    del self.entries[key]
+                self.count(endpoint, 'invalidated')
+
+    def stats(self):
+        """
+        エンドポイントごとのヒット・ミスの回数とヒット率
+
+        :rtype: object
+        """
+        with self.lock:
+            stats = {}
+            for endpoint, counter in self.counters.items():
+                total = counter['hit'] + counter['miss'] + counter['coalesced']
+                stats[endpoint] = dict(counter, hit_rate=(counter['hit'] + counter['coalesced']) / total if total else 0.0)
+            return stats
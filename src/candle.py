@@ -0,0 +1,161 @@
+##############################
+# 関数（ローソク足系）
+##############################
+
+import numpy as np
+
+# ローソク足の列
+COLUMNS = ['open', 'high', 'low', 'close']
+
+
+class CandleBuffer:
+    """
+    ローソク足の固定長リングバッファ
+
+    同じ値を2か所（i と i + capacity）に書き込むことで、
+    直近n本を常にコピーなしの連続したビューとして参照できる
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = np.full((len(COLUMNS), capacity * 2), np.nan)
+        # 次に書き込む位置
+        self.head = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, candle):
+        """
+        ローソク足を1本追加する（容量を超えた場合は最も古いものを上書き）
+        """
+        for i, column in enumerate(COLUMNS):
+            value = candle[column]
+            self.data[i, self.head] = value
+            self.data[i, self.head + self.capacity] = value
+        self.head = (self.head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def extend(self, candles):
+        """
+        ローソク足をまとめて追加する
+        """
+        for candle in candles:
+            self.append(candle)
+
+    def clear(self):
+        self.head = 0
+        self.size = 0
+
+    def window(self, n=None):
+        """
+        直近n本（省略時は保持している全件）のビューを返す（古い順、shape=(4, n)）
+
+        :rtype: numpy.ndarray
+        """
+        n = self.size if n is None else min(n, self.size)
+        end = self.head + self.capacity
+        return self.data[:, end - n:end]
+
+    @property
+    def open(self):
+        return self.window()[0]
+
+    @property
+    def high(self):
+        return self.window()[1]
+
+    @property
+    def low(self):
+        return self.window()[2]
+
+    @property
+    def close(self):
+        return self.window()[3]
+
+    def last(self):
+        """
+        最新のローソク足
+
+        :rtype: object
+        """
+        if self.size == 0:
+            return None
+        index = self.head + self.capacity - 1
+        return {column: float(self.data[i, index]) for i, column in enumerate(COLUMNS)}
+
+    def to_dataframe(self, n=None):
+        """
+        pandasのDataFrameとして参照する（algorithm.pyの関数に渡す場合など）
+
+        :rtype: pandas.DataFrame
+        """
+        import pandas as pd
+        return pd.DataFrame(self.window(n).T, columns=COLUMNS, copy=False)
+
+
+class CandleAggregator:
+    """
+    約定をINTERVAL秒ごとのローソク足（OHLCV）に集計する
+
+    区切りは時刻のINTERVAL秒の境界に合わせる。約定がなかった区間は直前の価格で出来高0のローソク足にする
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.window = None
+        self.candle = None
+        self.last = None
+
+    def add(self, timestamp, rate, amount=0.0):
+        """
+        約定を1件反映する
+
+        :rtype: list 確定したローソク足
+        """
+        completed = self.flush(timestamp)
+        if self.candle is None:
+            self.candle = {
+                'time': self.window * self.interval,
+                'open': rate,
+                'high': rate,
+                'low': rate,
+                'close': rate,
+                'volume': 0.0
+            }
+        self.candle['high'] = rate if rate > self.candle['high'] else self.candle['high']
+        self.candle['low'] = rate if rate < self.candle['low'] else self.candle['low']
+        self.candle['close'] = rate
+        self.candle['volume'] += amount
+        self.last = rate
+        return completed
+
+    def flush(self, now):
+        """
+        nowより前の区間のローソク足を確定する
+
+        :rtype: list 確定したローソク足
+        """
+        window = int(now // self.interval)
+        if self.window is None:
+            self.window = window
+            return []
+
+        completed = []
+        while self.window < window:
+            if self.candle is not None:
+                completed.append(self.candle)
+            elif self.last is not None:
+                completed.append({
+                    'time': self.window * self.interval,
+                    'open': self.last,
+                    'high': self.last,
+                    'low': self.last,
+                    'close': self.last,
+                    'volume': 0.0
+                })
+            self.candle = None
+            self.window += 1
+        return completed
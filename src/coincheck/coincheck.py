@@ -1,21 +1,78 @@
 import http.client
 import time
 import json
-import hmac
-import hashlib
 import base64
 import urllib
 import logging
+import re
+import threading
 from coincheck.servicebase import ServiceBase
+from coincheck.connectionpool import ConnectionPool
+from coincheck.signer import Signer
+from coincheck.ratelimit import RateLimitExceeded, TokenBucket
+from coincheck.ticker import Ticker
+from coincheck.trade import Trade
+from coincheck.orderbook import OrderBook
+from coincheck.order import Order
+from coincheck.leverage import Leverage
+from coincheck.account import Account
+from coincheck.send import Send
+from coincheck.deposit import Deposit
+from coincheck.bankaccount import BankAccount
+from coincheck.withdraw import Withdraw
+from coincheck.borrow import Borrow
+from coincheck.transfer import Transfer
 
 class CoinCheck:
     DEBUG = False
     DEBUG_LEVEL = logging.INFO
     apiBase = 'coincheck.jp'
+    #endpoints that need no authentication (everything else is private)
+    PUBLIC = ('/api/ticker', '/api/trades', '/api/order_books', '/api/exchange/orders/rate')
+    PUBLIC_PREFIXES = ('/api/rate/',)
+    #static service registry (accessor name -> service class)
+    SERVICES = {
+        'ticker': Ticker,
+        'trade': Trade,
+        'order_book': OrderBook,
+        'order': Order,
+        'leverage': Leverage,
+        'account': Account,
+        'send': Send,
+        'deposit': Deposit,
+        'bank_account': BankAccount,
+        'withdraw': Withdraw,
+        'borrow': Borrow,
+        'transfer': Transfer
+    }
 
     def __init__(self, accessKey, secretKey, options = {}):
         self.accessKey = accessKey
         self.secretKey = secretKey
+        #pre-keyed HMAC and monotonic nonce shared by all requests
+        self.signer = Signer(accessKey, secretKey)
+        #connection options (apiBase/port/secure can point the client at a local stand-in server)
+        self.apiBase = options.get('apiBase', self.apiBase)
+        self.pool = ConnectionPool(self.apiBase,
+                                   port = options.get('port'),
+                                   secure = options.get('secure', True),
+                                   size = options.get('poolSize', 4),
+                                   timeout = options.get('timeout', 10),
+                                   context = options.get('context'))
+        #timing hook: an object with observe(name, seconds, **labels) (e.g. metrics.Registry)
+        self.metrics = options.get('metrics')
+        #bounded concurrency per endpoint class; private requests default to one at a time so
+        #signed nonces reach the exchange in the order they were issued
+        self.semaphores = {
+            'public': threading.BoundedSemaphore(options.get('publicConcurrency', options.get('poolSize', 4))),
+            'private': threading.BoundedSemaphore(options.get('privateConcurrency', 1))
+        }
+        #request budgets per endpoint class (requests per second, None for no limit)
+        self.buckets = {}
+        for scope in ['public', 'private']:
+            rate = options.get(scope + 'Rate')
+            if (rate):
+                self.buckets[scope] = TokenBucket(rate, options.get(scope + 'Burst'))
 
         if (self.DEBUG):
             logging.basicConfig()
@@ -27,55 +84,89 @@ class CoinCheck:
             http.client.HTTPSConnection.debuglevel = self.DEBUG_LEVEL
 
     def __getattr__(self, attr):
-        attrs = ['ticker', 'trade', 'order_book', 'order', 'leverage', 'account'
-                , 'send', 'deposit', 'bank_account', 'withdraw', 'borrow', 'transfer']
-
-        if attr in attrs:
-            #dynamic import module
-            moduleName = attr.replace('_', '')
-            module = __import__('coincheck.' + moduleName)
-            #uppercase first letter
-            className = attr.title().replace('_', '')
-            module = getattr(module, moduleName)
-            class_ = getattr(module, className)
-            #dynamic create instance of class
-            func = class_(self)
-            setattr(self, attr, func)
-            return func
-        else:
+        service = self.SERVICES.get(attr)
+        if service is None:
             raise AttributeError('Unknown accessor ' + attr)
+        #create the service on first access and keep it as a plain attribute
+        func = service(self)
+        setattr(self, attr, func)
+        return func
 
-    def setSignature(self, path):
-        nonce = str(round(time.time() * 1000000))
+    def signature(self, path):
         url = 'https://' + self.apiBase + path
-        message = nonce + url
-        signature = hmac.new(self.secretKey.encode('utf-8'), message.encode('utf-8'), hashlib.sha256).hexdigest()
-        self.request_headers.update({
-                'ACCESS-NONCE': nonce,
-                'ACCESS-KEY': self.accessKey,
-                'ACCESS-SIGNATURE': signature
-            })
+        headers = self.signer.sign(url)
 
         if (self.DEBUG):
             self.logger.info('Set signature...')
-            self.logger.debug('\n\tnone: %s\n\turl: %s\n\tmessage: %s\n\tsignature: %s', nonce, url, message, signature)
+            self.logger.debug('\n\tnonce: %s\n\turl: %s\n\tsignature: %s', headers['ACCESS-NONCE'], url, headers['ACCESS-SIGNATURE'])
+        return headers
+
+    def scope(self, endpoint):
+        if (endpoint in self.PUBLIC or endpoint.startswith(self.PUBLIC_PREFIXES)):
+            return 'public'
+        return 'private'
 
-    def request(self, method, path, params):
+    def request(self, method, path, params, timeout = None):
+        #all request state is local, so one client can be shared by threads and asyncio.to_thread
+        start = time.perf_counter()
+        endpoint = path
+        scope = self.scope(endpoint)
         if (method == ServiceBase.METHOD_GET and len(params) > 0):
             path = path + '?' + urllib.parse.urlencode(params)
         data = ''
-        self.request_headers = {}
+        #headers are built per request so concurrent calls never share them
+        headers = {}
         if (method == ServiceBase.METHOD_POST or method == ServiceBase.METHOD_DELETE):
-            self.request_headers = {
+            headers = {
                 'content-type': "application/json"
             }
             path = path + '?' + urllib.parse.urlencode(params)
-        self.setSignature(path)
+        bucket = self.buckets.get(scope)
+        if (bucket is not None):
+            #wait for the budget, but not past the request timeout
+            waiting = time.perf_counter()
+            if (not bucket.acquire(timeout)):
+                raise RateLimitExceeded(scope + ' rate limit: ' + endpoint)
+            if (self.metrics is not None):
+                self.metrics.observe('rate_limit_wait_seconds', time.perf_counter() - waiting, scope = scope)
+        with self.semaphores[scope]:
+            #sign inside the semaphore: with one private slot nonces are sent in increasing order
+            signing = None
+            send = headers
+            if (scope == 'private'):
+                signing = time.perf_counter()
+                headers.update(self.signature(path))
+                signing = time.perf_counter() - signing
 
-        self.client = http.client.HTTPSConnection(self.apiBase)
-        if (self.DEBUG):
-            self.logger.info('Process request...')
-        self.client.request(method, path, data, self.request_headers)
-        res = self.client.getresponse()
-        data = res.read()
-        return data.decode("utf-8")
\ No newline at end of file
+                first = [headers]
+
+                def send():
+                    #a GET resent on a fresh connection must not replay the nonce
+                    if (first):
+                        return first.pop()
+                    return dict(headers, **self.signature(path))
+
+            if (self.DEBUG):
+                self.logger.info('Process request...')
+            try:
+                status, data = self.pool.request(method, path, data, send, timeout)
+            except Exception:
+                self.observe(endpoint, method, 'error', start, signing)
+                raise
+        self.observe(endpoint, method, status, start, signing)
+        return data.decode("utf-8")
+
+    def observe(self, endpoint, method, status, start, signing):
+        if (self.metrics is None):
+            return
+        #ids in the path (e.g. order cancel) are folded into one endpoint
+        endpoint = re.sub(r'/\d+', '/:id', endpoint)
+        if (signing is not None):
+            self.metrics.observe('sign_seconds', signing)
+        self.metrics.observe('http_request_seconds', time.perf_counter() - start, endpoint = endpoint, method = method, status = status)
+
+    def stats(self):
+        return self.pool.stats()
+
+    def close(self):
+        self.pool.close()
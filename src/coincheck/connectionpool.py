@@ -0,0 +1,154 @@
+import http.client
+import queue
+import select
+import socket
+import ssl
+import threading
+import time
+
+
+class ConnectionPool:
+    """
+    Keep-alive connection pool for a single host.
+
+    Idle connections are reused LIFO so the most recently used (and least
+    likely to have been closed by the server) socket is picked first.
+    An idle connection the server has already closed is dropped before use.
+    A request that still fails on a reused connection because the server
+    dropped it is retried once on a fresh connection, but only when resending
+    is safe: GET requests, or failures raised before anything was sent.
+    Orders (POST/DELETE) are never sent twice, since the exchange would reject
+    the replayed nonce after the first one went through.
+    """
+    RETRY_METHODS = ('GET',)
+    STALE_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                    http.client.BadStatusLine, OSError)
+
+    def __init__(self, host, port = None, secure = True, size = 4, timeout = 10, context = None):
+        self.host = host
+        self.port = port
+        self.secure = secure
+        self.size = size
+        self.timeout = timeout
+        self.context = context
+        self.idle = queue.LifoQueue(maxsize = size)
+        self.lock = threading.Lock()
+        self.counters = {
+            'created': 0,  # new TCP/TLS handshakes
+            'reused': 0,  # requests served on an idle keep-alive connection
+            'reconnected': 0,  # stale keep-alive connections replaced mid-request
+            'discarded': 0,  # connections closed because the pool was full
+            'handshake_seconds': 0.0  # total time spent in connect()
+        }
+
+    def isStale(self, e):
+        #a timeout means the server is slow, not that the socket went away
+        #(socket.timeout is not a TimeoutError before Python 3.10)
+        return isinstance(e, self.STALE_ERRORS) and not isinstance(e, (socket.timeout, TimeoutError))
+
+    def isRetryable(self, method, e):
+        #CannotSendRequest is raised before any bytes are written
+        return method in self.RETRY_METHODS or isinstance(e, http.client.CannotSendRequest)
+
+    def isClosed(self, conn):
+        #an idle keep-alive socket is readable only if the server closed it,
+        #sent garbage, or (TLS 1.3) sent a session ticket, which recv() consumes
+        if conn.sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+            if not readable:
+                return False
+            conn.sock.setblocking(False)
+            try:
+                conn.sock.recv(1)
+            except (BlockingIOError, ssl.SSLWantReadError):
+                return False
+            finally:
+                conn.sock.settimeout(conn.timeout)
+        except (OSError, ValueError):
+            pass
+        return True
+
+    def count(self, key, value = 1):
+        with self.lock:
+            self.counters[key] += value
+
+    def connect(self, timeout = None):
+        if self.secure:
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout = timeout or self.timeout, context = self.context)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout = timeout or self.timeout)
+        start = time.perf_counter()
+        conn.connect()
+        self.count('handshake_seconds', time.perf_counter() - start)
+        self.count('created')
+        return conn
+
+    def acquire(self, timeout = None):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                return self.connect(timeout), False
+            if not self.isClosed(conn):
+                break
+            self.count('reconnected')
+            conn.close()
+        self.count('reused')
+        return conn, True
+
+    def release(self, conn):
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            self.count('discarded')
+            conn.close()
+
+    def send(self, conn, method, path, body, headers, timeout = None):
+        conn.timeout = timeout or self.timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(conn.timeout)
+        #headers may be a function so a resent request gets a fresh signature/nonce
+        conn.request(method, path, body, headers() if callable(headers) else headers)
+        res = conn.getresponse()
+        data = res.read()
+        return res, data
+
+    def request(self, method, path, body = None, headers = {}, timeout = None):
+        conn, reused = self.acquire(timeout)
+        try:
+            res, data = self.send(conn, method, path, body, headers, timeout)
+        except Exception as e:
+            conn.close()
+            if not (reused and self.isStale(e) and self.isRetryable(method, e)):
+                raise
+            #the server closed the idle connection, reconnect once
+            self.count('reconnected')
+            conn = self.connect(timeout)
+            try:
+                res, data = self.send(conn, method, path, body, headers, timeout)
+            except Exception:
+                conn.close()
+                raise
+
+        if res.will_close:
+            conn.close()
+        else:
+            self.release(conn)
+        return res.status, data
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats['idle'] = self.idle.qsize()
+        #estimated handshake time saved by reuse
+        stats['saved_seconds'] = stats['handshake_seconds'] / stats['created'] * stats['reused'] if stats['created'] else 0.0
+        return stats
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
@@ -21,5 +21,8 @@ class Order(ServiceBase):
     def transactions(self, params={}):
         return self.coinCheck.request(ServiceBase.METHOD_GET, self.baseUrl + '/transactions', params)
 
-    def rate(self, params={}):
-        return self.coinCheck.request(ServiceBase.METHOD_GET, self.baseUrl + '/rate', params)
+    def transactions_pagination(self, params={}):
+        return self.coinCheck.request(ServiceBase.METHOD_GET, self.baseUrl + '/transactions_pagination', params)
+
+    def rate(self, params={}, timeout=None):
+        return self.coinCheck.request(ServiceBase.METHOD_GET, self.baseUrl + '/rate', params, timeout)
@@ -0,0 +1,37 @@
+import hashlib
+import hmac
+import threading
+import time
+
+
+class Signer:
+    """
+    Request signer for the private API.
+
+    The secret is keyed into one HMAC-SHA256 object up front; each signature
+    works on a copy of it, so the key schedule is not redone per request and
+    the shared object is never mutated. Nonces come from a single lock-guarded
+    counter seeded from the clock in microseconds, so they are strictly
+    increasing across threads and across restarts.
+    """
+
+    def __init__(self, accessKey, secretKey):
+        self.accessKey = accessKey
+        self.mac = hmac.new(secretKey.encode('utf-8'), digestmod = hashlib.sha256)
+        self.lock = threading.Lock()
+        self.last = 0
+
+    def nonce(self):
+        with self.lock:
+            self.last = max(self.last + 1, time.time_ns() // 1000)
+            return self.last
+
+    def sign(self, url):
+        nonce = str(self.nonce())
+        mac = self.mac.copy()
+        mac.update((nonce + url).encode('utf-8'))
+        return {
+            'ACCESS-NONCE': nonce,
+            'ACCESS-KEY': self.accessKey,
+            'ACCESS-SIGNATURE': mac.hexdigest()
+        }
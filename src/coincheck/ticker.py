@@ -3,5 +3,5 @@ from coincheck.servicebase import ServiceBase
 class Ticker(ServiceBase):
     baseUrl = '/api/ticker'
     
-    def all(self, params = {}):
-        return self.coinCheck.request(ServiceBase.METHOD_GET, self.baseUrl, params)
\ No newline at end of file
+    def all(self, params = {}, timeout = None):
+        return self.coinCheck.request(ServiceBase.METHOD_GET, self.baseUrl, params, timeout)
\ No newline at end of file
@@ -1,43 +1,200 @@
-import boto3
+import atexit
+import json
 import os
-from boto3.dynamodb.conditions import Key
+import queue
+import threading
+import time
 
+from logger import logger
 
-def set_result(simulation, algorithm, interval, profit):
+# 書き込みに失敗した結果の退避先
+JOURNAL = os.getenv('DYNAMODB_JOURNAL') or 'dynamodb_journal.jsonl'
+
+
+class ResultSink:
     """
-    DynamoDBへログを送信
+    DynamoDBへの結果の書き込みを別スレッドでまとめて行う
+
+    同じキーの利益は合算し、ADDによる加算で1回の書き込みにする（読み込み不要で複数のBotが同じキーでも失われない）。
+    件数（batch_size）か時間（flush_interval秒）のどちらかに達したら書き込み、失敗した分はjournalに退避して
+    flush_interval秒ごとに再送する（起動時にstart()を呼ぶと前回退避した分をすぐに再送する）。
+    再送した分は1件書き込むたびにjournalから消すので、再送の途中で落ちても同じ結果を二重に加算しない。
     """
-    if os.getenv('AWS_ACCESS_KEY_ID') is None and os.getenv('AWS_SECRET_ACCESS_KEY') is None and os.getenv('AWS_DEFAULT_REGION') is None:
-        return
+    STOP = object()
+
+    def __init__(self, table_factory=None, batch_size=10, flush_interval=5.0, journal=JOURNAL):
+        self.table_factory = table_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.journal = journal
+        self.queue = queue.Queue()
+        self.tables = {}
+        self.thread = None
+        self.lock = threading.Lock()
+        self.counters = {'enqueued': 0, 'written': 0, 'failed': 0}
+
+    def table(self, name):
+        """
+        テーブル（1つのクライアントを使い回す）
+        """
+        if name not in self.tables:
+            if self.table_factory is None:
+                # boto3は読み込みが重いので最初に書き込むときに読み込む
+                import boto3
+                dynamoDB = boto3.resource('dynamodb')
+                self.table_factory = dynamoDB.Table
+            self.tables[name] = self.table_factory(name)
+        return self.tables[name]
+
+    def start(self):
+        """
+        書き込むスレッドを開始する（前回退避した分を再送する、2回目以降は何もしない）
+        """
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def put(self, table_name, algorithm, interval, profit):
+        """
+        結果を書き込み待ちに追加する（すぐに戻る）
+        """
+        self.start()
+        with self.lock:
+            self.counters['enqueued'] += 1
+        self.queue.put((table_name, algorithm, interval, int(profit)))
 
-    try:
-        dynamoDB = boto3.resource('dynamodb')
-        table_name = 'coincheck-auto-trade-simulation' if simulation else 'coincheck-auto-trade'
-        table = dynamoDB.Table(table_name)  # DynamoDBのテーブル名
+    def run(self):
+        # 前回退避した分を再送する（失敗した場合はflush_interval秒後にもう一度）
+        pending = {}
+        count = 0
+        deadline = self.retry_deadline(self.flush({}))
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
 
-        # DynamoDBへのquery処理実行
-        queryData = table.query(
-            KeyConditionExpression=Key('algorithm').eq(algorithm) & Key('interval').eq(interval),  # 取得するKey情報
-            Limit=1  # 取得するデータ件数
+            if item is self.STOP:
+                self.flush(pending)
+                return
+            if item is not None:
+                table_name, algorithm, interval, profit = item
+                key = (table_name, algorithm, interval)
+                pending[key] = pending.get(key, 0) + profit
+                count += 1
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if count >= self.batch_size or (deadline is not None and time.monotonic() >= deadline):
+                deadline = self.retry_deadline(self.flush(pending))
+                pending = {}
+                count = 0
+
+    def retry_deadline(self, failed):
+        """
+        退避した分がある場合は次に再送する時刻
+
+        :rtype: float
+        """
+        return time.monotonic() + self.flush_interval if failed > 0 else None
+
+    def write(self, record):
+        self.table(record['table']).update_item(
+            Key={'algorithm': record['algorithm'], 'interval': record['interval']},
+            UpdateExpression='ADD profit :p',
+            ExpressionAttributeValues={':p': record['profit']}
         )
 
-        if queryData['Count'] == 0:
-            # 初回登録
-            table.put_item(
-                Item={
-                    'algorithm': algorithm,  # アルゴリズム
-                    'interval': interval,  # 間隔
-                    'profit': int(profit)  # 利益
-                }
-            )
-        else:
-            # 2回目以降
-            table.update_item(
-                Key={'algorithm': algorithm, 'interval': interval},
-                UpdateExpression='set profit = :p',
-                ExpressionAttributeValues={
-                    ':p': int(queryData['Items'][0]['profit']) + int(profit),
-                }
-            )
-    except Exception as e:
-        print(e)
+    def flush(self, pending):
+        """
+        退避分と書き込み待ちをまとめて書き込む
+
+        :rtype: int 書き込めずに退避した件数
+        """
+        journal = self.read_journal()
+        records = journal + [
+            {'table': table_name, 'algorithm': algorithm, 'interval': interval, 'profit': profit}
+            for (table_name, algorithm, interval), profit in pending.items()
+        ]
+        if len(records) == 0:
+            return 0
+
+        failed = []
+        for index, record in enumerate(records):
+            try:
+                self.write(record)
+                self.counters['written'] += 1
+            except Exception as e:
+                logger.error('dynamodb_failed', record=record, error=repr(e))
+                self.counters['failed'] += 1
+                failed.append(record)
+                continue
+            # 退避分は書き込めたらすぐにjournalから消す（途中で落ちても再送で二重に加算しない）
+            if index < len(journal):
+                self.write_journal(failed + journal[index + 1:])
+        self.write_journal(failed)
+        return len(failed)
+
+    def read_journal(self):
+        if not os.path.exists(self.journal):
+            return []
+        with open(self.journal) as f:
+            return [json.loads(line) for line in f if line.strip() != '']
+
+    def write_journal(self, records):
+        """
+        退避分を書き換える（一時ファイルに書いてから置き換える）
+        """
+        if len(records) == 0:
+            if os.path.exists(self.journal):
+                os.remove(self.journal)
+            return
+        tmp = self.journal + '.tmp'
+        with open(tmp, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.journal)
+
+    def close(self, timeout=10):
+        """
+        書き込み待ちを書き込んで終了する
+        """
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(self.STOP)
+            self.thread.join(timeout)
+
+
+sink = ResultSink()
+atexit.register(sink.close)
+
+
+def enabled():
+    """
+    DynamoDBに連携するか（AWSの認証情報・リージョンが設定されている場合）
+
+    :rtype: bool
+    """
+    return not (os.getenv('AWS_ACCESS_KEY_ID') is None and os.getenv('AWS_SECRET_ACCESS_KEY') is None and os.getenv('AWS_DEFAULT_REGION') is None)
+
+
+def start_results():
+    """
+    起動時に呼ぶ（前回書き込めずに退避した結果を次の取引を待たずに再送する）
+    """
+    if enabled():
+        sink.start()
+
+
+def set_result(simulation, algorithm, interval, profit):
+    """
+    DynamoDBへログを送信（書き込みはバックグラウンドで行う）
+    """
+    if not enabled():
+        return
+
+    table_name = 'coincheck-auto-trade-simulation' if simulation else 'coincheck-auto-trade'
+    sink.put(table_name, algorithm, interval, profit)
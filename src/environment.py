@@ -1,5 +1,7 @@
+import json
 import os
-import pandas as pd
+
+from ledger import Ledger
 
 ##############################
 # 共通変数
@@ -12,26 +14,109 @@ market_buy_amount = 0
 # 利益
 PROFIT = os.getenv('PROFIT')
 profit = float(PROFIT if type(PROFIT) is str and PROFIT != '' else 0.0)
-df_profit = pd.DataFrame() \
-    .append({'profit': profit, }, ignore_index=True) \
-    .append({'profit': profit, }, ignore_index=True) \
-    .append({'profit': profit, }, ignore_index=True)
+# 約定から記録する損益（直近の取引ごとの利益は3件で初期化）
+ledger = Ledger(profit)
 
 # シミュレーション用通貨
 simulation_jpy = 100000.0
 simulation_coin = 0.0
 
 # 計測間隔
-INTERVAL = int(os.environ['INTERVAL'])
+INTERVAL = int(os.getenv('INTERVAL') or 60)
 
 # 通貨
-COIN = os.environ['COIN']
+COIN = os.getenv('COIN') or 'btc'
 PAIR = COIN + '_jpy'
 # アルゴリズム
-ALGORITHM = os.environ['ALGORITHM']
+ALGORITHM = os.getenv('ALGORITHM') or ''
 # 購入金額
 AMOUNT = os.getenv('AMOUNT')
+# インジケーター・ロスカットのパラメータ（JSON、未指定のものは基本値）
+PARAMS = json.loads(os.getenv('PARAMS') or '{}')
 
 # シミュレーションモード
 SIMULATION = os.getenv('SIMULATION')
 simulation = False if SIMULATION is None or SIMULATION == '' or SIMULATION == 'false' else True
+
+# 非同期モード（asyncioで価格の取得と売買を並行して行う）
+ASYNC = os.getenv('ASYNC')
+asynchronous = False if ASYNC is None or ASYNC == '' or ASYNC == 'false' else True
+
+# 接続先（模擬サーバーexchange.pyを使う場合はAPI_BASE=127.0.0.1 API_PORT=8080 API_SECURE=false）
+API_OPTIONS = {}
+if os.getenv('API_BASE'):
+    API_OPTIONS['apiBase'] = os.getenv('API_BASE')
+if os.getenv('API_PORT'):
+    API_OPTIONS['port'] = int(os.getenv('API_PORT'))
+if os.getenv('API_SECURE') == 'false':
+    API_OPTIONS['secure'] = False
+# 同時に送るリクエストの上限（公開API・認証が必要なAPIごと、認証が必要なAPIはnonceの順序を保つため既定は1）
+if os.getenv('API_PUBLIC_CONCURRENCY'):
+    API_OPTIONS['publicConcurrency'] = int(os.getenv('API_PUBLIC_CONCURRENCY'))
+if os.getenv('API_PRIVATE_CONCURRENCY'):
+    API_OPTIONS['privateConcurrency'] = int(os.getenv('API_PRIVATE_CONCURRENCY'))
+
+# 1秒あたりのリクエスト数の上限（公開API・認証が必要なAPIごと、0の場合は制限しない）
+API_PUBLIC_RATE = float(os.getenv('API_PUBLIC_RATE') or 10)
+API_PRIVATE_RATE = float(os.getenv('API_PRIVATE_RATE') or 5)
+API_OPTIONS['publicRate'] = API_PUBLIC_RATE
+API_OPTIONS['privateRate'] = API_PRIVATE_RATE
+
+# 公開APIの再試行（指数バックオフの基準・上限秒、レートの取得の試行回数）
+BACKOFF_BASE = float(os.getenv('BACKOFF_BASE') or 0.2)
+BACKOFF_CAP = float(os.getenv('BACKOFF_CAP') or 10)
+RETRY_ATTEMPTS = int(os.getenv('RETRY_ATTEMPTS') or 5)
+# 連続してBREAKER_THRESHOLD回失敗したらBREAKER_COOLDOWN秒は公開APIを呼ばない
+BREAKER_THRESHOLD = int(os.getenv('BREAKER_THRESHOLD') or 5)
+BREAKER_COOLDOWN = float(os.getenv('BREAKER_COOLDOWN') or 30)
+# 1回の価格の取得の期限（秒、過ぎた場合は最後に取得できた価格を使う）
+TICK_DEADLINE = float(os.getenv('TICK_DEADLINE') or 0.8)
+
+# 取引履歴からサンプルデータを作る（データ収集を待たずに取引を始める）
+BOOTSTRAP = os.getenv('BOOTSTRAP')
+bootstrap = False if BOOTSTRAP is None or BOOTSTRAP == '' or BOOTSTRAP == 'false' else True
+
+# 価格の取得方法（rest: 1秒ごとのAPI呼び出し、websocket: 約定の配信）
+FEED = os.getenv('FEED') or 'rest'
+WS_URL = os.getenv('WS_URL') or 'wss://ws-api.coincheck.com/'
+
+# APIレスポンスのキャッシュの有効期間（秒、JSONで上書き）
+CACHE_TTL = dict({
+    'ticker': 0.5,  # 最新の取引レート
+    'trades': 0.5,  # 最新の取引レート（BTC以外）
+    'rate': 1,  # レート
+    'order_books': 1,  # 板（WebSocketで更新している場合は取り直さない）
+    'balance': 5  # 残高（注文時に破棄）
+}, **json.loads(os.getenv('CACHE_TTL') or '{}'))
+
+# 約定・ローソク足の保存先（再起動時はここからサンプルデータを作る）
+STORE_DIR = os.getenv('STORE_DIR') or 'store'
+
+# 毎秒のログ（DEBUGレベル）を何秒に1回出力するか
+LOG_SAMPLE = int(os.getenv('LOG_SAMPLE') or 1)
+
+# 成行注文のスリッページの上限（板から見積もって超える場合は注文を分割する、0の場合は分割しない）
+MAX_SLIPPAGE = float(os.getenv('MAX_SLIPPAGE') or 0)
+# 分割した注文の間隔（秒、板が回復するのを待ってから取り直して残りを分割し直す）と子注文の数の上限
+SPLIT_DELAY = float(os.getenv('SPLIT_DELAY') or 1)
+SPLIT_MAX_CHILDREN = int(os.getenv('SPLIT_MAX_CHILDREN') or 10)
+# 売り注文の数量の刻み（分割した子注文はこの単位で切り捨てる）
+AMOUNT_STEP = float(os.getenv('AMOUNT_STEP') or 0.00000001)
+
+# 注文方法（market: 成行、limit: 指値（post only）で出し、LIMIT_TIMEOUT秒で約定しなければ出し直す）
+EXECUTION = os.getenv('EXECUTION') or 'market'
+LIMIT_TIMEOUT = float(os.getenv('LIMIT_TIMEOUT') or 10)
+LIMIT_REPLACES = int(os.getenv('LIMIT_REPLACES') or 3)
+
+# 売り注文の約定が取引履歴に揃うまで待つ秒数（揃わない分は見積もった金額で記録する）
+FILL_TIMEOUT = float(os.getenv('FILL_TIMEOUT') or 10)
+
+# 状態の保存先（注文の意図は末尾に.journalを付けたファイルに書く）
+STATE_PATH = os.getenv('STATE_PATH') or 'state.json'
+
+# 取引履歴の索引の保存先（再起動後は前回の続きから取得する）
+TRANSACTIONS_PATH = os.getenv('TRANSACTIONS_PATH') or 'transactions.jsonl'
+
+# 計測値（/metrics）を公開するポート（未指定の場合は公開しない）
+METRICS_PORT = os.getenv('METRICS_PORT')
+METRICS_HOST = os.getenv('METRICS_HOST') or '127.0.0.1'
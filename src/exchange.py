@@ -0,0 +1,570 @@
+##############################
+# 取引所の模擬サーバー（ローカル）
+##############################
+
+import argparse
+import datetime
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 板の段数
+DEPTH = 20
+
+
+def iso(timestamp):
+    """
+    APIと同じ形式の時刻（"2015-01-10T05:55:38.000Z"）
+
+    :rtype: str
+    """
+    return datetime.datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%dT%H:%M:%S.') + \
+        str(int(timestamp * 1000) % 1000).zfill(3) + 'Z'
+
+
+def random_walk(start=5000000.0, length=86400, volatility=0.0005, seed=0, begin=None):
+    """
+    1秒ごとの価格の系列（ランダムウォーク）
+
+    :rtype: list (時刻, 価格)のリスト
+    """
+    rng = random.Random(seed)
+    begin = time.time() - length if begin is None else begin
+    price = start
+    ticks = []
+    for i in range(length):
+        price *= 1.0 + rng.gauss(0.0, volatility)
+        ticks.append((begin + i, round(price)))
+    return ticks
+
+
+def synthesize_book(price, spread=0.0005, step=0.0002, size=0.05, depth=DEPTH):
+    """
+    価格の前後に板を作る（離れるほど厚くする）
+
+    :rtype: object
+    """
+    half = price * spread / 2
+    return {
+        'bids': [[round(price - half - price * step * i), round(size * (1 + i), 8)] for i in range(depth)],
+        'asks': [[round(price + half + price * step * i), round(size * (1 + i), 8)] for i in range(depth)]
+    }
+
+
+def fill(levels, amount=None, funds=None):
+    """
+    板の良い方から順に約定させる（levelsの数量を減らす）
+
+    :param amount: 約定させる数量
+    :param funds: 約定させる金額（amountの代わり）
+    :rtype: tuple (約定した数量, 金額)
+    """
+    coins = 0.0
+    jpy = 0.0
+    for level in levels:
+        rate, size = level
+        if amount is not None:
+            take = min(size, amount - coins)
+        else:
+            take = min(size, (funds - jpy) / rate)
+        if take <= 1e-12:
+            break
+        coins += take
+        jpy += take * rate
+        level[1] = size - take
+    levels[:] = [level for level in levels if level[1] > 1e-12]
+    return coins, jpy
+
+
+class Market:
+    """
+    1つのペアの価格の再生と板
+
+    市場データ（ticker・trades・板）を取得するたびにstep件ずつ進めるため、同じ呼び出し順であれば結果は毎回同じになる。
+    時刻は開始位置（start件目）が起動した時刻になるようにずらす（取引履歴から過去のローソク足を作れるように）
+    """
+
+    def __init__(self, pair, ticks, books=None, step=1, start=0, rebase=True, **book_options):
+        self.pair = pair
+        self.ticks = ticks
+        # 記録した板（なければ価格から作る）
+        self.books = books
+        self.step = step
+        self.book_options = book_options
+        self.cursor = min(start, len(ticks) - 1)
+        self.offset = time.time() - ticks[self.cursor][0] if rebase else 0.0
+        self.book = None
+        self.load()
+
+    def time(self, i):
+        return self.ticks[i][0] + self.offset
+
+    def now(self):
+        return self.time(self.cursor)
+
+    def price(self):
+        return self.ticks[self.cursor][1]
+
+    def load(self):
+        if self.books is not None:
+            book = self.books[min(self.cursor, len(self.books) - 1)]
+            self.book = {side: [[float(rate), float(amount)] for rate, amount in book[side]] for side in ['bids', 'asks']}
+        else:
+            self.book = synthesize_book(self.price(), **self.book_options)
+
+    def advance(self):
+        """
+        次の価格に進めて板を作り直す
+        """
+        self.cursor = min(self.cursor + self.step, len(self.ticks) - 1)
+        self.load()
+
+    def trades(self, limit=100, starting_after=None):
+        """
+        直近の約定（新しい順）
+
+        :rtype: list
+        """
+        # IDは位置+1（starting_afterより古いものを返す）
+        end = self.cursor if starting_after is None else min(self.cursor, int(starting_after) - 2)
+        start = max(-1, end - limit)
+        return [{
+            'id': i + 1,
+            'amount': '0.01',
+            'rate': str(float(self.ticks[i][1])),
+            'pair': self.pair,
+            'order_type': 'buy' if i > 0 and self.ticks[i][1] >= self.ticks[i - 1][1] else 'sell',
+            'created_at': iso(self.time(i))
+        } for i in range(end, start, -1)]
+
+
+class Exchange:
+    """
+    Coincheck APIの模擬（残高・注文・約定履歴を持つ）
+
+    成行注文は現在の板を消費して約定させ（スリッページ）、指値注文は価格が届いたときに指値で約定させる
+    """
+
+    # 認証が不要なAPI
+    PUBLIC = ('/api/ticker', '/api/trades', '/api/order_books', '/api/exchange/orders/rate')
+
+    def __init__(self, markets, balance=None, fee=0.0, latency=0.0, jitter=0.0, error_rate=0.0, seed=0, credentials=None):
+        self.markets = {market.pair: market for market in markets}
+        self.balance = dict({'jpy': 1000000.0}, **(balance or {}))
+        for pair in self.markets:
+            self.balance.setdefault(pair.split('_')[0], 0.0)
+        self.fee = fee
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.opens = {}
+        self.transactions = []
+        self.requests = 0
+        # アクセスキー → シークレット（指定した場合は認証が必要なAPIの署名とnonceを検証する）
+        self.credentials = credentials
+        # アクセスキーごとの最後のnonce
+        self.nonces = {}
+        self.rejected = 0
+
+    def delay(self):
+        """
+        注入する遅延（秒）とエラーにするか
+
+        :rtype: tuple
+        """
+        with self.lock:
+            self.requests += 1
+            delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+            error = self.rng.random() < self.error_rate
+        return delay, error
+
+    def authenticate(self, method, path, headers, host):
+        """
+        署名とnonceを検証する（エラーの場合はそのレスポンス、問題ない場合はNone）
+
+        :param path: クエリ文字列を含むパス
+        :rtype: object
+        """
+        endpoint = path.split('?', 1)[0]
+        if self.credentials is None or endpoint in self.PUBLIC or endpoint.startswith('/api/rate/'):
+            return None
+        key = headers.get('ACCESS-KEY')
+        nonce = headers.get('ACCESS-NONCE') or ''
+        secret = self.credentials.get(key)
+        # クライアントはポートを含まないホスト名で署名する
+        message = nonce + 'https://' + host.split(':')[0] + path
+        signature = hmac.new(secret.encode('utf-8'), message.encode('utf-8'), hashlib.sha256).hexdigest() if secret else None
+        with self.lock:
+            if signature is None or not hmac.compare_digest(signature, headers.get('ACCESS-SIGNATURE') or ''):
+                self.rejected += 1
+                return {'success': False, 'error': 'invalid authentication'}
+            if not nonce.isdigit() or int(nonce) <= self.nonces.get(key, 0):
+                self.rejected += 1
+                return {'success': False, 'error': 'Nonce must be incremented'}
+            self.nonces[key] = int(nonce)
+        return None
+
+    def market(self, params):
+        return self.markets[params.get('pair') or 'btc_jpy']
+
+    def record(self, market, order_id, side, coins, jpy, liquidity):
+        """
+        約定を残高・約定履歴に反映する
+        """
+        coin = market.pair.split('_')[0]
+        fee = jpy * self.fee
+        if side == 'buy':
+            self.balance[coin] += coins
+            self.balance['jpy'] -= jpy + fee
+        else:
+            self.balance[coin] -= coins
+            self.balance['jpy'] += jpy - fee
+        self.transactions.insert(0, {
+            'id': len(self.transactions) + 1,
+            'order_id': order_id,
+            'created_at': iso(market.now()),
+            'funds': {
+                coin: str(coins if side == 'buy' else -coins),
+                'jpy': str(-jpy - fee if side == 'buy' else jpy - fee)
+            },
+            'pair': market.pair,
+            'rate': str(jpy / coins if coins > 0 else 0.0),
+            'fee_currency': 'jpy',
+            'fee': str(fee),
+            'liquidity': liquidity,
+            'side': side
+        })
+
+    def match(self, market):
+        """
+        価格が届いた指値注文を約定させる
+        """
+        if len(market.book['bids']) == 0 or len(market.book['asks']) == 0:
+            return
+        bid = market.book['bids'][0][0]
+        ask = market.book['asks'][0][0]
+        for order_id, order in list(self.opens.items()):
+            if order['pair'] != market.pair:
+                continue
+            rate = order['rate']
+            if (order['order_type'] == 'buy' and ask <= rate) or (order['order_type'] == 'sell' and bid >= rate):
+                amount = order['pending_amount']
+                self.record(market, order_id, order['order_type'], amount, amount * rate, 'M')
+                del self.opens[order_id]
+
+    # 公開API
+
+    def ticker(self, params):
+        market = self.market(params)
+        with self.lock:
+            market.advance()
+            self.match(market)
+            # 直近1時間の高値・安値
+            prices = [price for _, price in market.ticks[max(0, market.cursor - 3600):market.cursor + 1]]
+            return {
+                'last': market.price(),
+                'bid': market.book['bids'][0][0],
+                'ask': market.book['asks'][0][0],
+                'high': max(prices),
+                'low': min(prices),
+                'volume': 0.01 * len(prices),
+                'timestamp': int(market.now())
+            }
+
+    def trades(self, params):
+        market = self.market(params)
+        limit = int(params.get('limit', 100))
+        with self.lock:
+            if 'starting_after' not in params:
+                market.advance()
+                self.match(market)
+            data = market.trades(limit, params.get('starting_after'))
+        return {
+            'success': True,
+            'pagination': {'limit': limit, 'order': 'desc', 'starting_after': params.get('starting_after'), 'ending_before': None},
+            'data': data
+        }
+
+    def order_books(self, params):
+        market = self.market(params)
+        with self.lock:
+            market.advance()
+            self.match(market)
+            return {side: [[str(rate), str(amount)] for rate, amount in market.book[side]] for side in ['asks', 'bids']}
+
+    # 認証が必要なAPI
+
+    def rate(self, params):
+        """
+        成行で約定させた場合のレート（板は消費しない）
+        """
+        market = self.market(params)
+        with self.lock:
+            levels = [list(level) for level in market.book['asks' if params['order_type'] == 'buy' else 'bids']]
+        if 'amount' in params:
+            coins, jpy = fill(levels, amount=float(params['amount']))
+        else:
+            coins, jpy = fill(levels, funds=float(params['price']))
+        return {
+            'success': True,
+            'rate': str(jpy / coins if coins > 0 else 0.0),
+            'price': str(jpy),
+            'amount': str(coins)
+        }
+
+    def create(self, params):
+        market = self.market(params)
+        order_type = params['order_type']
+        coin = market.pair.split('_')[0]
+        with self.lock:
+            order_id = self.next_id
+            self.next_id += 1
+            order = {
+                'success': True,
+                'id': order_id,
+                'rate': params.get('rate'),
+                'amount': params.get('amount'),
+                'order_type': order_type,
+                'stop_loss_rate': None,
+                'pair': market.pair,
+                'created_at': iso(market.now())
+            }
+
+            if order_type == 'market_buy':
+                funds = float(params['market_buy_amount'])
+                if funds > self.balance['jpy']:
+                    return {'success': False, 'error': 'Amount exceeds your available balance'}
+                coins, jpy = fill(market.book['asks'], funds=funds / (1 + self.fee))
+                self.record(market, order_id, 'buy', coins, jpy, 'T')
+                order['market_buy_amount'] = params['market_buy_amount']
+                return order
+
+            if order_type == 'market_sell':
+                amount = float(params['amount'])
+                if amount > self.balance[coin] + 1e-12:
+                    return {'success': False, 'error': 'Amount exceeds your available balance'}
+                coins, jpy = fill(market.book['bids'], amount=amount)
+                self.record(market, order_id, 'sell', coins, jpy, 'T')
+                return order
+
+            if order_type in ['buy', 'sell']:
+                rate = float(params['rate'])
+                amount = float(params['amount'])
+                crosses = market.book['asks'][0][0] <= rate if order_type == 'buy' else market.book['bids'][0][0] >= rate
+                post_only = str(params.get('post_only', params.get('time_in_force', ''))).lower() in ['true', 'post_only']
+                if crosses and post_only:
+                    return {'success': False, 'error': 'Post only order would be executed immediately'}
+                self.opens[order_id] = {
+                    'id': order_id,
+                    'order_type': order_type,
+                    'rate': rate,
+                    'pair': market.pair,
+                    'pending_amount': amount,
+                    'pending_market_buy_amount': None,
+                    'stop_loss_rate': None,
+                    'created_at': order['created_at']
+                }
+                if crosses:
+                    self.match(market)
+                return order
+
+        return {'success': False, 'error': 'Invalid order type'}
+
+    def cancel(self, order_id):
+        with self.lock:
+            if self.opens.pop(order_id, None) is None:
+                return {'success': False, 'error': 'The order doesn\'t exist.'}
+        return {'success': True, 'id': order_id}
+
+    def open_orders(self, params):
+        with self.lock:
+            return {'success': True, 'orders': [
+                dict(order, rate=str(order['rate']), pending_amount=str(order['pending_amount']))
+                for order in self.opens.values()
+            ]}
+
+    def order_transactions(self, params):
+        with self.lock:
+            return {'success': True, 'transactions': list(self.transactions)}
+
+    def order_transactions_pagination(self, params):
+        """
+        取引履歴のページ（orderの並びでstarting_afterより後、ending_beforeより前）
+        """
+        limit = int(params.get('limit', 20))
+        order = params.get('order', 'desc')
+        with self.lock:
+            # 取引履歴は新しい順に持っている
+            transactions = list(self.transactions) if order == 'desc' else self.transactions[::-1]
+        if params.get('starting_after') is not None:
+            after = int(params['starting_after'])
+            transactions = [t for t in transactions if (t['id'] > after if order == 'asc' else t['id'] < after)]
+        if params.get('ending_before') is not None:
+            before = int(params['ending_before'])
+            transactions = [t for t in transactions if (t['id'] < before if order == 'asc' else t['id'] > before)]
+        return {
+            'success': True,
+            'pagination': {'limit': limit, 'order': order, 'starting_after': params.get('starting_after'),
+                           'ending_before': params.get('ending_before')},
+            'data': transactions[:limit]
+        }
+
+    def account_balance(self, params):
+        with self.lock:
+            balance = {currency: str(value) for currency, value in self.balance.items()}
+        balance.update({currency + '_reserved': '0.0' for currency in self.balance})
+        return dict({'success': True}, **balance)
+
+    def dispatch(self, method, path, params):
+        """
+        パスに対応する処理を呼ぶ
+
+        :rtype: tuple (ステータス, レスポンス)
+        """
+        routes = {
+            ('GET', '/api/ticker'): self.ticker,
+            ('GET', '/api/trades'): self.trades,
+            ('GET', '/api/order_books'): self.order_books,
+            ('GET', '/api/exchange/orders/rate'): self.rate,
+            ('POST', '/api/exchange/orders'): self.create,
+            ('GET', '/api/exchange/orders/opens'): self.open_orders,
+            ('GET', '/api/exchange/orders/transactions'): self.order_transactions,
+            ('GET', '/api/exchange/orders/transactions_pagination'): self.order_transactions_pagination,
+            ('GET', '/api/accounts/balance'): self.account_balance
+        }
+        if method == 'DELETE' and path.startswith('/api/exchange/orders/'):
+            return 200, self.cancel(int(path.rsplit('/', 1)[1]))
+        route = routes.get((method, path))
+        if route is None:
+            return 404, {'success': False, 'error': 'Not found'}
+        return 200, route(params)
+
+    def serve(self, port=0, host='127.0.0.1'):
+        """
+        別スレッドのHTTPサーバーで公開する（keep-alive対応）
+
+        :rtype: ThreadingHTTPServer
+        """
+        exchange = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # ヘッダーと本文を分けて送るため、Nagleアルゴリズムによる遅延をなくす
+            disable_nagle_algorithm = True
+
+            def handle_request(self, method):
+                url = urllib.parse.urlsplit(self.path)
+                params = dict(urllib.parse.parse_qsl(url.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                if length > 0:
+                    self.rfile.read(length)
+
+                delay, error = exchange.delay()
+                if delay > 0:
+                    time.sleep(delay)
+                rejected = exchange.authenticate(method, self.path, self.headers, self.headers.get('Host') or '')
+                if error:
+                    status, response = 500, {'success': False, 'error': 'Injected error'}
+                elif rejected is not None:
+                    status, response = 401, rejected
+                else:
+                    try:
+                        status, response = exchange.dispatch(method, url.path, params)
+                    except (KeyError, ValueError) as e:
+                        status, response = 400, {'success': False, 'error': repr(e)}
+
+                body = json.dumps(response).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.handle_request('GET')
+
+            def do_POST(self):
+                self.handle_request('POST')
+
+            def do_DELETE(self):
+                self.handle_request('DELETE')
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def load_ticks(path, pair):
+    """
+    約定・ローソク足の保存先（STORE_DIR）から(時刻, 価格)を読み込む
+
+    :rtype: list
+    """
+    from store import MarketStore
+    ticks = MarketStore(path).ticks(pair)
+    return list(zip(ticks['time'].tolist(), ticks['rate'].tolist()))
+
+
+def load_books(path):
+    """
+    記録した板（1行に1つの/api/order_booksのレスポンス）を読み込む
+
+    :rtype: list
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip() != '']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Coincheck APIの模擬サーバー')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--pair', action='append', help='ペア（複数指定可、既定はbtc_jpy）')
+    parser.add_argument('--store', help='価格を再生する約定の保存先（STORE_DIR、未指定の場合はランダムウォーク）')
+    parser.add_argument('--books', help='再生する板（JSON Lines、1ペアの場合のみ）')
+    parser.add_argument('--start', type=int, default=3600, help='再生を始める位置（それより前は取引履歴として返す）')
+    parser.add_argument('--step', type=int, default=1, help='市場データの取得ごとに進める件数')
+    parser.add_argument('--jpy', type=float, default=1000000.0)
+    parser.add_argument('--fee', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.0, help='注入する遅延（秒）')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--key', help='署名を検証する場合のアクセスキー（ACCESS_KEY）')
+    parser.add_argument('--secret', help='署名を検証する場合のシークレット（API_SECRET）')
+    args = parser.parse_args()
+
+    pairs = args.pair or ['btc_jpy']
+    markets = []
+    for i, pair in enumerate(pairs):
+        ticks = load_ticks(args.store, pair) if args.store else random_walk(seed=args.seed + i)
+        books = load_books(args.books) if args.books and len(pairs) == 1 else None
+        markets.append(Market(pair, ticks, books, args.step, args.start))
+
+    credentials = {args.key: args.secret} if args.key and args.secret else None
+    exchange = Exchange(markets, {'jpy': args.jpy}, args.fee, args.latency, args.jitter, args.error_rate, args.seed,
+                        credentials)
+    server = exchange.serve(args.port, args.host)
+    print('Listening on http://' + args.host + ':' + str(server.server_address[1]) +
+          ' (API_BASE=' + args.host + ' API_PORT=' + str(server.server_address[1]) + ' API_SECURE=false)')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+##############################
+# 指値注文の執行
+##############################
+
+import json
+import threading
+import time
+
+from logger import logger
+
+
+class OrderTable:
+    """
+    出した注文をIDで引ける表（約定はIDからO(1)で反映する）
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.orders = {}
+        # 未約定の注文のID
+        self.open_ids = set()
+
+    def add(self, order_id, pair, side, rate, amount):
+        with self.lock:
+            self.orders[order_id] = {
+                'id': order_id,
+                'pair': pair,
+                'side': side,
+                'rate': rate,
+                'amount': amount,
+                'filled': 0.0,
+                'cost': 0.0,
+                # 未約定の一覧で確認できた約定済みの数量（取引履歴の反映が遅れても下回らない）
+                'executed': 0.0,
+                'status': 'open',
+                'created': time.monotonic()
+            }
+            self.open_ids.add(order_id)
+
+    def get(self, order_id):
+        return self.orders.get(order_id)
+
+    def fill(self, order_id, amount, cost):
+        """
+        約定の合計を反映する（表にない注文の約定は無視する）
+
+        :rtype: bool
+        """
+        with self.lock:
+            order = self.orders.get(order_id)
+            if order is None:
+                return False
+            order['filled'] = amount
+            order['cost'] = cost
+            if order['filled'] >= order['amount'] - 1e-12:
+                order['status'] = 'filled'
+                self.open_ids.discard(order_id)
+            return True
+
+    def execute(self, order_id, amount):
+        """
+        未約定の一覧の残量から分かった約定済みの数量を記録する
+        """
+        with self.lock:
+            order = self.orders.get(order_id)
+            if order is not None:
+                order['executed'] = max(order['executed'], amount)
+
+    def close(self, order_id, status):
+        """
+        取消・約定済みなどで未約定の一覧から外す
+        """
+        with self.lock:
+            order = self.orders.get(order_id)
+            if order is not None and order['status'] == 'open':
+                order['status'] = status
+            self.open_ids.discard(order_id)
+
+    def open_orders(self):
+        with self.lock:
+            return [self.orders[order_id] for order_id in self.open_ids]
+
+
+class LimitExecutor:
+    """
+    指値（post only）で注文を出し、約定するまで追跡する
+
+    未約定の一覧（opens）と新しい取引履歴（transactions.TransactionIndex）だけを確認し、
+    timeout秒で約定しなかった残りは取り消してその時点の最良気配で出し直す（max_replaces回まで）
+    出し直す前に約定が取引履歴に揃うのをsettle_timeout秒まで待つ（同じ数量を二重に出さない）
+    """
+
+    def __init__(self, client, get_book, index, timeout=10.0, poll_interval=1.0, max_replaces=3, post_only=True,
+                 settle_timeout=5.0):
+        self.client = client
+        self.get_book = get_book
+        self.index = index
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.max_replaces = max_replaces
+        self.post_only = post_only
+        self.settle_timeout = settle_timeout
+        self.table = OrderTable()
+
+    def sync_transactions(self, order_ids):
+        """
+        新しい取引履歴を取得し、注文ごとの約定の合計を表に反映する
+        """
+        self.index.sync()
+        for order_id in order_ids:
+            summary = self.index.order(order_id)
+            if summary is not None:
+                self.table.fill(order_id, abs(summary['amount']), abs(summary['jpy']))
+
+    def poll(self):
+        """
+        未約定の一覧と突き合わせて、一覧から消えた注文の約定を反映する
+        """
+        response = json.loads(self.client.order.opens())
+        if not response.get('success', True):
+            logger.error('opens_failed', response=response)
+            return
+        opens = set()
+        for order in response['orders']:
+            opens.add(order['id'])
+            stored = self.table.get(order['id'])
+            if stored is not None and order.get('pending_amount') is not None:
+                self.table.execute(order['id'], stored['amount'] - float(order['pending_amount']))
+        closed = [order['id'] for order in self.table.open_orders() if order['id'] not in opens]
+        if len(closed) > 0:
+            self.sync_transactions(closed)
+            for order_id in closed:
+                self.table.close(order_id, 'filled')
+
+    def place(self, pair, side, amount, rate=None):
+        """
+        指値注文を1つ出す（rateを省略した場合は自分の側の最良気配）
+
+        :rtype: int 注文ID（失敗した場合はNone）
+        """
+        if rate is None:
+            book = self.get_book(pair)
+            rate = book.best('bids' if side == 'buy' else 'asks')
+            if rate is None:
+                logger.warning('empty_book', pair=pair, side=side)
+                return None
+        params = {
+            'pair': pair,
+            'order_type': side,
+            'rate': rate,
+            'amount': round(amount, 8)
+        }
+        if self.post_only:
+            params['time_in_force'] = 'post_only'
+        response = json.loads(self.client.order.create(params))
+        if not response.get('success'):
+            logger.warning('limit_order_rejected', params=params, response=response)
+            return None
+        self.table.add(response['id'], pair, side, rate, round(amount, 8))
+        logger.info('limit_order', id=response['id'], side=side, rate=rate, amount=amount)
+        return response['id']
+
+    def cancel(self, order_id):
+        """
+        注文を取り消す（約定済みで取り消せなかった場合はFalse）
+
+        :rtype: bool
+        """
+        response = json.loads(self.client.order.cancel({'id': order_id}))
+        if response.get('success'):
+            self.table.close(order_id, 'cancelled')
+            return True
+        return False
+
+    def settle(self, order_id, complete):
+        """
+        注文の約定が取引履歴に揃うまで待つ
+
+        一覧から消えた（complete）注文は数量のすべて、取り消した注文は未約定の一覧で確認できた数量まで待ち、
+        settle_timeout秒で揃わなかった分は注文のレートで約定したものとして扱う
+        """
+        order = self.table.get(order_id)
+        target = order['amount'] if complete else order['executed']
+        deadline = time.monotonic() + self.settle_timeout
+        while True:
+            self.sync_transactions([order_id])
+            if order['filled'] >= target - 1e-8:
+                return
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(min(self.poll_interval, 0.2))
+        logger.warning('fills_pending', id=order_id, filled=order['filled'], target=target)
+        self.table.fill(order_id, target, order['cost'] + (target - order['filled']) * order['rate'])
+
+    def execute(self, pair, side, amount=None, funds=None):
+        """
+        指定した数量（買いの場合は金額でも可）が約定するまで注文を出し直す
+
+        :rtype: object 約定した数量・金額と注文IDの一覧
+        """
+        order_ids = []
+        filled = 0.0
+        cost = 0.0
+        for attempt in range(self.max_replaces + 1):
+            rate = None
+            if funds is not None:
+                rate = self.get_book(pair).best('bids' if side == 'buy' else 'asks')
+                if rate is None:
+                    # 板の片側が空の場合は少し待って取り直す
+                    logger.warning('empty_book', pair=pair, side=side)
+                    time.sleep(self.poll_interval)
+                    continue
+                remaining = (funds - cost) / rate
+            else:
+                remaining = amount - filled
+            if remaining <= 1e-8:
+                break
+            order_id = self.place(pair, side, remaining, rate)
+            if order_id is None:
+                # post onlyで弾かれた場合は板が動いたので次の最良気配で出し直す
+                time.sleep(self.poll_interval)
+                continue
+            order_ids.append(order_id)
+
+            deadline = time.monotonic() + self.timeout
+            while time.monotonic() < deadline and self.table.get(order_id)['status'] == 'open':
+                time.sleep(self.poll_interval)
+                self.poll()
+
+            cancelled = self.table.get(order_id)['status'] == 'open' and self.cancel(order_id)
+            if not cancelled:
+                # 取り消す前に約定した
+                self.table.close(order_id, 'filled')
+            # 取消までに約定した分を反映する（出し直す数量を決める前に揃える）
+            self.settle(order_id, not cancelled)
+            order = self.table.get(order_id)
+            filled += order['filled']
+            cost += order['cost']
+
+        return {
+            'ids': order_ids,
+            'amount': filled,
+            'price': cost,
+            'rate': cost / filled if filled > 0 else None
+        }
@@ -0,0 +1,429 @@
+##############################
+# 関数（インジケーター系）
+##############################
+
+import math
+from collections import deque
+
+import numpy as np
+
+from algorithm import DEFAULT_PARAMS, difference_rule, bollinger_bands_rule, macd_rule, hybrid_rule, rsi_rule, mix_rule
+from logger import DEBUG, logger
+
+
+class RollingStats:
+    """
+    移動平均・標準偏差（ローソク足1本ごとにO(1)で更新）
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        # 桁落ちを防ぐため最初の値を基準にずらして合計する
+        self.shift = None
+        self.sum = 0.0
+        self.sum_sq = 0.0
+
+    def update(self, value):
+        if self.shift is None:
+            self.shift = value
+        x = value - self.shift
+        self.values.append(x)
+        self.sum += x
+        self.sum_sq += x * x
+        if len(self.values) > self.window:
+            old = self.values.popleft()
+            self.sum -= old
+            self.sum_sq -= old * old
+
+    def ready(self):
+        return len(self.values) == self.window
+
+    @property
+    def mean(self):
+        """
+        単純移動平均（期間に満たない場合はNaN）
+
+        :rtype: float
+        """
+        if not self.ready():
+            return math.nan
+        return self.shift + self.sum / self.window
+
+    @property
+    def std(self):
+        """
+        標準偏差（pandasのrolling().std()と同じ不偏標準偏差）
+
+        :rtype: float
+        """
+        if not self.ready() or self.window < 2:
+            return math.nan
+        var = (self.sum_sq - self.sum * self.sum / self.window) / (self.window - 1)
+        return math.sqrt(var) if var > 0 else 0.0
+
+
+class Ema:
+    """
+    指数移動平均（pandasのewm(span=span).mean()と同じadjust=True形式を再帰的に計算）
+    """
+
+    def __init__(self, span):
+        self.decay = 1.0 - 2.0 / (span + 1.0)
+        self.numerator = 0.0
+        self.denominator = 0.0
+        self.value = math.nan
+
+    def update(self, value):
+        self.numerator = value + self.decay * self.numerator
+        self.denominator = 1.0 + self.decay * self.denominator
+        self.value = self.numerator / self.denominator
+        return self.value
+
+
+class Macd:
+    """
+    MACD・シグナル・ヒストグラム
+    """
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.ema_fast = Ema(fast)
+        self.ema_slow = Ema(slow)
+        self.ema_signal = Ema(signal)
+        self.macd = math.nan
+        self.signal = math.nan
+        self.histogram = math.nan
+        self.prev_histogram = math.nan
+
+    def update(self, value):
+        self.macd = self.ema_fast.update(value) - self.ema_slow.update(value)
+        self.signal = self.ema_signal.update(self.macd)
+        self.prev_histogram = self.histogram
+        self.histogram = self.macd - self.signal
+
+
+class Rsi:
+    """
+    RSI（値上がり幅・値下がり幅の単純移動平均、wilder=Trueの場合はワイルダーの平滑化）
+    """
+
+    def __init__(self, duration=14, wilder=False):
+        self.duration = duration
+        self.wilder = wilder
+        self.prev_close = None
+        self.ups = deque()
+        self.downs = deque()
+        self.up_sum = 0.0
+        self.down_sum = 0.0
+        self.count = 0
+        self.up_avg = math.nan
+        self.down_avg = math.nan
+        self.value = math.nan
+
+    def update(self, close):
+        if self.prev_close is None:
+            self.prev_close = close
+            return
+        diff = close - self.prev_close
+        self.prev_close = close
+        up = diff if diff > 0 else 0.0
+        down = -diff if diff < 0 else 0.0
+        self.count += 1
+
+        if self.wilder:
+            if self.count <= self.duration:
+                self.up_sum += up
+                self.down_sum += down
+                if self.count == self.duration:
+                    self.up_avg = self.up_sum / self.duration
+                    self.down_avg = self.down_sum / self.duration
+            else:
+                self.up_avg = (self.up_avg * (self.duration - 1) + up) / self.duration
+                self.down_avg = (self.down_avg * (self.duration - 1) + down) / self.duration
+        else:
+            self.ups.append(up)
+            self.downs.append(down)
+            self.up_sum += up
+            self.down_sum += down
+            if len(self.ups) > self.duration:
+                self.up_sum -= self.ups.popleft()
+                self.down_sum -= self.downs.popleft()
+            if len(self.ups) == self.duration:
+                # 浮動小数点の誤差で負にならないようにする
+                self.up_avg = max(self.up_sum, 0.0) / self.duration
+                self.down_avg = max(self.down_sum, 0.0) / self.duration
+
+        if math.isnan(self.up_avg):
+            self.value = math.nan
+        elif self.down_avg == 0:
+            self.value = 100.0 if self.up_avg > 0 else math.nan
+        else:
+            self.value = 100.0 - 100.0 / (1.0 + self.up_avg / self.down_avg)
+
+
+class IndicatorEngine:
+    """
+    ローソク足が確定するたびに全インジケーターを逐次更新し、algorithm.pyと同じ判定を返す
+    """
+
+    def __init__(self, params=None, verbose=True):
+        # パラメータ（未指定のものは基本値）
+        self.params = dict(DEFAULT_PARAMS, **(params or {}))
+        # 判定時にインジケーターの値をログに出すか（バックテスト時・DEBUGレベルでない場合はFalse）
+        self.verbose = verbose and logger.enabled(DEBUG)
+        # ボリンジャーバンドの期間（基本は20）
+        self.duration = self.params['duration']
+        # σの値
+        self.sigma = self.params['sigma']
+        self.bollinger = RollingStats(self.duration)
+        self.macd_state = Macd(self.params['fast'], self.params['slow'], self.params['signal'])
+        # RSIの期間（基本は14）
+        self.rsi_state = Rsi(self.params['rsi_duration'])
+        self.close = math.nan
+        self.diff = math.nan
+        self.prev_diff = math.nan
+
+    def update(self, close):
+        """
+        確定したローソク足の終値を反映する
+        """
+        self.prev_diff = self.diff
+        self.diff = close - self.close
+        self.close = close
+        self.bollinger.update(close)
+        self.macd_state.update(close)
+        self.rsi_state.update(close)
+
+    def feed(self, closes):
+        """
+        過去の終値をまとめて反映する
+        """
+        for close in closes:
+            self.update(float(close))
+
+    def lower_band(self):
+        return self.bollinger.mean - self.sigma * self.bollinger.std
+
+    def upper_band(self):
+        return self.bollinger.mean + self.sigma * self.bollinger.std
+
+    def difference(self):
+        """
+        上昇下降トレンドによる判定
+
+        :rtype: object
+        """
+        if self.verbose:
+            logger.debug('indicator', algorithm='DIFFERENCE', prev_diff=self.prev_diff, diff=self.diff)
+        return difference_rule(self.prev_diff, self.diff)
+
+    def bollinger_bands(self):
+        """
+        ボリンジャーバンドによる判定
+
+        :rtype: object
+        """
+        lower = self.lower_band()
+        upper = self.upper_band()
+        if self.verbose:
+            logger.debug('indicator', algorithm='BOLLINGER_BANDS', sigma=self.sigma, lower=lower, upper=upper)
+        return bollinger_bands_rule(self.close, lower, upper)
+
+    def macd(self):
+        """
+        MACDによる判定
+
+        :rtype: object
+        """
+        prev = self.macd_state.prev_histogram
+        histogram = self.macd_state.histogram
+        if self.verbose:
+            logger.debug('indicator', algorithm='MACD', prev_histogram=prev, histogram=histogram)
+        return macd_rule(prev, histogram)
+
+    def hybrid(self):
+        """
+        ボリンジャーバンドとMACDによる判定
+
+        :rtype: object
+        """
+        lower = self.lower_band()
+        prev = self.macd_state.prev_histogram
+        histogram = self.macd_state.histogram
+        if self.verbose:
+            logger.debug('indicator', algorithm='HYBRID', sigma=self.sigma, lower=lower, prev_histogram=prev, histogram=histogram)
+        return hybrid_rule(self.close, lower, prev, histogram)
+
+    def rsi(self):
+        """
+        RSIによる判定
+
+        :rtype: object
+        """
+        value = self.rsi_state.value
+        if self.verbose:
+            logger.debug('indicator', algorithm='RSI', rsi=value)
+        return rsi_rule(value, self.params['rsi_buy'], self.params['rsi_sell'])
+
+    def mix(self):
+        """
+        ボリンジャーバンド・MACD・RSIによる判定
+
+        :rtype: object
+        """
+        return mix_rule([self.bollinger_bands(), self.macd(), self.rsi()])
+
+    def judge(self, algorithm):
+        """
+        環境変数ALGORITHMに対応する判定を返す
+
+        :rtype: object
+        """
+        if algorithm == 'DIFFERENCE':
+            return self.difference()
+        elif algorithm == 'BOLLINGER_BANDS':
+            return self.bollinger_bands()
+        elif algorithm == 'MACD':
+            return self.macd()
+        elif algorithm == 'HYBRID':
+            return self.hybrid()
+        elif algorithm == 'RSI':
+            return self.rsi()
+        elif algorithm == 'MIX':
+            return self.mix()
+        return None
+
+
+##############################
+# 系列の一括計算（バックテスト用）
+##############################
+
+def shift(values, periods=1):
+    """
+    系列をperiods本後ろにずらす（先頭はNaN）
+
+    :rtype: numpy.ndarray
+    """
+    shifted = np.full(len(values), np.nan)
+    if periods < len(values):
+        shifted[periods:] = values[:len(values) - periods]
+    return shifted
+
+
+def rolling_mean_std(values, window, chunk=65536):
+    """
+    移動平均・標準偏差の系列（期間に満たない箇所はNaN）
+
+    :rtype: tuple
+    """
+    length = len(values)
+    mean = np.full(length, np.nan)
+    std = np.full(length, np.nan)
+    if length < window:
+        return mean, std
+    windows = np.lib.stride_tricks.sliding_window_view(values, window)
+    # 一時配列が大きくなりすぎないように分割して計算する
+    for start in range(0, len(windows), chunk):
+        block = windows[start:start + chunk]
+        mean[start + window - 1:start + window - 1 + len(block)] = block.mean(axis=1)
+        if window > 1:
+            std[start + window - 1:start + window - 1 + len(block)] = block.std(axis=1, ddof=1)
+    return mean, std
+
+
+def ema_series(values, span):
+    """
+    指数移動平均の系列（Emaクラスと同じadjust=True形式）
+
+    decay^(-k)を掛けた累積和をブロックごとに求め、ブロック間は直前の値を引き継ぐ
+
+    :rtype: numpy.ndarray
+    """
+    values = np.asarray(values, dtype=np.float64)
+    length = len(values)
+    decay = 1.0 - 2.0 / (span + 1.0)
+    if decay <= 0:
+        return values.copy()
+    # decay^(-block)がオーバーフローしない大きさ
+    block = max(1, min(4096, int(100 * math.log(10) / -math.log(decay))))
+    steps = np.arange(block)
+    powers = decay ** steps
+    inverse = decay ** -steps
+
+    numerator = np.empty(length)
+    carry = 0.0
+    for start in range(0, length, block):
+        x = values[start:start + block]
+        k = len(x)
+        numerator[start:start + k] = powers[:k] * (np.cumsum(x * inverse[:k]) + carry)
+        carry = decay * numerator[start + k - 1]
+    denominator = (1.0 - decay ** (np.arange(length) + 1.0)) / (1.0 - decay)
+    return numerator / denominator
+
+
+def macd_histogram_series(values, fast=12, slow=26, signal=9):
+    """
+    MACDのヒストグラムの系列
+
+    :rtype: numpy.ndarray
+    """
+    macd = ema_series(values, fast) - ema_series(values, slow)
+    return macd - ema_series(macd, signal)
+
+
+def rsi_series(values, duration=14):
+    """
+    RSIの系列（値上がり幅・値下がり幅の単純移動平均）
+
+    :rtype: numpy.ndarray
+    """
+    length = len(values)
+    rsi = np.full(length, np.nan)
+    if length <= duration:
+        return rsi
+    diff = np.diff(values)
+    up = np.cumsum(np.r_[0.0, np.where(diff > 0, diff, 0.0)])
+    down = np.cumsum(np.r_[0.0, np.where(diff < 0, -diff, 0.0)])
+    up_avg = (up[duration:] - up[:-duration]) / duration
+    down_avg = (down[duration:] - down[:-duration]) / duration
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi[duration:] = 100.0 - 100.0 / (1.0 + up_avg / down_avg)
+    return rsi
+
+
+def signals(algorithm, close, params=None):
+    """
+    終値の系列全体に対する買い・売りの判定（IndicatorEngineと同じ売買ルール）
+
+    :rtype: object
+    """
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    close = np.asarray(close, dtype=np.float64)
+
+    if algorithm == 'DIFFERENCE':
+        diff = np.r_[np.nan, np.diff(close)]
+        return difference_rule(shift(diff), diff)
+
+    if algorithm in ['BOLLINGER_BANDS', 'HYBRID', 'MIX']:
+        mean, std = rolling_mean_std(close, params['duration'])
+        lower = mean - params['sigma'] * std
+        upper = mean + params['sigma'] * std
+    if algorithm in ['MACD', 'HYBRID', 'MIX']:
+        histogram = macd_histogram_series(close, params['fast'], params['slow'], params['signal'])
+        prev_histogram = shift(histogram)
+    if algorithm in ['RSI', 'MIX']:
+        rsi = rsi_series(close, params['rsi_duration'])
+
+    if algorithm == 'BOLLINGER_BANDS':
+        return bollinger_bands_rule(close, lower, upper)
+    elif algorithm == 'MACD':
+        return macd_rule(prev_histogram, histogram)
+    elif algorithm == 'HYBRID':
+        return hybrid_rule(close, lower, prev_histogram, histogram)
+    elif algorithm == 'RSI':
+        return rsi_rule(rsi, params['rsi_buy'], params['rsi_sell'])
+    elif algorithm == 'MIX':
+        return mix_rule([bollinger_bands_rule(close, lower, upper),
+                         macd_rule(prev_histogram, histogram),
+                         rsi_rule(rsi, params['rsi_buy'], params['rsi_sell'])])
+    return None
@@ -0,0 +1,120 @@
+##############################
+# 損益の記録
+##############################
+
+from collections import deque
+
+
+class Ledger:
+    """
+    約定した数量・金額・手数料から取引ごとの損益を記録する
+
+    累計の損益・最大ドローダウン・連勝連敗数は値だけを更新し、
+    直近の取引ごとの損益は長さが一定のdequeに持つ（一時停止の判定用）
+    """
+
+    def __init__(self, profit=0.0, window=4, history=3):
+        self.window = window
+        self.history = history
+        # 利益（累計）
+        self.profit = float(profit)
+        # 利益の最大値とそこからの下落幅
+        self.peak = self.profit
+        self.drawdown = 0.0
+        self.max_drawdown = 0.0
+        self.trades = 0
+        self.wins = 0
+        self.fees = 0.0
+        # 連勝数（正）・連敗数（負）
+        self.streak = 0
+        # 直近の取引ごとの利益（古い順、history件で初期化）
+        self.recent = deque([self.profit] * history, maxlen=window)
+        # 保有中のポジション（数量・取得金額）
+        self.amount = 0.0
+        self.cost = 0.0
+
+    def buy(self, amount, cost, fee=0.0):
+        """
+        買いの約定を記録する
+
+        :param amount: 約定した数量
+        :param cost: 支払った金額（手数料を含む）
+        :param fee: 手数料
+        """
+        self.amount += amount
+        self.cost += cost
+        self.fees += fee
+
+    def sell(self, amount, proceeds, fee=0.0):
+        """
+        売りの約定を記録し、今回の取引の利益を返す（一部だけ売った場合は取得金額を数量で按分する）
+
+        :param amount: 約定した数量
+        :param proceeds: 受け取った金額（手数料を差し引いた額）
+        :param fee: 手数料
+        :rtype: float
+        """
+        if self.amount > 0 and amount < self.amount:
+            cost = self.cost * amount / self.amount
+        else:
+            cost = self.cost
+        self.amount = max(0.0, self.amount - amount)
+        self.cost -= cost
+        if self.amount <= 1e-12:
+            self.amount = 0.0
+            self.cost = 0.0
+        self.fees += fee
+
+        profit = proceeds - cost
+        self.profit += profit
+        self.trades += 1
+        if profit > 0:
+            self.wins += 1
+            self.streak = self.streak + 1 if self.streak > 0 else 1
+        else:
+            self.streak = self.streak - 1 if self.streak < 0 else -1
+        self.peak = max(self.peak, self.profit)
+        self.drawdown = self.peak - self.profit
+        self.max_drawdown = max(self.max_drawdown, self.drawdown)
+        self.recent.append(profit)
+        return profit
+
+    def reset(self, profit):
+        """
+        一時停止した後に直近の利益を今回の利益で初期化する
+        """
+        self.recent = deque([profit] * self.history, maxlen=self.window)
+
+    def state(self):
+        """
+        保存用の状態
+
+        :rtype: object
+        """
+        return dict(self.stats(), peak=self.peak, recent=list(self.recent), amount=self.amount, cost=self.cost)
+
+    def restore(self, state):
+        """
+        保存した状態に戻す
+        """
+        for key in ['profit', 'peak', 'drawdown', 'max_drawdown', 'trades', 'wins', 'fees', 'streak', 'amount', 'cost']:
+            if key in state:
+                setattr(self, key, state[key])
+        if 'recent' in state:
+            self.recent = deque(state['recent'], maxlen=self.window)
+
+    def stats(self):
+        """
+        現在の損益の状態
+
+        :rtype: object
+        """
+        return {
+            'profit': self.profit,
+            'drawdown': self.drawdown,
+            'max_drawdown': self.max_drawdown,
+            'trades': self.trades,
+            'wins': self.wins,
+            'fees': self.fees,
+            'streak': self.streak
+        }
@@ -0,0 +1,131 @@
+##############################
+# ログ（JSON Lines）
+##############################
+
+import atexit
+import datetime
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {'DEBUG': DEBUG, 'INFO': INFO, 'WARNING': WARNING, 'ERROR': ERROR}
+NAMES = {value: name for name, value in LEVELS.items()}
+
+
+class Logger:
+    """
+    ログを1行1件のJSONとして別スレッドで書き出す
+
+    呼び出し側はレベルの判定とキューへの追加だけを行い、整形・出力は待たない。
+    レベルが無効なログは何もせずに戻り、キューが溢れた場合は捨てて件数を数える。
+    """
+    STOP = object()
+
+    def __init__(self, level=INFO, stream=None, maxsize=10000):
+        self.level = LEVELS.get(str(level).upper(), INFO) if not isinstance(level, int) else level
+        self.stream = stream
+        self.queue = queue.Queue(maxsize)
+        self.thread = None
+        self.lock = threading.Lock()
+        # イベントごとの呼び出し回数（間引き用）
+        self.calls = {}
+        self.dropped = 0
+
+    def enabled(self, level):
+        """
+        ログを出力するレベルか（無効な場合は引数を組み立てずに済ませるため）
+
+        :rtype: bool
+        """
+        return level >= self.level
+
+    def log(self, level, event, every=1, **fields):
+        """
+        ログを書き出し待ちに追加する
+
+        :param every: 同じイベントをevery回に1回だけ出力する（毎秒のログなど）
+        """
+        if level < self.level:
+            return
+        if every > 1:
+            count = self.calls.get(event, 0)
+            self.calls[event] = count + 1
+            if count % every != 0:
+                return
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run, daemon=True)
+                    self.thread.start()
+        try:
+            self.queue.put_nowait((time.time(), level, event, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def debug(self, event, every=1, **fields):
+        self.log(DEBUG, event, every, **fields)
+
+    def info(self, event, every=1, **fields):
+        self.log(INFO, event, every, **fields)
+
+    def warning(self, event, every=1, **fields):
+        self.log(WARNING, event, every, **fields)
+
+    def error(self, event, every=1, **fields):
+        self.log(ERROR, event, every, **fields)
+
+    def format(self, record):
+        timestamp, level, event, fields = record
+        line = {
+            'time': datetime.datetime.fromtimestamp(timestamp).isoformat(timespec='milliseconds'),
+            'level': NAMES.get(level, str(level)),
+            'event': event
+        }
+        line.update(fields)
+        return json.dumps(line, ensure_ascii=False, default=str)
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            # 出力先は書き出すたびに決める（sys.stdoutが差し替えられた場合も閉じたファイルに書かない）
+            stream = self.stream or sys.stdout
+            if record is self.STOP:
+                stream.flush()
+                return
+            lines = [self.format(record)]
+            # 溜まっている分はまとめて書き出す
+            stop = False
+            while not stop:
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is self.STOP:
+                    stop = True
+                else:
+                    lines.append(self.format(record))
+            stream.write('\n'.join(lines) + '\n')
+            stream.flush()
+            if stop:
+                return
+
+    def close(self, timeout=5):
+        """
+        書き出し待ちのログを出力して終了する
+        """
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(self.STOP)
+            self.thread.join(timeout)
+
+
+# LOG_LEVEL: DEBUG/INFO/WARNING/ERROR（既定はINFO）
+logger = Logger(os.getenv('LOG_LEVEL') or 'INFO')
+atexit.register(logger.close)
@@ -1,9 +1,20 @@
-import datetime
+import asyncio
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 起動にかかった時間の計測の起点
+boot_time = time.perf_counter()
+
+import runtime
 
 from api import *
 from algorithm import *
+from indicator import *
 from dynamodb import *
+from logger import logger
+from metrics import registry
+from state import StateStore, match_intents
 
 ##############################
 # 環境変数チェック
@@ -27,88 +38,215 @@ if not (environment.ALGORITHM == 'DIFFERENCE' or
     print('Invalid algorithm.')
     sys.exit()
 
-# レートを取得してみる
-res_json = get_rate('sell', 0.005, None)
+# APIキーの確認（署名が必要な残高の取得）と最小注文数量のレートの取得はウォームアップと並行して行う
+probes = ThreadPoolExecutor(max_workers=2)
+probe = probes.submit(get_balance)
+rate_probe = probes.submit(get_rate, 'sell', 0.005, None)
+checked = False
 
-# キーが有効であるか
-is_valid_key = res_json['success']
 
-# APIキーの判定
-if not is_valid_key:
-    print('Invalid API key.')
-    sys.exit()
+def check_key():
+    """
+    APIキーの確認の結果を待ち、キーが無効・購入金額が足りない場合は終了する（2回目以降は何もしない）
+    """
+    global checked
+    if checked:
+        return
+    # キーが有効であるか（公開APIのレートでは署名が確認されない）
+    is_valid_key = probe.result()['success']
 
-# 最小注文数量（円）
-min_amount = 500
-# BTCの場合は0.005以上からしか購入できない
-if environment.COIN == 'btc':
-    min_amount = float(res_json['price'])
+    # APIキーの判定
+    if not is_valid_key:
+        print('Invalid API key.')
+        sys.exit()
 
-# 購入金額の判定
-amount = get_amount()
-if amount < min_amount:
-    print('Please specify more than ' + str(min_amount) + ' Yen')
-    sys.exit()
+    # 最小注文数量（円）
+    min_amount = 500
+    # BTCの場合は0.005以上からしか購入できない
+    if environment.COIN == 'btc':
+        min_amount = float(rate_probe.result()['price'])
+
+    # 購入金額の判定
+    amount = get_amount()
+    if amount < min_amount:
+        print('Please specify more than ' + str(min_amount) + ' Yen')
+        sys.exit()
 
-print('ALGORITHM: ' + environment.ALGORITHM)
-print('Buy ' + environment.COIN + ' for ' + str(amount) + ' Yen')
+    print('ALGORITHM: ' + environment.ALGORITHM)
+    print('Buy ' + environment.COIN + ' for ' + str(amount) + ' Yen')
+
+    # シミュレーションの場合
+    if not environment.simulation:
+        print('##############################')
+        print('####                      ####')
+        print('####   Production Mode!   ####')
+        print('####                      ####')
+        print('##############################')
+    checked = True
 
-# シミュレーションの場合
-if not environment.simulation:
-    print('##############################')
-    print('####                      ####')
-    print('####   Production Mode!   ####')
-    print('####                      ####')
-    print('##############################')
 
 ##############################
 # メイン処理
 ##############################
 
-# 空のデータフレーム作り、サンプルデータを入れる
-df = data_collecting(2 if environment.ALGORITHM == 'DIFFERENCE' else 25)
-
-# 以下無限ループ
-while True:
-    # 最新の価格を取ってくる
-    candle_stick = get_candle_stick()
-    df = df.append({'open': candle_stick['open'], 'high': candle_stick['high'], 'low': candle_stick['low'], 'close': candle_stick['close'], }, ignore_index=True)
-
-    buy_flg = False
-    sell_flg = False
-
-    if environment.ALGORITHM == 'DIFFERENCE':
-        result = difference(df)
-        buy_flg = result['buy_flg']
-        sell_flg = result['sell_flg']
-    elif environment.ALGORITHM == 'BOLLINGER_BANDS':
-        result = bollinger_bands(df)
-        buy_flg = result['buy_flg']
-        sell_flg = result['sell_flg']
-    elif environment.ALGORITHM == 'MACD':
-        result = macd(df)
-        buy_flg = result['buy_flg']
-        sell_flg = result['sell_flg']
-    elif environment.ALGORITHM == 'HYBRID':
-        result = hybrid(df)
-        buy_flg = result['buy_flg']
-        sell_flg = result['sell_flg']
-    elif environment.ALGORITHM == 'RSI':
-        result = rsi(df)
-        buy_flg = result['buy_flg']
-        sell_flg = result['sell_flg']
-    elif environment.ALGORITHM == 'MIX':
-        result = mix(df)
-        buy_flg = result['buy_flg']
-        sell_flg = result['sell_flg']
-    else:
-        print('Invalid algorithm.')
+# ローソク足のバッファ
+candles = None
+# インジケーター
+engine = None
+# ポジションの状態の保存先
+state_store = StateStore(environment.STATE_PATH)
+# 一時停止の終了時刻（再起動しても一時停止を続ける）
+paused_until = 0.0
+# APIキーの確認・取引所との突き合わせが済んだか
+ready = False
+
+
+def save_state():
+    """
+    現在のポジション・損益を保存する（状態が変わるたびに呼ぶ）
+    """
+    state_store.save({
+        'pair': environment.PAIR,
+        'algorithm': environment.ALGORITHM,
+        'order_id': environment.order_id,
+        'market_buy_amount': environment.market_buy_amount,
+        'simulation_jpy': environment.simulation_jpy,
+        'simulation_coin': environment.simulation_coin,
+        'paused_until': paused_until,
+        'ledger': environment.ledger.state()
+    })
+
+
+def reconcile(pending):
+    """
+    完了していない注文の意図を取引所の取引履歴・残高と突き合わせる
+    """
+    transaction_index.sync()
+    coin_amount = get_status()[environment.COIN]
+    for match in match_intents(pending, transaction_index, environment.PAIR, environment.order_id, coin_amount):
+        intent, order_ids, fills = match['intent'], match['order_ids'], match['fills']
+        if intent['action'] == 'buy':
+            # 買い注文を出した後に落ちていた
+            environment.order_id = order_ids if len(order_ids) > 1 else order_ids[0]
+            environment.market_buy_amount = float(intent['amount'])
+            environment.ledger.buy(fills['amount'], fills['jpy'], fills['fee'])
+            logger.warning('reconcile_buy', order_ids=order_ids, fills=fills)
+        else:
+            # 売り注文を出した後に落ちていた（買いの約定が記録できていなかった場合は取り直す）
+            if environment.ledger.amount <= 0:
+                book_buy_fills(environment.ledger, environment.order_id, environment.market_buy_amount, fills['amount'])
+            profit = environment.ledger.sell(fills['amount'], fills['jpy'], fills['fee'])
+            environment.profit = environment.ledger.profit
+            set_result(environment.simulation, environment.ALGORITHM, environment.INTERVAL, profit)
+            environment.order_id = None
+            environment.market_buy_amount = 0
+            logger.warning('reconcile_sell', order_ids=order_ids, fills=fills, profit=profit)
+
+    if environment.order_id is not None and coin_amount <= 0:
+        # 取引所で売却済み（利益は記録できない）
+        logger.warning('position_missing', order_id=environment.order_id)
+        environment.order_id = None
+        environment.market_buy_amount = 0
+        environment.ledger.amount = 0.0
+        environment.ledger.cost = 0.0
+
+
+def load_state():
+    """
+    保存した状態を読み込む（取引所との突き合わせはAPIキーの確認の後にresumeで行う）
+    """
+    global paused_until
+    state = state_store.load()
+    if state is not None and state.get('pair') == environment.PAIR:
+        environment.order_id = state['order_id']
+        environment.market_buy_amount = state['market_buy_amount']
+        environment.simulation_jpy = state['simulation_jpy']
+        environment.simulation_coin = state['simulation_coin']
+        environment.ledger.restore(state['ledger'])
+        environment.profit = environment.ledger.profit
+        paused_until = state.get('paused_until', 0.0)
+
+    # 一時停止中に落ちた場合は残りの時間だけ停止する
+    if paused_until > time.time():
+        logger.warning('paused_resume', seconds=paused_until - time.time())
+        time.sleep(paused_until - time.time())
+
+
+def resume():
+    """
+    完了していない注文の意図を取引所と突き合わせてから再開する
+    """
+    pending = state_store.pending()
+    if not environment.simulation:
+        reconcile(pending)
+    state_store.clear()
+    save_state()
+    logger.info('resume', order_id=environment.order_id, market_buy_amount=environment.market_buy_amount,
+                pending=len(pending), pnl=environment.ledger.stats())
+
+
+def start():
+    """
+    最初のウォームアップの後に1回だけ呼ぶ（APIキーの確認を待ち、取引所と突き合わせる）
+    """
+    global ready
+    if ready:
+        return
+    check_key()
+    resume()
+    ready = True
+    registry.observe('startup_seconds', time.perf_counter() - boot_time)
+    logger.info('startup', seconds=time.perf_counter() - boot_time)
+
+
+def warm_up_size():
+    """
+    取引開始までに集めるローソク足の本数
+
+    :rtype: int
+    """
+    return 2 if environment.ALGORITHM == 'DIFFERENCE' else 25
+
+
+def warm_up(collected):
+    """
+    集めたサンプルデータでインジケーターを初期化する
+    """
+    global candles, engine
+    candles = collected
+    # インジケーターを逐次計算する
+    engine = IndicatorEngine(environment.PARAMS)
+    engine.feed(candles.close)
+    start()
+
+
+def trade(candle_stick):
+    """
+    確定したローソク足で売買を判定し、注文を入れる
+
+    :rtype: bool 一時停止する場合はTrue
+    """
+    global paused_until
+    # バッファの長さは一定（最も古いローソク足を上書き）
+    candles.append(candle_stick)
+
+    # インジケーターの計算時間を計測する
+    with registry.timer('indicator_seconds', algorithm=environment.ALGORITHM):
+        engine.update(candle_stick['close'])
+        result = engine.judge(environment.ALGORITHM)
+    # 判定してから注文が受け付けられるまでの時間を計測する
+    decided = time.perf_counter()
+    registry.inc('candles')
+    if result is None:
+        logger.error('invalid_algorithm', algorithm=environment.ALGORITHM)
         sys.exit()
+    buy_flg = result['buy_flg']
+    sell_flg = result['sell_flg']
 
     coin_amount = get_status()[environment.COIN]
-    now_amount = df.iloc[-1]['close'] * coin_amount
+    now_amount = candles.close[-1] * coin_amount
     # ロスカット判定（購入金額の1%を下回った場合）
-    loss_cut_flg = environment.market_buy_amount * 0.01 < environment.market_buy_amount - now_amount
+    loss_cut_flg = loss_cut(environment.market_buy_amount, now_amount, engine.params['loss_cut'])
 
     # 買い注文実施判定
     buying = environment.order_id is None and buy_flg
@@ -116,84 +254,138 @@ while True:
     selling = environment.order_id is not None and (sell_flg or loss_cut_flg)
 
     if buying:
-        # 買い注文実施
-        print('Execute a buy order!')
+        # 買い注文実施（注文を出す前に意図を書く）
+        logger.info('buy', amount=get_amount())
+        seq = state_store.intent('buy', amount=get_amount(), last_id=transaction_index.last_id)
         order_json = simulation_buy(get_amount()) if environment.simulation else buy(get_amount())
+        registry.observe('order_ack_seconds', time.perf_counter() - decided, side='buy')
+        registry.inc('orders', side='buy', success=order_json is not None)
 
         # 買い注文成功の場合
         if order_json is not None:
-            # オーダーIDをセット
-            environment.order_id = order_json['id']
+            # オーダーIDをセット（分割・指値で出し直した場合はすべての注文のIDのリスト）
+            environment.order_id = order_json.get('ids', order_json['id'])
             # 購入金額をセット
             environment.market_buy_amount = float(order_json['market_buy_amount'])
             # シミュレーションの場合
             if environment.simulation:
                 environment.simulation_jpy -= get_amount()
                 environment.simulation_coin += float(order_json['amount'])
+                environment.ledger.buy(float(order_json['amount']), environment.market_buy_amount)
+            else:
+                # 実際に約定した数量・金額・手数料を記録する（揃わなければ売る前に取り直す）
+                book_buy_fills(environment.ledger, environment.order_id, environment.market_buy_amount)
+            save_state()
+        state_store.done(seq, order_id=order_json['id'] if order_json is not None else None)
     elif selling:
-        # 売り注文実施
-        print('Execute a sell order!')
+        # 売り注文実施（注文を出す前に意図を書く）
+        logger.info('sell', order_id=environment.order_id)
+        seq = state_store.intent('sell', order_id=environment.order_id, last_id=transaction_index.last_id)
         order_json = simulation_sell() if environment.simulation else sell(environment.order_id)
+        registry.observe('order_ack_seconds', time.perf_counter() - decided, side='sell')
+        registry.inc('orders', side='sell', success=order_json is not None)
 
         # 売り注文成功の場合
         if order_json is not None:
             # オーダーIDを初期化
+            bought_id = environment.order_id
             environment.order_id = None
 
-            # 利益を計算するためにレートを取得
-            order_rate_json = get_rate('sell', order_json['amount'], None)
+            if environment.simulation:
+                fills = {'amount': float(order_json['amount']), 'jpy': order_json['price'], 'fee': 0.0}
+            else:
+                # 実際に約定した数量・金額・手数料から利益を計算する
+                fills = get_sell_fills(order_json)
+                # 買いの約定が記録できていなかった場合は取り直す
+                if environment.ledger.amount <= 0:
+                    book_buy_fills(environment.ledger, bought_id, environment.market_buy_amount, fills['amount'])
             # 今回の取引の利益
-            profit = float(order_rate_json['price']) - environment.market_buy_amount
-            environment.profit += profit
-            environment.df_profit = environment.df_profit.append({'profit': profit, }, ignore_index=True)
+            profit = environment.ledger.sell(fills['amount'], fills['jpy'], fills['fee'])
+            environment.profit = environment.ledger.profit
 
             # DynamoDBに連携
             set_result(environment.simulation, environment.ALGORITHM, environment.INTERVAL, profit)
 
             # シミュレーションの場合
             if environment.simulation:
-                environment.simulation_jpy += float(order_rate_json['price'])
+                environment.simulation_jpy += fills['jpy']
                 environment.simulation_coin = 0
 
-            #  df_profitのlength調整
-            if len(environment.df_profit.index) > 4:
-                environment.df_profit = environment.df_profit.drop(environment.df_profit.index[0])
-
-            # 1%以上の損失を出しているか
-            loss = environment.market_buy_amount * 0.01 + profit
-            loss_flg = loss < 0
-            # 3連続の損失か
-            environment.df_profit['diff'] = environment.df_profit.diff()
-            down_flg = (environment.df_profit.iloc[-3]['diff'] < 0 and
-                        environment.df_profit.iloc[-2]['diff'] < 0 and
-                        environment.df_profit.iloc[-1]['diff'] < 0)
+            # 1%以上の損失・3連続の損失の判定
+            pause_result = pause(environment.market_buy_amount, profit, environment.ledger.recent, engine.params['loss_cut'])
+            loss = pause_result['loss']
+            loss_flg = pause_result['loss_flg']
+            down_flg = pause_result['down_flg']
 
             # 購入金額初期化
             environment.market_buy_amount = 0
 
             # 1%以上の損失を出している、もしくは2連続で損失が出たら暴落の可能性があるので一時停止する
+            paused = (loss_flg or down_flg) and not environment.simulation
             if loss_flg or down_flg:
-                print('loss_flg: ' + str(loss_flg))
-                print(loss)
-                print('down_flg: ' + str(down_flg))
-                print(environment.df_profit)
-
-                if not environment.simulation:
-                    # 5時間停止
-                    sleep(5)
-                    # 一時停止した後なので初期化
-                    environment.df_profit = pd.DataFrame() \
-                        .append({'profit': profit, }, ignore_index=True) \
-                        .append({'profit': profit, }, ignore_index=True) \
-                        .append({'profit': profit, }, ignore_index=True)
-                    # サンプルデータ作り直し（この後、先頭行を削除されるので+1）
-                    df = data_collecting(2 + 1 if environment.ALGORITHM == 'DIFFERENCE' else 25 + 1)
-
-    # 現在の時刻・金額を表示
-    dt_now = datetime.datetime.now()
-    time = dt_now.strftime('%Y/%m/%d %H:%M:%S')
-    status = get_status()
-    print(time + ' ' + str(status))
-
-    # 先頭行を削除してdfの長さを一定に保つ（長時間の運用時のメモリ対策）
-    df = df.drop(df.index[0])
+                logger.warning('pause', loss_flg=loss_flg, loss=loss, down_flg=down_flg,
+                               profits=list(environment.ledger.recent))
+            if paused:
+                # 一時停止した後なので初期化
+                environment.ledger.reset(profit)
+                # run()のsleep(5)と同じ時間
+                paused_until = time.time() + environment.INTERVAL * 5 * environment.INTERVAL
+            save_state()
+            state_store.done(seq)
+            return paused
+
+        state_store.done(seq)
+
+    return False
+
+
+def report():
+    """
+    現在の金額・損益・キャッシュの状態を表示する（時刻はログに付く）
+    """
+    logger.info('status', status=get_status(), pnl=environment.ledger.stats(), cache=cache.stats())
+
+
+def run(collected=None):
+    """
+    1秒ごとに価格を取得しながら売買を続ける
+
+    :param collected: 保存済みのローソク足から作ったサンプルデータ（ない場合は集める）
+    """
+    # ローソク足のバッファを作り、サンプルデータを入れる
+    warm_up(collected or data_collecting(warm_up_size()))
+
+    # 以下無限ループ
+    while True:
+        # 最新の価格を取ってくる
+        if trade(get_candle_stick()):
+            # 5時間停止
+            sleep(5)
+            # サンプルデータ作り直し
+            warm_up(warm_start(warm_up_size()) or data_collecting(warm_up_size()))
+
+        report()
+
+
+# 保存した状態を読み込む
+load_state()
+# 前回DynamoDBに書き込めなかった結果を再送する
+start_results()
+
+# 保存済みの直近のローソク足があればそれを使う（APIキーの確認と並行して作る）
+# ポジションを持ったまま再開した場合は取引履歴からでも作ってすぐに売買を判定する
+collected = warm_start(warm_up_size(), force=environment.order_id is not None)
+if collected is None:
+    # 集めるには時間がかかるので先にAPIキーを確認する
+    check_key()
+
+# 計測値を公開する
+registry.collect(lambda: [('pnl_' + key, {}, value) for key, value in environment.ledger.stats().items()])
+if environment.METRICS_PORT:
+    registry.serve(int(environment.METRICS_PORT), environment.METRICS_HOST)
+
+# WebSocketの配信はasyncioで受信する
+if environment.asynchronous or environment.FEED == 'websocket':
+    asyncio.run(runtime.run(trade, warm_up, report, warm_up_size(), collected=collected))
+else:
+    run(collected)
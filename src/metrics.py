@@ -0,0 +1,167 @@
+##############################
+# 計測（Prometheus形式）
+##############################
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from logger import logger
+
+# 所要時間（秒）のヒストグラムの区切り
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+                          for key, value in labels) + '}'
+
+
+class Histogram:
+    """
+    区切りごとの件数と値の合計・件数
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """
+    ヒストグラム・カウンターを名前とラベルごとに集計し、Prometheusのテキスト形式で出力する
+    """
+
+    def __init__(self, prefix='coincheck_'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        # 出力時に値を集める関数（キャッシュ・コネクションプールの状態など）
+        self.collectors = []
+
+    def observe(self, name, value, **labels):
+        """
+        所要時間などをヒストグラムに記録する
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        """
+        カウンターを増やす
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        with内の所要時間をヒストグラムに記録する
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def collect(self, collector):
+        """
+        出力時に呼ぶ関数を登録する（[(名前, ラベルのdict, 値), ...]を返す）
+        """
+        self.collectors.append(collector)
+
+    def render(self):
+        """
+        Prometheusのテキスト形式
+
+        :rtype: str
+        """
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            histograms = [(key, list(histogram.counts), histogram.sum, histogram.count, histogram.buckets)
+                          for key, histogram in histograms]
+
+        typed = set()
+        for (name, labels), counts, total, count, buckets in histograms:
+            name = self.prefix + name
+            if name not in typed:
+                lines.append('# TYPE ' + name + ' histogram')
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += bucket
+                lines.append(name + '_bucket' + format_labels(labels + (('le', bound),)) + ' ' + str(cumulative))
+            lines.append(name + '_sum' + format_labels(labels) + ' ' + repr(total))
+            lines.append(name + '_count' + format_labels(labels) + ' ' + str(count))
+
+        for (name, labels), value in counters:
+            name = self.prefix + name + '_total'
+            if name not in typed:
+                lines.append('# TYPE ' + name + ' counter')
+                typed.add(name)
+            lines.append(name + format_labels(labels) + ' ' + str(value))
+
+        for collector in self.collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                logger.error('collector_failed', error=repr(e))
+                continue
+            for name, labels, value in samples:
+                name = self.prefix + name
+                if name not in typed:
+                    lines.append('# TYPE ' + name + ' gauge')
+                    typed.add(name)
+                lines.append(name + format_labels(tuple(sorted(labels.items()))) + ' ' + str(float(value)))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """
+        /metrics を別スレッドのHTTPサーバーで公開する
+
+        :rtype: ThreadingHTTPServer
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info('metrics', url='http://' + host + ':' + str(server.server_address[1]) + '/metrics')
+        return server
+
+
+registry = Registry()
@@ -0,0 +1,161 @@
+##############################
+# APIの再試行（バックオフ・サーキットブレーカー・期限）
+##############################
+
+import random
+import threading
+import time
+
+from logger import logger
+
+
+class DeadlineExceeded(Exception):
+    """
+    期限までに成功しなかった
+    """
+
+
+class CircuitOpen(Exception):
+    """
+    失敗が続いているため呼び出さなかった
+    """
+
+
+class CircuitBreaker:
+    """
+    連続してthreshold回失敗したら開き、cooldown秒は呼び出さずに失敗させる
+
+    cooldown秒経ったら1回だけ試し、成功したら閉じ、失敗したらもう一度開く
+    """
+
+    def __init__(self, name, threshold=5, cooldown=30.0):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = 0
+        # 開いた時刻（閉じている場合はNone）
+        self.opened = None
+        # 試しに呼び出している最中か
+        self.trial = False
+
+    def remaining(self):
+        """
+        次に試せるまでの秒数（閉じている場合は0）
+
+        :rtype: float
+        """
+        with self.lock:
+            if self.opened is None:
+                return 0.0
+            return max(0.0, self.opened + self.cooldown - time.monotonic())
+
+    def allow(self):
+        """
+        呼び出してよいか
+
+        :rtype: bool
+        """
+        with self.lock:
+            if self.opened is None:
+                return True
+            if self.trial or time.monotonic() < self.opened + self.cooldown:
+                return False
+            self.trial = True
+            return True
+
+    def success(self):
+        with self.lock:
+            if self.opened is not None:
+                logger.info('circuit_closed', name=self.name)
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or (self.opened is None and self.failures >= self.threshold):
+                logger.warning('circuit_opened', name=self.name, failures=self.failures, cooldown=self.cooldown)
+                self.opened = time.monotonic()
+            self.trial = False
+
+    def state(self):
+        """
+        closed: 閉じている、open: 開いている、half_open: 次の呼び出しで試す
+
+        :rtype: str
+        """
+        with self.lock:
+            if self.opened is None:
+                return 'closed'
+            return 'open' if self.trial or time.monotonic() < self.opened + self.cooldown else 'half_open'
+
+
+class Backoff:
+    """
+    指数バックオフ（0からbase * 2^attemptまでの一様乱数、上限cap秒）
+
+    複数のBotが同時に再試行して再び集中しないように待ち時間をばらつかせる
+    """
+
+    def __init__(self, base=0.2, cap=10.0, seed=None):
+        self.base = base
+        self.cap = cap
+        self.rng = random.Random(seed)
+
+    def delay(self, attempt):
+        """
+        attempt回目の失敗の後に待つ秒数
+
+        :rtype: float
+        """
+        return self.rng.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+
+def remaining(deadline, minimum=0.05):
+    """
+    期限までの秒数（HTTPのタイムアウト用、期限がない場合はNone）
+
+    :rtype: float
+    """
+    if deadline is None:
+        return None
+    return max(minimum, deadline - time.monotonic())
+
+
+def call(fetch, name, breaker=None, backoff=None, attempts=None, deadline=None):
+    """
+    fetch()を呼び、失敗した場合は間隔を空けて再試行する
+
+    :param attempts: 呼び出す回数の上限（Noneの場合は成功するまで）
+    :param deadline: time.monotonic()での期限（それまでに成功しない場合はDeadlineExceeded・CircuitOpen）
+    """
+    backoff = backoff or Backoff()
+    attempt = 0
+    while True:
+        if breaker is not None and not breaker.allow():
+            wait = max(breaker.remaining(), 0.01)
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise CircuitOpen(name)
+            time.sleep(wait)
+            continue
+
+        try:
+            result = fetch()
+        except Exception as e:
+            if breaker is not None:
+                breaker.failure()
+            attempt += 1
+            if attempts is not None and attempt >= attempts:
+                raise
+            wait = backoff.delay(attempt)
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise DeadlineExceeded(name) from e
+            logger.warning('retry', name=name, attempt=attempt, wait=round(wait, 3), error=repr(e))
+            time.sleep(wait)
+            continue
+
+        if breaker is not None:
+            breaker.success()
+        return result
@@ -0,0 +1,283 @@
+##############################
+# 複数ペア・複数アルゴリズムの同時実行
+##############################
+
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import environment
+
+from algorithm import loss_cut, pause
+from api import book_buy_fills, buy, books, get_bought_amount, get_latest_trading_rate, get_sell_fills, market_sell, quote, store, warm_start
+from book import OrderBook
+from candle import CandleAggregator, CandleBuffer
+from dynamodb import set_result, start_results
+from indicator import IndicatorEngine
+from ledger import Ledger
+from logger import logger
+from metrics import registry
+from runtime import sample_prices
+from stream import MarketStream
+
+
+class Slot:
+    """
+    1つの(ペア, アルゴリズム, INTERVAL, 購入金額)の組み合わせと、そのポジションの状態
+    """
+
+    def __init__(self, pair, algorithm, interval, amount, params=None, name=None, simulation=environment.simulation):
+        self.pair = pair
+        self.coin = pair.split('_')[0]
+        self.algorithm = algorithm
+        self.interval = interval
+        self.amount = float(amount)
+        self.params = params or {}
+        # DynamoDBのキー（未指定の場合はアルゴリズム名）
+        self.name = name or algorithm
+        self.simulation = simulation
+
+        # 注文ID
+        self.order_id = None
+        # 保有している量
+        self.coin_amount = 0.0
+        # 購入金額
+        self.market_buy_amount = 0.0
+        # 約定から記録する損益
+        self.ledger = Ledger()
+        # 一時停止の終了時刻
+        self.paused_until = 0.0
+
+        self.candles = None
+        self.engine = None
+        self.collected = 0
+        self.reset()
+
+        # 保存済みの直近のローソク足があればすぐに取引を始める
+        collected = warm_start(self.warm_up_size(), self.warm_up_size() + 1, self.pair, self.interval)
+        if collected is not None:
+            self.candles = collected
+            self.engine.feed(collected.close)
+            self.collected = self.warm_up_size()
+
+    def warm_up_size(self):
+        """
+        取引開始までに集めるローソク足の本数
+
+        :rtype: int
+        """
+        return 2 if self.algorithm == 'DIFFERENCE' else 25
+
+    def reset(self):
+        """
+        サンプルデータを集め直す
+        """
+        self.candles = CandleBuffer(self.warm_up_size() + 1)
+        self.engine = IndicatorEngine(self.params, verbose=False)
+        self.collected = 0
+
+    def on_candle(self, candle):
+        """
+        確定したローソク足で売買を判定し、注文を入れる
+        """
+        if time.time() < self.paused_until:
+            return
+
+        self.candles.append(candle)
+        with registry.timer('indicator_seconds', algorithm=self.algorithm):
+            self.engine.update(candle['close'])
+            # サンプルデータ収集中は取引しない
+            if self.collected < self.warm_up_size():
+                self.collected += 1
+                return
+
+            result = self.engine.judge(self.algorithm)
+        registry.inc('candles', slot=self.name, pair=self.pair)
+        now_amount = candle['close'] * self.coin_amount
+        # ロスカット判定
+        loss_cut_flg = loss_cut(self.market_buy_amount, now_amount, self.engine.params['loss_cut'])
+
+        if self.order_id is None and result['buy_flg']:
+            self.buy()
+        elif self.order_id is not None and (result['sell_flg'] or loss_cut_flg):
+            self.sell()
+
+    def buy(self):
+        """
+        買い注文を入れる（成行）
+        """
+        logger.info('buy', slot=self.name, pair=self.pair, amount=self.amount)
+        # 判定してから注文が受け付けられるまでの時間を計測する
+        with registry.timer('order_ack_seconds', side='buy', slot=self.name):
+            if self.simulation:
+                order_rate = quote('buy', None, self.amount, self.pair)
+                order_json = {'id': 'simulation', 'market_buy_amount': self.amount, 'amount': order_rate['amount']}
+            else:
+                order_json = buy(self.amount, self.pair)
+        registry.inc('orders', side='buy', slot=self.name, success=order_json is not None)
+
+        # 買い注文成功の場合
+        if order_json is not None:
+            # 分割・指値で出し直した場合もすべての注文のIDを持つ（約定の合計に使う）
+            self.order_id = order_json.get('ids', [order_json['id']])
+            self.market_buy_amount = float(order_json['market_buy_amount'])
+            if self.simulation:
+                self.coin_amount = float(order_json['amount'])
+                self.ledger.buy(self.coin_amount, self.market_buy_amount)
+            else:
+                # 分割した場合はすべての注文の約定を合計する（揃わなければ売る前に取り直す）
+                if book_buy_fills(self.ledger, self.order_id, self.market_buy_amount):
+                    self.coin_amount = self.ledger.amount
+
+    def sell(self):
+        """
+        購入した量で売り注文を入れる（成行）
+        """
+        logger.info('sell', slot=self.name, pair=self.pair, order_id=self.order_id)
+        if not self.simulation:
+            # 約定が反映されていなかった場合は取り直す
+            if self.coin_amount <= 0:
+                self.coin_amount = get_bought_amount(self.order_id, self.coin)
+            with registry.timer('order_ack_seconds', side='sell', slot=self.name):
+                order_json = market_sell(self.coin_amount, self.pair)
+            registry.inc('orders', side='sell', slot=self.name, success=order_json is not None)
+            if order_json is None:
+                return
+            # 実際に約定した数量・金額・手数料から利益を計算する
+            fills = get_sell_fills(order_json, self.pair)
+            # 買いの約定が記録できていなかった場合は取り直す
+            if self.ledger.amount <= 0:
+                book_buy_fills(self.ledger, self.order_id, self.market_buy_amount, fills['amount'])
+        else:
+            # シミュレーションは板から見積もった金額で約定したことにする
+            order_rate_json = quote('sell', self.coin_amount, None, self.pair)
+            fills = {'amount': self.coin_amount, 'jpy': float(order_rate_json['price']), 'fee': 0.0}
+
+        profit = self.ledger.sell(fills['amount'], fills['jpy'], fills['fee'])
+        set_result(self.simulation, self.name, self.interval, profit)
+
+        pause_result = pause(self.market_buy_amount, profit, self.ledger.recent, self.engine.params['loss_cut'])
+        self.order_id = None
+        self.coin_amount = 0.0
+        self.market_buy_amount = 0.0
+
+        # 1%以上の損失を出している、もしくは連続で損失が出たら一時停止する
+        if (pause_result['loss_flg'] or pause_result['down_flg']) and not self.simulation:
+            logger.warning('pause', slot=self.name, pair=self.pair, **pause_result)
+            # main.pyのsleep(5)と同じ時間
+            self.paused_until = time.time() + self.interval * 5 * self.interval
+            self.ledger.reset(profit)
+            self.reset()
+
+    def status(self):
+        """
+        現在の状態
+
+        :rtype: object
+        """
+        return {
+            'name': self.name,
+            'pair': self.pair,
+            'interval': self.interval,
+            'profit': self.ledger.profit,
+            'pnl': self.ledger.stats(),
+            'order_id': self.order_id,
+            'coin_amount': self.coin_amount,
+            'market_buy_amount': self.market_buy_amount,
+            'paused': time.time() < self.paused_until
+        }
+
+
+def load_slots(path):
+    """
+    設定ファイル（JSON）を読み込む
+
+    [{"pair": "btc_jpy", "algorithm": "MACD", "interval": 60, "amount": 10000, "params": {...}, "name": "..."}, ...]
+
+    :rtype: list
+    """
+    with open(path) as f:
+        return [Slot(**config) for config in json.load(f)]
+
+
+async def run(slots, feed=environment.FEED):
+    """
+    ペアごとに1つの価格取得（またはWebSocket購読）を全スロットで共有して実行する
+    """
+    loop = asyncio.get_running_loop()
+    # 注文はスロットをまたいで1つずつ行う
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    # (ペア, INTERVAL)ごとのローソク足の集計と購読しているスロット
+    aggregators = {}
+    subscribers = {}
+    for slot in slots:
+        key = (slot.pair, slot.interval)
+        aggregators.setdefault(key, CandleAggregator(slot.interval))
+        subscribers.setdefault(key, []).append(slot)
+
+    def dispatch(key, candles):
+        for candle in candles:
+            store.append_candle(key[0], key[1], candle)
+            for slot in subscribers[key]:
+                future = loop.run_in_executor(executor, slot.on_candle, candle)
+                future.add_done_callback(lambda future, slot=slot: report(future, slot))
+
+    def report(future, slot):
+        if future.exception() is not None:
+            logger.error('slot_failed', slot=slot.name, error=repr(future.exception()))
+        logger.info('status', **slot.status())
+
+    def on_price(pair):
+        def receive(timestamp, price, amount=0.0):
+            store.append_tick(pair, timestamp, price, amount)
+            for key, aggregator in aggregators.items():
+                if key[0] == pair:
+                    dispatch(key, aggregator.add(time.time(), price, amount))
+        return receive
+
+    tasks = []
+    for pair in sorted(set(slot.pair for slot in slots)):
+        if feed == 'websocket':
+            # 板の差分も購読し、見積もり用の板の写しを更新する
+            stream = MarketStream(pair, environment.WS_URL, on_trade=on_price(pair), on_orderbook=books.setdefault(pair, OrderBook(pair)).apply)
+            tasks.append(asyncio.create_task(stream.run()))
+        else:
+            tasks.append(asyncio.create_task(sample_prices(on_price(pair), lambda pair=pair: get_latest_trading_rate(pair))))
+
+    # 約定のない区間もINTERVALの境界で確定する
+    while True:
+        now = time.time()
+        await asyncio.sleep(int(now) + 1 - now)
+        for key, aggregator in aggregators.items():
+            dispatch(key, aggregator.flush(time.time()))
+        for task in tasks:
+            if task.done():
+                task.result()
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else os.getenv('SLOTS')
+    if path is None:
+        print('Usage: python runner.py slots.json')
+        sys.exit()
+
+    slots = load_slots(path)
+    # 前回DynamoDBに書き込めなかった結果を再送する
+    start_results()
+    # スロットごとの損益を計測値として公開する
+    registry.collect(lambda: [('pnl_' + key, {'slot': slot.name, 'pair': slot.pair}, value)
+                              for slot in slots for key, value in slot.ledger.stats().items()])
+    if environment.METRICS_PORT:
+        registry.serve(int(environment.METRICS_PORT), environment.METRICS_HOST)
+
+    for slot in slots:
+        logger.info('status', **slot.status())
+    asyncio.run(run(slots))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+##############################
+# 非同期実行（asyncio）
+##############################
+
+import asyncio
+import time
+
+import environment
+
+from api import books, get_latest_trading_rate, print_sampling, store, warm_start
+from book import OrderBook
+from candle import CandleBuffer
+from logger import logger
+from stream import stream_candles
+
+
+async def sample_candles(queue, interval, fetch=get_latest_trading_rate):
+    """
+    1秒ごとに価格を取得してローソク足を作り、確定したものをqueueに入れる
+
+    取得は単調時計上の一定間隔で行い、ローソク足の区切りは壁時計のINTERVAL秒の境界に合わせる。
+    取得が1秒以内に終わらない場合は直前の価格を使い、遅れを次の取得に持ち越さない。
+    """
+    loop = asyncio.get_running_loop()
+    # 次の壁時計の境界を単調時計に換算する
+    wall = time.time()
+    boundary = (wall // interval + 1) * interval
+    start = loop.time() + boundary - wall
+
+    async def emit(candle):
+        store.append_candle(environment.PAIR, interval, candle, boundary + window * interval)
+        await queue.put(candle)
+
+    tick = 0
+    price = None
+    pending = None
+    candle = {}
+    window = 0
+    while True:
+        await asyncio.sleep(max(0.0, start + tick - loop.time()))
+
+        # 前回の取得が終わっていない場合は新たに取得しない
+        if pending is None:
+            pending = asyncio.ensure_future(asyncio.to_thread(fetch))
+        done, _ = await asyncio.wait({pending}, timeout=max(0.0, start + tick + 0.9 - loop.time()))
+        if done:
+            try:
+                price = pending.result()
+                store.append_tick(environment.PAIR, time.time(), price)
+            except Exception as e:
+                logger.error('fetch_failed', error=repr(e))
+            pending = None
+
+        # 区切りをまたいだ場合は途中までのローソク足を確定する
+        if candle and tick // interval != window:
+            await emit(candle)
+            candle = {}
+        window = tick // interval
+        sec = tick % interval + 1
+
+        if price is not None:
+            if not candle:
+                candle = {'open': price, 'high': price, 'low': price}
+            candle['high'] = price if price > candle['high'] else candle['high']
+            candle['low'] = price if price < candle['low'] else candle['low']
+            candle['close'] = price
+            print_sampling(sec, candle)
+
+        if sec == interval and candle:
+            await emit(candle)
+            candle = {}
+
+        # 処理が大きく遅れた場合は過ぎた時刻を飛ばす
+        tick = max(tick + 1, int(loop.time() - start))
+
+
+async def sample_prices(on_price, fetch, period=1):
+    """
+    単調時計上の一定間隔で価格を取得し、on_price(時刻, 価格)に渡す
+
+    取得が間隔内に終わらない場合はその回を飛ばし、遅れを次の取得に持ち越さない
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    tick = 0
+    pending = None
+    while True:
+        await asyncio.sleep(max(0.0, start + tick * period - loop.time()))
+
+        # 前回の取得が終わっていない場合は新たに取得しない
+        if pending is None:
+            pending = asyncio.ensure_future(asyncio.to_thread(fetch))
+        done, _ = await asyncio.wait({pending}, timeout=max(0.0, start + (tick + 0.9) * period - loop.time()))
+        if done:
+            try:
+                on_price(time.time(), pending.result())
+            except Exception as e:
+                logger.error('fetch_failed', error=repr(e))
+            pending = None
+
+        tick = max(tick + 1, int((loop.time() - start) / period))
+
+
+async def next_candle(queue, sampler):
+    """
+    次のローソク足を待つ（価格の取得が異常終了した場合は待ち続けずにその例外を出す）
+
+    :rtype: object
+    """
+    getter = asyncio.ensure_future(queue.get())
+    done, _ = await asyncio.wait({getter, sampler}, return_when=asyncio.FIRST_COMPLETED)
+    if getter in done:
+        return getter.result()
+    getter.cancel()
+    sampler.result()
+    raise RuntimeError('sampler stopped')
+
+
+async def collect(queue, how_many_samples, sampler):
+    """
+    取引をせずにローソク足を集める
+
+    :rtype: CandleBuffer
+    """
+    logger.info('collecting', seconds=how_many_samples * environment.INTERVAL)
+    candles = CandleBuffer(how_many_samples)
+    for i in range(1, how_many_samples + 1):
+        candles.append(await next_candle(queue, sampler))
+        logger.info('collected', count=i, total=how_many_samples)
+    logger.info('collection_complete')
+    return candles
+
+
+def drain(queue):
+    """
+    溜まっているローソク足を捨てる
+    """
+    while not queue.empty():
+        queue.get_nowait()
+
+
+async def run(trade, warm_up, report, how_many_samples, hour=5, collected=None):
+    """
+    価格の取得と売買を並行して実行する
+
+    :param trade: ローソク足1本ごとの売買処理（一時停止する場合はTrueを返す）
+    :param warm_up: 集めたサンプルデータでインジケーターを初期化する処理
+    :param report: 状態の表示
+    :param collected: 起動時に作ったサンプルデータ（ない場合は保存済みのローソク足から作るか集める）
+    """
+    queue = asyncio.Queue()
+    if environment.FEED == 'websocket':
+        sampler = asyncio.create_task(stream_candles(queue, environment.INTERVAL, environment.PAIR, environment.WS_URL, store,
+                                                     books.setdefault(environment.PAIR, OrderBook(environment.PAIR)).apply))
+    else:
+        sampler = asyncio.create_task(sample_candles(queue, environment.INTERVAL))
+    background = set()
+
+    # 保存済みの直近のローソク足があればそれを使う（ポジションを持ったまま再開した場合は取引履歴からでも作る）
+    # 取引履歴の取得・APIキーの確認・突き合わせは別スレッドで行い、価格の取得を止めない
+    collected = collected or await asyncio.to_thread(warm_start, how_many_samples, force=environment.order_id is not None)
+    await asyncio.to_thread(warm_up, collected or await collect(queue, how_many_samples, sampler))
+    while True:
+        candle = await next_candle(queue, sampler)
+        # 残高確認・注文・DynamoDB連携は別スレッドで行い、価格の取得を止めない
+        if await asyncio.to_thread(trade, candle):
+            # 一時停止（main.pyのsleep(hour)と同じ時間）
+            await asyncio.sleep(environment.INTERVAL * hour * environment.INTERVAL)
+            drain(queue)
+            collected = await asyncio.to_thread(warm_start, how_many_samples)
+            await asyncio.to_thread(warm_up, collected or await collect(queue, how_many_samples, sampler))
+
+        task = asyncio.create_task(asyncio.to_thread(report))
+        background.add(task)
+        task.add_done_callback(background.discard)
@@ -0,0 +1,159 @@
+##############################
+# 状態の保存（再起動後の再開）
+##############################
+
+import json
+import os
+import threading
+import time
+
+from logger import logger
+
+
+class StateStore:
+    """
+    ポジションなどの状態を1つのJSONファイルに保存し、注文の意図を先行ログ（journal）に書く
+
+    状態は一時ファイルに書いてfsyncしてから置き換えるため、途中で落ちても前回の状態が残る。
+    注文を出す前に意図を書き、状態を保存した後に完了を書くため、
+    完了していない意図が残っている場合は注文を出した後に落ちた可能性がある（取引所と突き合わせる）
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.lock = threading.Lock()
+        # 完了していない意図のseq
+        self.open = set(intent['seq'] for intent in self.pending())
+        self.seq = max(self.open or [0])
+
+    def load(self):
+        """
+        保存した状態（ない場合・壊れている場合はNone）
+
+        :rtype: object
+        """
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except ValueError as e:
+            logger.error('state_corrupted', path=self.path, error=str(e))
+            return None
+
+    def save(self, state):
+        """
+        状態を保存する（一時ファイルに書いてから置き換える）
+        """
+        with self.lock:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(dict(state, saved=time.time()), f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self.sync_directory()
+
+    def sync_directory(self):
+        # 置き換えたことをディレクトリにも反映する（対応していない環境では何もしない）
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def write(self, record):
+        with open(self.journal_path, 'a') as f:
+            f.write(json.dumps(record, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def intent(self, action, **fields):
+        """
+        注文を出す前に意図を書く
+
+        :rtype: int seq（完了時にdoneに渡す）
+        """
+        with self.lock:
+            self.seq += 1
+            self.write(dict(fields, seq=self.seq, action=action, status='intent', time=time.time()))
+            self.open.add(self.seq)
+            return self.seq
+
+    def done(self, seq, **fields):
+        """
+        意図の完了を書く（完了していない意図がなくなったらjournalを空にする）
+        """
+        with self.lock:
+            self.open.discard(seq)
+            if len(self.open) == 0:
+                self.truncate()
+            else:
+                self.write(dict(fields, seq=seq, status='done', time=time.time()))
+
+    def truncate(self):
+        with open(self.journal_path, 'w') as f:
+            f.flush()
+            os.fsync(f.fileno())
+
+    def pending(self):
+        """
+        完了していない意図（古い順、書き込み途中で落ちた行は無視する）
+
+        :rtype: list
+        """
+        if not os.path.exists(self.journal_path):
+            return []
+        intents = {}
+        with open(self.journal_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record['status'] == 'intent':
+                    intents[record['seq']] = record
+                else:
+                    intents.pop(record['seq'], None)
+        return list(intents.values())
+
+    def clear(self):
+        """
+        突き合わせが終わった意図をすべて捨てる
+        """
+        with self.lock:
+            self.open = set()
+            self.truncate()
+
+
+def match_intents(pending, transaction_index, pair, order_id, coin_amount):
+    """
+    完了していない意図を取引履歴・残高と突き合わせ、注文を出した後に落ちていた注文を返す
+
+    意図を書いた時点より後に最初の約定がある同じペア・売買の注文をその意図の注文とみなす。
+    買いはポジションを持っておらず残高がある場合、売りはポジションを持っている場合だけ採用する
+
+    :param order_id: 保存した状態の注文ID（ポジションを持っていない場合はNone）
+    :param coin_amount: 取引所の残高（数量）
+    :rtype: list {'intent', 'order_ids', 'fills'}（古い順）
+    """
+    matched = []
+    holding = order_id is not None
+    for intent in pending:
+        order_ids = transaction_index.orders_after(intent.get('last_id'), pair, intent['action'])
+        if len(order_ids) == 0:
+            continue
+        if intent['action'] == 'buy' and not holding and coin_amount > 0:
+            holding = True
+        elif intent['action'] == 'sell' and holding:
+            holding = False
+        else:
+            continue
+        matched.append({'intent': intent, 'order_ids': order_ids, 'fills': transaction_index.fills(order_ids)})
+    return matched
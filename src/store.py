@@ -0,0 +1,170 @@
+##############################
+# 約定・ローソク足の保存
+##############################
+
+import os
+import threading
+import time
+
+import numpy as np
+
+# 約定（時刻, レート, 数量）
+TICK_DTYPE = np.dtype([('time', '<f8'), ('rate', '<f8'), ('amount', '<f8')])
+# ローソク足（区間の開始時刻, OHLCV）
+CANDLE_DTYPE = np.dtype([('time', '<f8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'), ('volume', '<f8')])
+
+
+def day_of(timestamp):
+    """
+    パーティションの日付（UTC）
+
+    :rtype: str
+    """
+    return time.strftime('%Y-%m-%d', time.gmtime(timestamp))
+
+
+class MarketStore:
+    """
+    約定とローソク足をペア・日付ごとのファイルに追記し、メモリマップで読み込む
+
+    root/ペア/日付/ticks.bin と root/ペア/日付/candles_INTERVAL.bin に固定長のレコードを並べるだけなので、
+    読み込み時に変換は不要で、1日分であればコピーせずにそのまま参照できる
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        # 追記中のファイル（(ペア, 種類) → (日付, ファイル)）
+        self.files = {}
+
+    def path(self, pair, day, name):
+        return os.path.join(self.root, pair, day, name + '.bin')
+
+    def append(self, pair, timestamp, name, record):
+        """
+        レコードを1件追記する（日付が変わった場合は新しいファイルにする）
+        """
+        day = day_of(timestamp)
+        with self.lock:
+            opened = self.files.get((pair, name))
+            if opened is None or opened[0] != day:
+                # 日付が変わったファイルは閉じる
+                if opened is not None:
+                    opened[1].close()
+                path = self.path(pair, day, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                f = open(path, 'ab')
+                # 書き込み途中で落ちた場合の半端なレコードを切り捨てる
+                size = f.seek(0, os.SEEK_END)
+                if size % record.itemsize != 0:
+                    f.truncate(size - size % record.itemsize)
+                opened = (day, f)
+                self.files[(pair, name)] = opened
+            opened[1].write(record.tobytes())
+            opened[1].flush()
+
+    def append_tick(self, pair, timestamp, rate, amount=0.0):
+        """
+        約定（取得した価格）を1件保存する
+        """
+        self.append(pair, timestamp, 'ticks', np.array([(timestamp, rate, amount)], dtype=TICK_DTYPE))
+
+    def append_candle(self, pair, interval, candle, timestamp=None):
+        """
+        確定したローソク足を1本保存する
+
+        :param timestamp: 区間の開始時刻（省略時はcandle['time']）
+        """
+        timestamp = candle['time'] if timestamp is None else timestamp
+        record = np.array([(timestamp, candle['open'], candle['high'], candle['low'], candle['close'],
+                            candle.get('volume', 0.0))], dtype=CANDLE_DTYPE)
+        self.append(pair, timestamp, 'candles_' + str(interval), record)
+
+    def days(self, pair):
+        """
+        保存されている日付（古い順）
+
+        :rtype: list
+        """
+        directory = os.path.join(self.root, pair)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(os.listdir(directory))
+
+    def open(self, path, dtype):
+        """
+        ファイルを読み込み専用でメモリマップする
+
+        :rtype: numpy.ndarray
+        """
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        length = size // dtype.itemsize
+        if length == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', shape=(length,))
+
+    def read(self, pair, name, dtype, start=None, end=None):
+        """
+        期間[start, end)のレコード（1日分の場合はメモリマップのビュー、複数日の場合は連結したコピー）
+
+        :rtype: numpy.ndarray
+        """
+        first = None if start is None else day_of(start)
+        last = None if end is None else day_of(end)
+        parts = []
+        for day in self.days(pair):
+            if (first is not None and day < first) or (last is not None and day > last):
+                continue
+            records = self.open(self.path(pair, day, name), dtype)
+            times = records['time']
+            lo = 0 if start is None else np.searchsorted(times, start, 'left')
+            hi = len(records) if end is None else np.searchsorted(times, end, 'left')
+            if hi > lo:
+                parts.append(records[lo:hi])
+        if len(parts) == 0:
+            return np.empty(0, dtype=dtype)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts)
+
+    def ticks(self, pair, start=None, end=None):
+        """
+        期間[start, end)の約定
+
+        :rtype: numpy.ndarray
+        """
+        return self.read(pair, 'ticks', TICK_DTYPE, start, end)
+
+    def candles(self, pair, interval, start=None, end=None):
+        """
+        期間[start, end)のローソク足
+
+        :rtype: numpy.ndarray
+        """
+        return self.read(pair, 'candles_' + str(interval), CANDLE_DTYPE, start, end)
+
+    def recent_candles(self, pair, interval, n):
+        """
+        直近n本のローソク足（新しい日付から遡って読む）
+
+        :rtype: numpy.ndarray
+        """
+        parts = []
+        count = 0
+        for day in reversed(self.days(pair)):
+            records = self.open(self.path(pair, day, 'candles_' + str(interval)), CANDLE_DTYPE)
+            if len(records) == 0:
+                continue
+            parts.insert(0, records[-(n - count):])
+            count += len(parts[0])
+            if count >= n:
+                break
+        if len(parts) == 0:
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def close(self):
+        with self.lock:
+            for day, f in self.files.values():
+                f.close()
+            self.files = {}
@@ -0,0 +1,136 @@
+##############################
+# WebSocket（リアルタイム配信）
+##############################
+
+import asyncio
+import json
+import time
+
+from candle import CandleAggregator
+from logger import logger
+
+# Coincheck Public WebSocket API
+WS_URL = 'wss://ws-api.coincheck.com/'
+
+
+def parse_trades(message):
+    """
+    trades チャンネルのメッセージを(時刻, レート, 数量)のリストにする
+
+    新形式: [["時刻", "ID", "ペア", "レート", "数量", "売買", ...], ...]
+    旧形式: ["ID", "ペア", "レート", "数量", "売買"]
+
+    :rtype: list
+    """
+    if len(message) > 0 and isinstance(message[0], list):
+        return [(float(trade[0]), float(trade[3]), float(trade[4])) for trade in message]
+    return [(time.time(), float(message[2]), float(message[3]))]
+
+
+def parse_orderbook(message):
+    """
+    orderbook チャンネルのメッセージを板の差分にする
+
+    ["ペア", {"bids": [["レート", "数量"], ...], "asks": [...]}]
+
+    :rtype: object
+    """
+    pair, book = message
+    return {
+        'pair': pair,
+        'bids': [(float(rate), float(amount)) for rate, amount in book.get('bids', [])],
+        'asks': [(float(rate), float(amount)) for rate, amount in book.get('asks', [])]
+    }
+
+
+class MarketStream:
+    """
+    約定・板のチャンネルを購読し続ける（切断時は再接続して購読し直す）
+    """
+
+    def __init__(self, pair, url=WS_URL, on_trade=None, on_orderbook=None, max_backoff=30):
+        self.pair = pair
+        self.url = url
+        self.on_trade = on_trade
+        self.on_orderbook = on_orderbook
+        self.max_backoff = max_backoff
+        self.connects = 0
+        self.messages = 0
+
+    def channels(self):
+        channels = []
+        if self.on_trade is not None:
+            channels.append(self.pair + '-trades')
+        if self.on_orderbook is not None:
+            channels.append(self.pair + '-orderbook')
+        return channels
+
+    def dispatch(self, raw):
+        """
+        受信したメッセージをチャンネルごとのコールバックに渡す
+        """
+        message = json.loads(raw)
+        self.messages += 1
+        # 板は ["ペア", {...}]、約定はそれ以外
+        if len(message) == 2 and isinstance(message[1], dict):
+            if self.on_orderbook is not None:
+                self.on_orderbook(parse_orderbook(message))
+        elif self.on_trade is not None:
+            for timestamp, rate, amount in parse_trades(message):
+                self.on_trade(timestamp, rate, amount)
+
+    async def run(self):
+        """
+        接続・購読・受信を繰り返す
+        """
+        import websockets
+
+        backoff = 1
+        while True:
+            try:
+                async with websockets.connect(self.url) as ws:
+                    self.connects += 1
+                    for channel in self.channels():
+                        await ws.send(json.dumps({'type': 'subscribe', 'channel': channel}))
+                    backoff = 1
+                    async for raw in ws:
+                        self.dispatch(raw)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning('websocket_disconnected', url=self.url, error=repr(e), backoff=backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+
+async def stream_candles(queue, interval, pair, url=WS_URL, store=None, on_orderbook=None):
+    """
+    約定の配信からローソク足を作り、確定したものをqueueに入れる（runtime.sample_candlesの代わり）
+
+    約定は受信時刻で区切り、約定がない区間もINTERVAL秒の境界で確定する
+
+    :param store: 約定・ローソク足の保存先（store.MarketStore）
+    :param on_orderbook: 板の差分を受け取る関数（指定した場合は板も購読する）
+    """
+    aggregator = CandleAggregator(interval)
+
+    def emit(candles):
+        for candle in candles:
+            if store is not None:
+                store.append_candle(pair, interval, candle)
+            queue.put_nowait(candle)
+
+    def on_trade(timestamp, rate, amount):
+        if store is not None:
+            store.append_tick(pair, timestamp, rate, amount)
+        emit(aggregator.add(time.time(), rate, amount))
+
+    stream = MarketStream(pair, url, on_trade=on_trade, on_orderbook=on_orderbook)
+    task = asyncio.create_task(stream.run())
+    try:
+        while True:
+            now = time.time()
+            await asyncio.sleep((now // interval + 1) * interval - now)
+            emit(aggregator.flush(time.time()))
+    finally:
+        task.cancel()
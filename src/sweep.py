@@ -0,0 +1,184 @@
+##############################
+# パラメータ探索
+##############################
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from algorithm import DEFAULT_PARAMS
+from backtest import ALGORITHMS, load_store, read_table, run, to_candles
+
+# 探索するパラメータの候補
+SPACE = {
+    'duration': [10, 20, 30],
+    'sigma': [1.5, 2, 2.5, 3],
+    'fast': [8, 12, 16],
+    'slow': [21, 26, 34],
+    'signal': [5, 9, 12],
+    'rsi_duration': [9, 14, 21],
+    'rsi_buy': [20, 25, 30, 35],
+    'rsi_sell': [65, 70, 75, 80],
+    'loss_cut': [0.005, 0.01, 0.02, 0.03]
+}
+
+# アルゴリズムごとに影響するパラメータ
+RELEVANT_PARAMS = {
+    'DIFFERENCE': ['loss_cut'],
+    'BOLLINGER_BANDS': ['duration', 'sigma', 'loss_cut'],
+    'MACD': ['fast', 'slow', 'signal', 'loss_cut'],
+    'HYBRID': ['duration', 'sigma', 'fast', 'slow', 'signal', 'loss_cut'],
+    'RSI': ['rsi_duration', 'rsi_buy', 'rsi_sell', 'loss_cut'],
+    'MIX': list(DEFAULT_PARAMS.keys())
+}
+
+# ワーカープロセスから参照する共有メモリ上の終値（INTERVALごと）
+shared_close = {}
+shared_blocks = []
+
+
+def share(close_by_interval):
+    """
+    INTERVALごとの終値を共有メモリに置く
+
+    :rtype: object
+    """
+    blocks = []
+    specs = {}
+    for interval, close in close_by_interval.items():
+        block = shared_memory.SharedMemory(create=True, size=max(close.nbytes, 1))
+        np.ndarray(close.shape, dtype=np.float64, buffer=block.buf)[:] = close
+        blocks.append(block)
+        specs[interval] = (block.name, close.shape)
+    return blocks, specs
+
+
+def attach(specs):
+    """
+    ワーカープロセスの初期化（共有メモリの終値をコピーせずに参照する）
+    """
+    for interval, (name, shape) in specs.items():
+        block = shared_memory.SharedMemory(name=name)
+        shared_blocks.append(block)
+        shared_close[interval] = np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+
+
+def evaluate(task):
+    """
+    1つのパラメータの組み合わせをバックテストする
+
+    :rtype: object
+    """
+    algorithm, interval, params, options = task
+    result = run({'close': shared_close[interval]}, algorithm, interval, params=params, **options)
+    result.update(params)
+    return result
+
+
+def combinations(algorithm, space, samples=None, seed=None):
+    """
+    アルゴリズムに関係するパラメータの組み合わせ（samples指定時はランダムに抽出）
+
+    :rtype: list
+    """
+    keys = [key for key in RELEVANT_PARAMS[algorithm] if key in space]
+    grid = [dict(zip(keys, values)) for values in itertools.product(*[space[key] for key in keys])]
+    # MACDの短期が長期以上になる組み合わせは除く
+    grid = [params for params in grid
+            if params.get('fast', DEFAULT_PARAMS['fast']) < params.get('slow', DEFAULT_PARAMS['slow'])]
+    if samples is not None and samples < len(grid):
+        grid = random.Random(seed).sample(grid, samples)
+    return grid
+
+
+def sweep(path, algorithms, intervals, space=SPACE, samples=None, workers=None, seed=None, sort='profit', pair='btc_jpy', **options):
+    """
+    アルゴリズム・INTERVAL・パラメータの組み合わせをプロセスプールで並列にバックテストする
+
+    :rtype: list
+    """
+    if os.path.isdir(path):
+        close_by_interval = {interval: np.ascontiguousarray(load_store(path, pair, interval)['close'], dtype=np.float64)
+                             for interval in intervals}
+    else:
+        df = read_table(path)
+        close_by_interval = {interval: np.ascontiguousarray(to_candles(df, interval)['close'], dtype=np.float64)
+                             for interval in intervals}
+    tasks = [(algorithm, interval, params, options)
+             for algorithm in algorithms
+             for interval in intervals
+             for params in combinations(algorithm, space, samples, seed)]
+
+    workers = workers or os.cpu_count()
+    blocks, specs = share(close_by_interval)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=attach, initargs=(specs,)) as executor:
+            # タスクを小分けにまとめてプロセス間通信の回数を減らす
+            chunksize = max(1, len(tasks) // (workers * 4))
+            results = list(executor.map(evaluate, tasks, chunksize=chunksize))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    results.sort(key=lambda result: result[sort], reverse=True)
+    for rank, result in enumerate(results, 1):
+        result['rank'] = rank
+    return results
+
+
+def write_results(results, path):
+    """
+    順位付きの結果をCSVに出力する
+    """
+    columns = ['rank', 'algorithm', 'interval', 'profit', 'max_drawdown', 'trades', 'win_rate', 'pauses'] + list(DEFAULT_PARAMS.keys())
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='アルゴリズム・INTERVAL・パラメータの組み合わせを並列にバックテストする')
+    parser.add_argument('path', help='CSV/Parquetファイル、または約定・ローソク足の保存先（STORE_DIR）')
+    parser.add_argument('--pair', default=(os.getenv('COIN') or 'btc') + '_jpy', help='保存先から読み込むペア')
+    parser.add_argument('--algorithms', default='ALL', help='カンマ区切り（ALLで全アルゴリズム）')
+    parser.add_argument('--intervals', default=os.getenv('INTERVAL', '60'), help='カンマ区切り')
+    parser.add_argument('--space', help='探索するパラメータの候補（JSONファイル）')
+    parser.add_argument('--random', type=int, help='組み合わせごとにランダムに抽出する件数')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--sort', default='profit')
+    parser.add_argument('--amount', type=float, default=float(os.getenv('AMOUNT') or 100000))
+    parser.add_argument('--fee', type=float, default=0.0)
+    parser.add_argument('--pause-hours', type=int, default=5)
+    parser.add_argument('--output', default='sweep.csv')
+    args = parser.parse_args()
+
+    algorithms = ALGORITHMS if args.algorithms == 'ALL' else args.algorithms.split(',')
+    intervals = [int(interval) for interval in args.intervals.split(',')]
+    space = SPACE
+    if args.space:
+        with open(args.space) as f:
+            space = json.load(f)
+
+    start = time.perf_counter()
+    results = sweep(args.path, algorithms, intervals, space, args.random, args.workers, args.seed, args.sort, args.pair,
+                    amount=args.amount, fee=args.fee, pause_hours=args.pause_hours)
+    write_results(results, args.output)
+
+    print(str(len(results)) + ' backtests (' + str(round(time.perf_counter() - start, 3)) + ' sec) -> ' + args.output)
+    for result in results[:10]:
+        print(result)
+
+
+if __name__ == '__main__':
+    main()
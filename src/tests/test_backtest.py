@@ -0,0 +1,50 @@
+##############################
+# バックテストのテスト
+##############################
+
+import numpy as np
+import pytest
+
+import backtest
+from candle import CandleAggregator
+from test_indicator import random_walk
+
+
+@pytest.mark.parametrize('algorithm', backtest.ALGORITHMS)
+def test_vectorized_matches_streaming(algorithm):
+    """
+    一時停止から再開した後も、一括計算とローソク足ごとの判定で同じ取引になる
+    """
+    candles = {'close': random_walk(20000, seed=1)}
+    vectorized = backtest.run(candles, algorithm, 2, vectorized=True)
+    streaming = backtest.run(candles, algorithm, 2, vectorized=False)
+
+    assert vectorized['pauses'] > 0
+    assert vectorized['trades'] == streaming['trades']
+    assert vectorized['pauses'] == streaming['pauses']
+    assert vectorized['profit'] == pytest.approx(streaming['profit'])
+
+
+def test_aggregate_trades_fills_empty_intervals():
+    """
+    約定のない区間は直前の終値で出来高0のローソク足になり、CandleAggregatorと同じローソク足になる
+    """
+    timestamps = np.array([0.5, 10.0, 59.0, 61.0, 62.0, 250.0, 299.0])
+    rates = np.array([100.0, 110.0, 90.0, 105.0, 95.0, 120.0, 130.0])
+    amounts = np.array([0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7])
+    candles = backtest.aggregate_trades(timestamps, rates, 60, amounts)
+
+    assert candles['time'].tolist() == [0, 60, 120, 180, 240]
+    assert candles['open'].tolist() == [100.0, 105.0, 95.0, 95.0, 120.0]
+    assert candles['high'].tolist() == [110.0, 105.0, 95.0, 95.0, 130.0]
+    assert candles['low'].tolist() == [90.0, 95.0, 95.0, 95.0, 120.0]
+    assert candles['close'].tolist() == [90.0, 95.0, 95.0, 95.0, 130.0]
+    assert candles['volume'].tolist() == pytest.approx([0.6, 0.9, 0.0, 0.0, 1.3])
+
+    aggregator = CandleAggregator(60)
+    live = []
+    for timestamp, rate, amount in zip(timestamps, rates, amounts):
+        live += aggregator.add(timestamp, rate, amount)
+    live += aggregator.flush(300)
+    for column in ['time', 'open', 'high', 'low', 'close', 'volume']:
+        assert candles[column].tolist() == pytest.approx([candle[column] for candle in live])
@@ -0,0 +1,10 @@
+##############################
+# 同時リクエストのテスト
+##############################
+
+from benchmark import stress
+
+
+def test_stress_accepts_every_signed_request():
+    # スレッドとasyncioから同時に送っても、模擬サーバーが署名・nonceを拒否しない
+    assert stress(requests=200, threads=4, tasks=4)
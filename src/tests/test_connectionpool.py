@@ -0,0 +1,120 @@
+##############################
+# コネクションプールのテスト
+##############################
+
+import http.client
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from coincheck.connectionpool import ConnectionPool
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    keep-aliveで応答する（server.dropの間は応答せずに切断する）
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+    def respond(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.server.received.append(self.command)
+        if self.server.drop:
+            # 受け取った後に応答せずに切断する（サーバーがkeep-aliveの接続を閉じた場合）
+            self.server.drop = False
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = True
+            return
+        body = b'{"success": true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.received = []
+    server.drop = False
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def create_pool(server):
+    return ConnectionPool('127.0.0.1', server.server_address[1], secure=False, size=2, timeout=5)
+
+
+def test_reuses_keep_alive_connection(server):
+    pool = create_pool(server)
+    for _ in range(3):
+        assert pool.request('GET', '/api/ticker') == (200, b'{"success": true}')
+
+    # 1回だけ接続し、残りは同じ接続で送る
+    stats = pool.stats()
+    assert stats['created'] == 1
+    assert stats['reused'] == 2
+    assert stats['idle'] == 1
+    pool.close()
+
+
+def test_replaces_idle_connection_closed_by_server(server, monkeypatch):
+    # 待機中の接続はすぐにサーバーから閉じられる
+    monkeypatch.setattr(Handler, 'timeout', 0.1)
+    pool = create_pool(server)
+    assert pool.request('GET', '/api/ticker')[0] == 200
+    time.sleep(0.3)
+
+    # 閉じられた接続は送る前に捨てて接続し直す
+    assert pool.request('GET', '/api/ticker')[0] == 200
+    stats = pool.stats()
+    assert stats['created'] == 2
+    assert stats['reconnected'] == 1
+    assert server.received == ['GET', 'GET']
+    pool.close()
+
+
+def test_resends_get_dropped_on_reused_connection(server):
+    pool = create_pool(server)
+    assert pool.request('GET', '/api/ticker')[0] == 200
+
+    # 再利用した接続が切断されたGETは新しい接続で送り直す（呼び出し元には見えない）
+    server.drop = True
+    assert pool.request('GET', '/api/ticker') == (200, b'{"success": true}')
+    stats = pool.stats()
+    assert stats['created'] == 2
+    assert stats['reconnected'] == 1
+    assert server.received == ['GET', 'GET', 'GET']
+    pool.close()
+
+
+def test_does_not_resend_post_dropped_on_reused_connection(server):
+    pool = create_pool(server)
+    assert pool.request('GET', '/api/ticker')[0] == 200
+
+    # 注文（POST）は届いた可能性があるので送り直さずに例外にする
+    server.drop = True
+    with pytest.raises(http.client.RemoteDisconnected):
+        pool.request('POST', '/api/exchange/orders', b'{}', {'Content-Type': 'application/json'})
+    assert server.received == ['GET', 'POST']
+    stats = pool.stats()
+    assert stats['created'] == 1
+    assert stats['reconnected'] == 0
+    pool.close()
@@ -0,0 +1,151 @@
+##############################
+# DynamoDBへの書き込みのテスト
+##############################
+
+import json
+import os
+import time
+
+from dynamodb import ResultSink
+
+
+class FakeTable:
+    """
+    update_itemのADDだけを受け付けるテーブル（failingの間は例外を出す）
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.calls = 0
+        self.failing = False
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues):
+        if self.failing:
+            raise ConnectionError('table unavailable')
+        assert UpdateExpression == 'ADD profit :p'
+        key = (Key['algorithm'], Key['interval'])
+        self.items[key] = self.items.get(key, 0) + ExpressionAttributeValues[':p']
+        self.calls += 1
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def create_sink(tmp_path, table, **options):
+    tables = {}
+
+    def table_factory(name):
+        tables[name] = table
+        return table
+
+    sink = ResultSink(table_factory, journal=str(tmp_path / 'journal.jsonl'), **options)
+    return sink, tables
+
+
+def test_batches_same_key_into_one_add(tmp_path):
+    table = FakeTable()
+    sink, tables = create_sink(tmp_path, table, batch_size=3, flush_interval=60)
+    sink.put('results', 'MACD', 60, 100)
+    sink.put('results', 'MACD', 60, -30)
+    sink.put('results', 'RSI', 60, 5)
+
+    # 件数に達したら同じキーを合算して書き込む
+    wait_until(lambda: table.calls == 2)
+    assert table.items == {('MACD', 60): 70, ('RSI', 60): 5}
+    assert list(tables) == ['results']
+    sink.close()
+
+
+def test_flushes_after_interval(tmp_path):
+    table = FakeTable()
+    sink, _ = create_sink(tmp_path, table, batch_size=100, flush_interval=0.2)
+    sink.put('results', 'MACD', 60, 100)
+    assert table.calls == 0
+
+    # 件数に達しなくてもflush_interval秒で書き込む
+    wait_until(lambda: table.calls == 1)
+    assert table.items == {('MACD', 60): 100}
+    sink.close()
+
+
+def test_flushes_pending_on_close(tmp_path):
+    table = FakeTable()
+    sink, _ = create_sink(tmp_path, table, batch_size=100, flush_interval=60)
+    sink.put('results', 'MACD', 60, 100)
+    sink.close()
+    assert table.items == {('MACD', 60): 100}
+
+
+def test_spills_to_journal_and_replays_on_start(tmp_path):
+    table = FakeTable()
+    table.failing = True
+    sink, _ = create_sink(tmp_path, table, batch_size=1, flush_interval=60)
+    sink.put('results', 'MACD', 60, 100)
+    sink.close()
+
+    # 書き込めなかった分はjournalに残る
+    journal = tmp_path / 'journal.jsonl'
+    with open(journal) as f:
+        assert [json.loads(line) for line in f] == [
+            {'table': 'results', 'algorithm': 'MACD', 'interval': 60, 'profit': 100}
+        ]
+
+    # 再起動後は次の取引を待たずに再送する
+    table = FakeTable()
+    sink, _ = create_sink(tmp_path, table, batch_size=1, flush_interval=60)
+    sink.start()
+    wait_until(lambda: table.calls == 1)
+    assert table.items == {('MACD', 60): 100}
+    assert not os.path.exists(journal)
+    sink.close()
+
+
+def test_retries_journal_while_running(tmp_path):
+    table = FakeTable()
+    table.failing = True
+    sink, _ = create_sink(tmp_path, table, batch_size=1, flush_interval=0.2)
+    sink.put('results', 'MACD', 60, 100)
+    wait_until(lambda: sink.counters['failed'] >= 1)
+
+    # 新しい結果がなくてもflush_interval秒ごとに再送する
+    table.failing = False
+    wait_until(lambda: table.calls == 1)
+    assert table.items == {('MACD', 60): 100}
+    assert not os.path.exists(tmp_path / 'journal.jsonl')
+    sink.close()
+
+
+def test_crash_during_replay_does_not_add_twice(tmp_path):
+    journal = tmp_path / 'journal.jsonl'
+    with open(journal, 'w') as f:
+        for algorithm in ['MACD', 'RSI']:
+            f.write(json.dumps({'table': 'results', 'algorithm': algorithm, 'interval': 60, 'profit': 100}) + '\n')
+
+    class CrashingTable(FakeTable):
+        def update_item(self, **kwargs):
+            # 1件書き込んだ後にプロセスが落ちる
+            if self.calls == 1:
+                raise SystemExit('crash')
+            super().update_item(**kwargs)
+
+    table = CrashingTable()
+    sink, _ = create_sink(tmp_path, table)
+    try:
+        sink.flush({})
+    except SystemExit:
+        pass
+
+    # 書き込めた分はjournalから消えている
+    with open(journal) as f:
+        assert [json.loads(line)['algorithm'] for line in f] == ['RSI']
+
+    # 再起動後は残りだけを再送する
+    table = FakeTable()
+    sink, _ = create_sink(tmp_path, table)
+    assert sink.flush({}) == 0
+    assert table.items == {('RSI', 60): 100}
+    assert not os.path.exists(journal)
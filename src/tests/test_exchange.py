@@ -0,0 +1,57 @@
+##############################
+# 模擬サーバーの認証のテスト
+##############################
+
+import json
+
+from coincheck.coincheck import CoinCheck
+from coincheck.signer import Signer
+from exchange import Exchange, Market, random_walk
+
+BALANCE = '/api/accounts/balance'
+
+
+def create_exchange():
+    return Exchange([Market('btc_jpy', random_walk(seed=0), start=3600)], credentials={'key': 'secret'})
+
+
+def test_rejects_bad_signature_and_replayed_nonce():
+    exchange = create_exchange()
+    signer = Signer('key', 'secret')
+    headers = signer.sign('https://127.0.0.1' + BALANCE)
+
+    # 正しい署名は受け付ける（Hostのポートは署名に含めない）
+    assert exchange.authenticate('GET', BALANCE, headers, '127.0.0.1:8080') is None
+    # 同じnonceを送り直すと拒否する
+    assert exchange.authenticate('GET', BALANCE, headers, '127.0.0.1:8080')['success'] is False
+    # 別のシークレットで署名したものは拒否する
+    forged = Signer('key', 'wrong').sign('https://127.0.0.1' + BALANCE)
+    assert exchange.authenticate('GET', BALANCE, forged, '127.0.0.1')['error'] == 'invalid authentication'
+    # 署名したものと別のパスは拒否する
+    other = signer.sign('https://127.0.0.1/api/exchange/orders/opens')
+    assert exchange.authenticate('GET', BALANCE, other, '127.0.0.1') is not None
+    assert exchange.rejected == 3
+
+    # 公開APIは署名を確認しない
+    assert exchange.authenticate('GET', '/api/ticker', {}, '127.0.0.1') is None
+    assert exchange.rejected == 3
+
+
+def test_client_with_wrong_secret_is_rejected():
+    exchange = create_exchange()
+    server = exchange.serve(0)
+    options = {'apiBase': '127.0.0.1', 'port': server.server_address[1], 'secure': False}
+    try:
+        client = CoinCheck('key', 'wrong', options)
+        assert json.loads(client.account.balance())['success'] is False
+        # 公開APIは署名が違っても取得できる
+        assert 'last' in json.loads(client.ticker.all())
+        assert exchange.rejected == 1
+        client.close()
+
+        client = CoinCheck('key', 'secret', options)
+        assert json.loads(client.account.balance())['success'] is True
+        assert exchange.rejected == 1
+        client.close()
+    finally:
+        server.shutdown()
@@ -0,0 +1,97 @@
+##############################
+# インジケーターのテスト
+##############################
+
+import numpy as np
+import pytest
+
+from backtest import ALGORITHMS
+from indicator import IndicatorEngine, signals
+
+# 基本値と異なるパラメータ
+CUSTOM_PARAMS = {
+    'duration': 10,
+    'sigma': 1.5,
+    'fast': 5,
+    'slow': 13,
+    'signal': 4,
+    'rsi_duration': 7,
+    'rsi_buy': 40,
+    'rsi_sell': 60
+}
+
+
+def random_walk(length=3000, seed=0):
+    """
+    シードを固定した価格のランダムウォーク
+
+    :rtype: numpy.ndarray
+    """
+    rng = np.random.default_rng(seed)
+    return 5000000.0 * np.exp(np.cumsum(rng.normal(0, 0.002, length)))
+
+
+@pytest.mark.parametrize('params', [None, CUSTOM_PARAMS], ids=['default', 'custom'])
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+def test_signals_match_engine(algorithm, params):
+    """
+    系列の一括計算（signals）とローソク足ごとの判定（IndicatorEngine.judge）が一致する
+    """
+    close = random_walk()
+    flags = signals(algorithm, close, params)
+
+    engine = IndicatorEngine(params, verbose=False)
+    buy_flgs = []
+    sell_flgs = []
+    for price in close:
+        engine.update(float(price))
+        result = engine.judge(algorithm)
+        buy_flgs.append(bool(result['buy_flg']))
+        sell_flgs.append(bool(result['sell_flg']))
+
+    assert flags['buy_flg'].tolist() == buy_flgs
+    assert flags['sell_flg'].tolist() == sell_flgs
+    # 判定が一度も出ない系列では比較にならない
+    assert any(buy_flgs) and any(sell_flgs)
+
+
+# pandasとの差の許容範囲（相対誤差・絶対誤差）
+# pandasのrolling().std()自体が長い系列で1e-9程度の相対誤差を持つため、相対誤差は1e-8とする
+RTOL = 1e-8
+ATOL = 1e-6
+
+
+@pytest.mark.parametrize('params', [None, CUSTOM_PARAMS], ids=['default', 'custom'])
+def test_engine_matches_pandas(params):
+    """
+    逐次更新したSMA・σ・MACD・シグナル・RSIが、pandasのrolling・ewm（algorithm.pyの計算）と一致する
+    """
+    pd = pytest.importorskip('pandas')
+    close = random_walk(5000, seed=2)
+    engine = IndicatorEngine(params, verbose=False)
+    p = engine.params
+
+    values = {'sma': [], 'std': [], 'macd': [], 'signal': [], 'rsi': []}
+    for price in close:
+        engine.update(float(price))
+        values['sma'].append(engine.bollinger.mean)
+        values['std'].append(engine.bollinger.std)
+        values['macd'].append(engine.macd_state.macd)
+        values['signal'].append(engine.macd_state.signal)
+        values['rsi'].append(engine.rsi_state.value)
+
+    series = pd.Series(close)
+    macd = series.ewm(span=p['fast']).mean() - series.ewm(span=p['slow']).mean()
+    diff = series.diff()
+    up = diff.clip(lower=0).rolling(window=p['rsi_duration']).mean()
+    down = (-diff).clip(lower=0).rolling(window=p['rsi_duration']).mean()
+    expected = {
+        'sma': series.rolling(window=p['duration']).mean(),
+        'std': series.rolling(window=p['duration']).std(),
+        'macd': macd,
+        'signal': macd.ewm(span=p['signal']).mean(),
+        'rsi': 100.0 - 100.0 / (1.0 + up / down)
+    }
+
+    for name, actual in values.items():
+        np.testing.assert_allclose(actual, expected[name].to_numpy(), rtol=RTOL, atol=ATOL, equal_nan=True, err_msg=name)
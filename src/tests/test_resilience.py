@@ -0,0 +1,80 @@
+##############################
+# 流量制限・再試行のテスト
+##############################
+
+import time
+
+import pytest
+
+from coincheck.ratelimit import TokenBucket
+from resilience import Backoff, CircuitBreaker, CircuitOpen, call
+
+
+def test_token_bucket_allows_burst_then_refills():
+    bucket = TokenBucket(20, burst=2)
+    assert bucket.acquire(0)
+    assert bucket.acquire(0)
+    # 空になったら補充されるまで待つ（timeoutより先になる場合は諦める）
+    assert not bucket.acquire(0.01)
+    start = time.monotonic()
+    assert bucket.acquire(1)
+    assert 0.02 <= time.monotonic() - start < 0.5
+
+    # 止まっていた間もburstを超えては溜まらない
+    time.sleep(0.2)
+    assert bucket.acquire(0)
+    assert bucket.acquire(0)
+    assert not bucket.acquire(0)
+
+
+def test_circuit_breaker_transitions():
+    breaker = CircuitBreaker('test', threshold=2, cooldown=0.1)
+    assert breaker.state() == 'closed'
+    breaker.failure()
+    assert breaker.state() == 'closed' and breaker.allow()
+
+    # threshold回続けて失敗したら開く
+    breaker.failure()
+    assert breaker.state() == 'open'
+    assert not breaker.allow()
+    assert 0 < breaker.remaining() <= 0.1
+
+    # cooldown秒後は1回だけ試す
+    time.sleep(0.12)
+    assert breaker.state() == 'half_open'
+    assert breaker.allow()
+    assert breaker.state() == 'open'
+    assert not breaker.allow()
+
+    # 試した呼び出しが失敗したらもう一度開く
+    breaker.failure()
+    assert breaker.state() == 'open'
+    time.sleep(0.12)
+    assert breaker.allow()
+
+    # 成功したら閉じる
+    breaker.success()
+    assert breaker.state() == 'closed'
+    assert breaker.remaining() == 0.0
+    breaker.failure()
+    assert breaker.state() == 'closed'
+
+
+def test_call_retries_until_breaker_opens():
+    breaker = CircuitBreaker('test', threshold=3, cooldown=10)
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        raise ConnectionError('down')
+
+    # 失敗が続くとブレーカーが開き、期限までに試せない場合は呼ばずに諦める
+    with pytest.raises(CircuitOpen):
+        call(fetch, 'test', breaker, Backoff(0.001, 0.001, seed=0), deadline=time.monotonic() + 1)
+    assert len(calls) == 3
+    assert breaker.state() == 'open'
+
+    # attemptsに達したら最後の例外をそのまま出す
+    with pytest.raises(ConnectionError):
+        call(fetch, 'test', None, Backoff(0.001, 0.001, seed=0), attempts=2)
+    assert len(calls) == 5
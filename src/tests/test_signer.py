@@ -0,0 +1,43 @@
+##############################
+# リクエストの署名のテスト
+##############################
+
+import hashlib
+import hmac
+import threading
+
+from coincheck.signer import Signer
+
+
+def test_nonces_strictly_increase_across_threads():
+    signer = Signer('key', 'secret')
+    results = [[] for _ in range(8)]
+    barrier = threading.Barrier(len(results))
+
+    def work(out):
+        barrier.wait()
+        for _ in range(2000):
+            out.append(signer.nonce())
+
+    threads = [threading.Thread(target=work, args=(out,)) for out in results]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # スレッドをまたいで重複せず、各スレッドの中では増え続ける
+    issued = [nonce for out in results for nonce in out]
+    assert len(set(issued)) == len(issued)
+    for out in results:
+        assert all(a < b for a, b in zip(out, out[1:]))
+
+
+def test_signature_matches_hmac_of_nonce_and_url():
+    signer = Signer('key', 'secret')
+    url = 'https://coincheck.com/api/accounts/balance'
+    headers = signer.sign(url)
+    expected = hmac.new(b'secret', (headers['ACCESS-NONCE'] + url).encode('utf-8'), hashlib.sha256).hexdigest()
+    assert headers['ACCESS-KEY'] == 'key'
+    assert headers['ACCESS-SIGNATURE'] == expected
+    # 署名に使う状態を共有していても次の署名に影響しない
+    assert signer.sign(url)['ACCESS-SIGNATURE'] != expected
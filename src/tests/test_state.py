@@ -0,0 +1,81 @@
+##############################
+# 状態の保存と再起動後の突き合わせのテスト
+##############################
+
+import os
+
+from state import StateStore, match_intents
+from transactions import TransactionIndex
+
+
+def fill(index, transaction_id, order_id, side, amount, jpy):
+    sign = 1 if side == 'buy' else -1
+    index.add({'id': transaction_id, 'order_id': order_id, 'pair': 'btc_jpy', 'side': side,
+               'funds': {'btc': sign * amount, 'jpy': -sign * jpy}, 'fee': 0})
+
+
+def test_replays_intents_without_done(tmp_path):
+    path = str(tmp_path / 'state.json')
+    store = StateStore(path)
+    store.save({'order_id': None, 'market_buy_amount': 0})
+    buy = store.intent('buy', amount=10000, last_id=5)
+    store.done(buy, order_id=7)
+    # 完了していない意図がなくなったらjournalは空になる
+    assert store.pending() == []
+
+    sell = store.intent('sell', order_id=7, last_id=6)
+    other = store.intent('buy', amount=10000, last_id=6)
+    store.done(other)
+    # 書き込み途中で落ちた行は無視する
+    with open(store.journal_path, 'a') as f:
+        f.write('{"seq": 9, "act')
+
+    # 再起動後は完了していない意図だけが残り、seqは続きから振る
+    store = StateStore(path)
+    assert [(intent['seq'], intent['action'], intent['order_id']) for intent in store.pending()] == [(sell, 'sell', 7)]
+    assert store.intent('buy', amount=10000) == sell + 1
+    assert store.load()['order_id'] is None
+
+    store.clear()
+    assert store.pending() == []
+    assert os.path.getsize(store.journal_path) == 0
+
+
+def test_matches_pending_buy_after_crash():
+    index = TransactionIndex(None)
+    fill(index, 1, 100, 'buy', 0.002, 10000)
+    fill(index, 2, 101, 'sell', 0.002, 10100)
+    # 意図を書いた後に出した買い注文（2回に分かれて約定）
+    fill(index, 3, 102, 'buy', 0.001, 5000)
+    fill(index, 4, 102, 'buy', 0.001, 5010)
+    pending = [{'seq': 1, 'action': 'buy', 'amount': 10000, 'last_id': 2}]
+
+    matched = match_intents(pending, index, 'btc_jpy', None, 0.002)
+    assert len(matched) == 1
+    assert matched[0]['order_ids'] == [102]
+    assert matched[0]['fills']['count'] == 2
+    assert abs(matched[0]['fills']['jpy'] - 10010) < 1e-9
+
+    # 残高がない場合・ポジションを持っている場合は採用しない
+    assert match_intents(pending, index, 'btc_jpy', None, 0.0) == []
+    assert match_intents(pending, index, 'btc_jpy', 100, 0.002) == []
+
+
+def test_matches_pending_sell_after_crash():
+    index = TransactionIndex(None)
+    fill(index, 1, 100, 'buy', 0.002, 10000)
+    pending = [{'seq': 1, 'action': 'sell', 'order_id': 100, 'last_id': 1}]
+    # 約定がまだない場合は何もしない
+    assert match_intents(pending, index, 'btc_jpy', 100, 0.002) == []
+
+    fill(index, 2, 101, 'sell', 0.002, 10100)
+    matched = match_intents(pending, index, 'btc_jpy', 100, 0.0)
+    assert [match['order_ids'] for match in matched] == [[101]]
+    assert abs(matched[0]['fills']['amount'] - 0.002) < 1e-12
+
+    # ポジションを持っていない場合は採用しない
+    assert match_intents(pending, index, 'btc_jpy', None, 0.0) == []
+    # 買ってから売る前に落ちていた場合は両方を古い順に採用する
+    pending = [{'seq': 1, 'action': 'buy', 'amount': 10000, 'last_id': None},
+               {'seq': 2, 'action': 'sell', 'last_id': 1}]
+    assert [match['intent']['action'] for match in match_intents(pending, index, 'btc_jpy', None, 0.002)] == ['buy', 'sell']
@@ -0,0 +1,80 @@
+##############################
+# WebSocket（リアルタイム配信）のテスト
+##############################
+
+import asyncio
+import json
+
+import pytest
+
+from stream import stream_candles
+
+websockets = pytest.importorskip('websockets')
+
+# 1回目の接続で送る約定（新形式）
+NEW_FORMAT = [
+    ['1700000000', '1', 'btc_jpy', '100', '0.1', 'buy', '1', '2', 'T', 'T'],
+    ['1700000000', '2', 'btc_jpy', '105', '0.2', 'buy', '1', '2', 'T', 'T'],
+    ['1700000000', '3', 'btc_jpy', '95', '0.3', 'sell', '1', '2', 'T', 'T'],
+    ['1700000000', '4', 'btc_jpy', '101', '0.4', 'buy', '1', '2', 'T', 'T']
+]
+# 再接続後に送る約定（旧形式、1件ずつ）
+OLD_FORMAT = [
+    ['5', 'btc_jpy', '200', '1.0', 'buy'],
+    ['6', 'btc_jpy', '210', '1.0', 'buy'],
+    ['7', 'btc_jpy', '190', '1.0', 'sell'],
+    ['8', 'btc_jpy', '201', '1.0', 'buy']
+]
+
+
+async def stream_with_drop():
+    """
+    1回目の接続は約定を送った後に切断し、再接続後は旧形式で約定を送る模擬サーバーでローソク足を作る
+
+    :rtype: tuple 購読の一覧（接続ごと）とローソク足
+    """
+    subscriptions = []
+
+    async def handler(ws):
+        channels = [json.loads(await ws.recv())]
+        subscriptions.append(channels)
+        if len(subscriptions) == 1:
+            await ws.send(json.dumps(NEW_FORMAT))
+            await asyncio.sleep(0.1)
+            # 閉じる手順を踏まずに切断する
+            ws.transport.abort()
+            return
+        for trade in OLD_FORMAT:
+            await ws.send(json.dumps(trade))
+        await ws.wait_closed()
+
+    async with websockets.serve(handler, '127.0.0.1', 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        queue = asyncio.Queue()
+        task = asyncio.create_task(stream_candles(queue, 1, 'btc_jpy', 'ws://127.0.0.1:' + str(port)))
+        candles = []
+        try:
+            while not candles or candles[-1]['close'] != 201.0:
+                candles.append(await asyncio.wait_for(queue.get(), 10))
+        finally:
+            task.cancel()
+        return subscriptions, candles
+
+
+def test_reconnects_and_builds_candles_from_both_formats():
+    subscriptions, candles = asyncio.run(stream_with_drop())
+
+    # 切断後に再接続して購読し直している
+    assert subscriptions == [[{'type': 'subscribe', 'channel': 'btc_jpy-trades'}]] * 2
+
+    traded = [candle for candle in candles if candle['volume'] > 0]
+    assert traded[0]['open'] == 100.0
+    assert traded[-1]['close'] == 201.0
+    assert max(candle['high'] for candle in candles) == 210.0
+    assert min(candle['low'] for candle in candles) == 95.0
+    # 新形式・旧形式の約定の数量がすべて出来高に入っている
+    assert sum(candle['volume'] for candle in candles) == pytest.approx(5.0)
+    # 約定のなかった区間は直前の終値で出来高0のローソク足になる
+    for prev, candle in zip(candles, candles[1:]):
+        if candle['volume'] == 0:
+            assert candle['open'] == candle['close'] == prev['close']
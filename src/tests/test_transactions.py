@@ -0,0 +1,115 @@
+##############################
+# 取引履歴の同期のテスト
+##############################
+
+import json
+
+from transactions import TransactionIndex
+
+
+class FakeOrder:
+    """
+    transactions_paginationだけを受け付ける（starting_afterより新しい取引履歴をlimit件ずつ返す）
+    """
+
+    def __init__(self):
+        self.transactions = []
+        self.calls = []
+
+    def transactions_pagination(self, params):
+        self.calls.append(dict(params))
+        data = [transaction for transaction in self.transactions
+                if 'starting_after' not in params or transaction['id'] > params['starting_after']]
+        return json.dumps({'success': True, 'data': data[:params['limit']]})
+
+
+class FakeClient:
+    def __init__(self):
+        self.order = FakeOrder()
+
+
+def transaction(transaction_id, order_id, side, amount, rate, fee=0.0):
+    """
+    約定1件（受け渡しは買いならBTCが正・円が負、売りなら逆）
+    """
+    sign = 1 if side == 'buy' else -1
+    return {
+        'id': transaction_id,
+        'order_id': order_id,
+        'pair': 'btc_jpy',
+        'side': side,
+        'funds': {'btc': str(sign * amount), 'jpy': str(-sign * amount * rate)},
+        'fee': str(fee)
+    }
+
+
+def test_syncs_only_new_transactions_in_pages(tmp_path):
+    client = FakeClient()
+    client.order.transactions = [transaction(i, 100 + i // 2, 'buy', 0.01, 5000000) for i in range(1, 6)]
+    index = TransactionIndex(client, str(tmp_path / 'transactions.jsonl'), limit=2)
+
+    # limit件ずつ前回の続きから取得する
+    assert [t['id'] for t in index.sync()] == [1, 2, 3, 4, 5]
+    assert [call.get('starting_after') for call in client.order.calls] == [None, 2, 4]
+    assert index.last_id == 5
+
+    # 2回目は新しい分だけ取得する
+    client.order.calls = []
+    client.order.transactions.append(transaction(6, 103, 'sell', 0.01, 5100000))
+    assert [t['id'] for t in index.sync()] == [6]
+    assert client.order.calls[0]['starting_after'] == 5
+    assert index.sync() == []
+
+
+def test_reloads_from_file_without_fetching_again(tmp_path):
+    path = tmp_path / 'transactions.jsonl'
+    client = FakeClient()
+    client.order.transactions = [transaction(i, 100 + i, 'buy', 0.01, 5000000) for i in range(1, 4)]
+    TransactionIndex(client, str(path)).sync()
+    # 書き込み途中で落ちた行
+    with open(path, 'a') as f:
+        f.write('{"id": 4, "order_')
+
+    client = FakeClient()
+    client.order.transactions = [transaction(i, 100 + i, 'buy', 0.01, 5000000) for i in range(1, 5)]
+    index = TransactionIndex(client, str(path))
+    # 壊れた行は切り捨て、その続きから取得する
+    assert index.last_id == 3
+    assert [t['id'] for t in index.sync()] == [4]
+    assert client.order.calls[0]['starting_after'] == 3
+    with open(path) as f:
+        assert [json.loads(line)['id'] for line in f] == [1, 2, 3, 4]
+
+
+def test_aggregates_fills_per_order():
+    client = FakeClient()
+    client.order.transactions = [
+        transaction(1, 10, 'buy', 0.01, 5000000, fee=5),
+        transaction(2, 10, 'buy', 0.02, 5010000, fee=10),
+        transaction(3, 11, 'buy', 0.03, 5020000),
+        transaction(4, 12, 'sell', 0.06, 5100000, fee=30)
+    ]
+    index = TransactionIndex(client)
+    index.sync()
+
+    # 注文ごとの合計は受け渡しの符号付き、idは最初の約定
+    order = index.order(10)
+    assert order['id'] == 1 and order['side'] == 'buy' and order['count'] == 2
+    assert abs(order['amount'] - 0.03) < 1e-12
+    assert abs(order['jpy'] + (50000 + 100200)) < 1e-6
+    assert index.order(12)['amount'] < 0
+    assert index.order(99) is None
+
+    # 複数の注文の合計は絶対値（見つからないIDは無視する）
+    fills = index.fills([10, 11, 99])
+    assert fills['count'] == 3
+    assert abs(fills['amount'] - 0.06) < 1e-12
+    assert abs(fills['jpy'] - (50000 + 100200 + 150600)) < 1e-6
+    assert fills['fee'] == 15
+    assert abs(index.bought_amount([10, 11, 12]) - 0.06) < 1e-12
+    assert index.fills([99])['count'] == 0
+
+    # 意図を書いた時点より後に約定した注文
+    assert index.orders_after(1, 'btc_jpy', 'buy') == [11]
+    assert index.orders_after(None, 'btc_jpy', 'buy') == [10, 11]
+    assert index.orders_after(2, 'btc_jpy', 'sell') == [12]
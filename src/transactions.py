@@ -0,0 +1,169 @@
+##############################
+# 取引履歴の同期
+##############################
+
+import json
+import os
+import threading
+
+from logger import logger
+
+
+class TransactionIndex:
+    """
+    取引履歴を前回の続きから取得し、注文ID・ペアごとに集計して手元に持つ
+
+    取得した取引履歴はファイルに追記し、再起動時はそこから索引を作り直す（過去の分を取り直さない）
+    """
+
+    def __init__(self, client, path=None, limit=100):
+        self.client = client
+        self.path = path
+        self.limit = limit
+        self.lock = threading.Lock()
+        # 注文ID → 約定の合計（idは最初の約定のID、最初の約定の順に並ぶ）
+        self.orders = {}
+        # ペア → 約定の合計
+        self.pairs = {}
+        # 取得済みの最新の取引履歴のID
+        self.last_id = None
+        self.load()
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            offset = 0
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('incomplete line')
+                    if line.strip() != b'':
+                        self.add(json.loads(line))
+                except ValueError:
+                    # 書き込み途中で落ちた行以降は切り捨てて取り直す
+                    f.truncate(offset)
+                    break
+                offset += len(line)
+
+    def add(self, transaction):
+        """
+        取引履歴を1件索引に加える
+        """
+        coin, currency = transaction['pair'].split('_')
+        funds = transaction['funds']
+        amount = float(funds.get(coin, 0))
+        jpy = float(funds.get(currency, 0))
+        fee = float(transaction.get('fee') or 0)
+        for summary in [self.orders.setdefault(transaction['order_id'],
+                                                 self.empty(transaction['pair'], transaction.get('side'), transaction['id'])),
+                        self.pairs.setdefault(transaction['pair'], self.empty(transaction['pair']))]:
+            summary['amount'] += amount
+            summary['jpy'] += jpy
+            summary['fee'] += fee
+            summary['count'] += 1
+        if self.last_id is None or transaction['id'] > self.last_id:
+            self.last_id = transaction['id']
+
+    def empty(self, pair, side=None, transaction_id=None):
+        return {'pair': pair, 'side': side, 'id': transaction_id, 'amount': 0.0, 'jpy': 0.0, 'fee': 0.0, 'count': 0}
+
+    def sync(self):
+        """
+        前回取得したIDより新しい取引履歴をページ単位で取得する
+
+        :rtype: list 新しく取得した取引履歴（古い順）
+        """
+        with self.lock:
+            added = []
+            while True:
+                params = {'limit': self.limit, 'order': 'asc'}
+                if self.last_id is not None:
+                    params['starting_after'] = self.last_id
+                response = json.loads(self.client.order.transactions_pagination(params))
+                if not response.get('success', True):
+                    logger.error('transactions_failed', response=response)
+                    break
+                data = sorted(response['data'], key=lambda transaction: transaction['id'])
+                data = [transaction for transaction in data if self.last_id is None or transaction['id'] > self.last_id]
+                if len(data) == 0:
+                    break
+                self.append(data)
+                for transaction in data:
+                    self.add(transaction)
+                added += data
+                if len(response['data']) < self.limit:
+                    break
+            return added
+
+    def append(self, transactions):
+        """
+        取得した取引履歴をファイルに追記する
+        """
+        if self.path is None:
+            return
+        with open(self.path, 'a') as f:
+            for transaction in transactions:
+                f.write(json.dumps(transaction) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def order(self, order_id):
+        """
+        注文ごとの約定の合計（数量・金額は受け渡しの符号付き、約定がない場合はNone）
+
+        :rtype: object
+        """
+        return self.orders.get(order_id)
+
+    def orders_after(self, transaction_id, pair, side):
+        """
+        最初の約定がtransaction_idより新しい注文のID（古い順、新しい方から遡る）
+
+        :rtype: list
+        """
+        order_ids = []
+        for order_id in reversed(self.orders):
+            summary = self.orders[order_id]
+            if transaction_id is not None and summary['id'] <= transaction_id:
+                break
+            if summary['pair'] == pair and summary['side'] == side:
+                order_ids.append(order_id)
+        return order_ids[::-1]
+
+    def pair(self, pair):
+        """
+        ペアごとの約定の合計
+
+        :rtype: object
+        """
+        return self.pairs.get(pair)
+
+    def fills(self, order_ids):
+        """
+        注文の約定の合計（数量・金額は絶対値）
+
+        :rtype: object
+        """
+        total = {'amount': 0.0, 'jpy': 0.0, 'fee': 0.0, 'count': 0}
+        for order_id in order_ids:
+            summary = self.orders.get(order_id)
+            if summary is not None:
+                total['amount'] += abs(summary['amount'])
+                total['jpy'] += abs(summary['jpy'])
+                total['fee'] += summary['fee']
+                total['count'] += summary['count']
+        return total
+
+    def bought_amount(self, order_ids):
+        """
+        買い注文で約定した数量の合計
+
+        :rtype: float
+        """
+        total = 0.0
+        for order_id in order_ids:
+            summary = self.orders.get(order_id)
+            if summary is not None and summary['amount'] > 0:
+                total += summary['amount']
+        return total